@@ -0,0 +1,237 @@
+"""
+End-to-end benchmark suite, runnable without a webcam, Flask or
+AWS_FLASK_FOLDER.
+
+Frames come from a SyntheticCamera, with or without faces, at every
+requested resolution, and a FaceDetectServer runs in process on the
+loopback interface. Three scenarios are measured:
+
+- transfer: pre-encoded frames sent and ack'ed, no detection. Latency is
+  the time from send to ack.
+- detect: pre-encoded frames decoded and detected in process, no network.
+  Latency is the detect_buffer time.
+- e2e: frames captured, encoded, sent and detected. Latency is the time
+  from capture to detection result.
+
+Results are printed as a JSON list, one object per scenario and frame
+format, with frames/sec, p50/p95/p99 latency in ms, bytes/frame and the
+CPU use of the whole process in percent of one core, so runs can be
+compared across releases.
+
+Usage: python3 -m benchmarks.bench_e2e [--frames FRAMES]
+                                       [--resolutions WxH [WxH ...]]
+                                       [--faces FACES [FACES ...]]
+                                       [--scenarios SCENARIO [...]]
+                                       [--window WINDOW] [--fps FPS]
+                                       [--output OUTPUT]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import threading
+import time
+
+import numpy as np
+
+import client.client as cl
+import common.wireformat as wf
+from benchmarks.synthetic import SyntheticCamera
+from server.asyncserver import FaceDetectServer
+from server.pipeline import detect_buffer
+
+SCENARIOS = ('transfer', 'detect', 'e2e')
+
+
+class TimedServer(FaceDetectServer):
+    """FaceDetectServer recording when every frame was processed."""
+
+    def __init__(self, *args, **kwargs):
+        """Init TimedServer like FaceDetectServer."""
+        super().__init__(*args, **kwargs)
+        self.done = {}
+
+    def process_frame(self, session, frame, payload):
+        """Process one frame and record the time it completed."""
+        result = super().process_frame(session, frame, payload)
+        self.done[(session.session_id, frame)] = time.perf_counter()
+        return result
+
+
+def start_loopback(detect):
+    """Run a TimedServer on localhost in a background thread.
+
+    Args:
+        detect: A boolean, False to only receive and ack frames.
+
+    Returns:
+        (server, loop, port): The server, its event loop and its port.
+    """
+    server = TimedServer('', address='127.0.0.1', port=0, detect=detect,
+                         save=False)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    bound = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        bound['addr'] = loop.run_until_complete(server.start())
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return (server, loop, bound['addr'][1])
+
+def send_timed(client_socket, buffers, frame_nbr, window):
+    """Send frames with a sliding window and time every frame.
+
+    Args:
+        client_socket: A connected client socket.
+        buffers: An iterable of encoded frames, possibly lazy.
+        frame_nbr: An int representing the number of frames.
+        window: An int representing the frames in flight.
+
+    Returns:
+        (sent, acked, sizes): Lists of the send time, ack time and payload
+        size of every frame.
+    """
+    reader = wf.MessageReader(client_socket)
+    cl.send_session_header(client_socket, frame_nbr)
+    sent, acked, sizes = [], [], []
+
+    def wait_ack():
+        last = cl.wait_cumulative_ack(reader)
+        now = time.perf_counter()
+        acked.extend([now] * (last + 1 - len(acked)))
+
+    for frame, buf in enumerate(buffers):
+        while frame - len(acked) >= window:
+            wait_ack()
+        sent.append(time.perf_counter())
+        wf.send_message(client_socket, wf.MSG_FRAME, frame, buf)
+        sizes.append(len(buf))
+    while len(acked) < len(sent):
+        wait_ack()
+    return (sent, acked, sizes)
+
+def run_session(server, port, buffers, frame_nbr, window):
+    """Send one session to the loopback server and wait for its end.
+
+    Returns:
+        (sent, acked, sizes, session_id): See send_timed.
+    """
+    expected = server.served + 1
+    client_socket = cl.init_client_socket('127.0.0.1', port)
+    sent, acked, sizes = send_timed(client_socket, buffers, frame_nbr,
+                                    window)
+    client_socket.close()
+    while server.served < expected:
+        time.sleep(0.001)
+    return (sent, acked, sizes, server.completed[-1].session_id)
+
+def summarize(scenario, camera, latencies, sizes, elapsed, cpu):
+    """Build the result object of one scenario run."""
+    latencies = np.array(latencies) * 1000
+    return {'scenario': scenario,
+            'resolution': "%dx%d" % (camera.width, camera.height),
+            'faces': camera.nfaces, 'frames': len(latencies),
+            'fps': round(len(latencies) / elapsed, 2),
+            'latency_ms': {name: round(float(np.percentile(latencies, q)), 3)
+                           for name, q in (('p50', 50), ('p95', 95),
+                                           ('p99', 99))},
+            'bytes_per_frame': round(float(np.mean(sizes)), 1),
+            'cpu_percent': round(100 * cpu / elapsed, 1)}
+
+def scenario_transfer(camera, window, servers):
+    """Send pre-encoded frames to a receive-only server."""
+    server, port = servers['transfer']
+    buffers = camera.capture_buffers()
+    start, cpu = time.perf_counter(), time.process_time()
+    sent, acked, sizes, _ = run_session(server, port, buffers, len(buffers),
+                                        window)
+    elapsed = time.perf_counter() - start
+    latencies = [ack - send for send, ack in zip(sent, acked)]
+    return summarize('transfer', camera, latencies, sizes, elapsed,
+                     time.process_time() - cpu)
+
+def scenario_detect(camera, _window, _servers):
+    """Decode and detect pre-encoded frames in process."""
+    buffers = camera.capture_buffers()
+    latencies = []
+    start, cpu = time.perf_counter(), time.process_time()
+    for frame, buf in enumerate(buffers):
+        begin = time.perf_counter()
+        detect_buffer((frame, buf))
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+    sizes = [len(buf) for buf in buffers]
+    return summarize('detect', camera, latencies, sizes, elapsed,
+                     time.process_time() - cpu)
+
+def scenario_e2e(camera, window, servers):
+    """Capture, encode, send and detect frames."""
+    server, port = servers['e2e']
+    camera.taken = []
+    start, cpu = time.perf_counter(), time.process_time()
+    _, _, sizes, session_id = run_session(server, port, camera.stream(),
+                                          camera.frames, window)
+    done = [server.done[(session_id, frame)] for frame in range(len(sizes))]
+    elapsed = max(done) - start
+    latencies = [end - taken for taken, end in zip(camera.taken, done)]
+    return summarize('e2e', camera, latencies, sizes, elapsed,
+                     time.process_time() - cpu)
+
+def main():
+    """Main function for the end-to-end benchmark suite."""
+    parser = argparse.ArgumentParser(description="End-to-end bench suite.")
+    parser.add_argument("-f", "--frames", help="Frames per run.",
+                        nargs='?', default=60, type=int)
+    parser.add_argument("-r", "--resolutions", help="Frame sizes, WxH.",
+                        nargs='+', default=['640x480', '1280x720'])
+    parser.add_argument("-F", "--faces", help="Faces per frame, 0 for none.",
+                        nargs='+', default=[0, 1], type=int)
+    parser.add_argument("-s", "--scenarios", help="Scenarios to run.",
+                        nargs='+', default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument("-w", "--window", help="Frames in flight.",
+                        nargs='?', default=8, type=int)
+    parser.add_argument("-p", "--fps", help="Camera rate for e2e, 0 for "
+                        "as fast as possible.",
+                        nargs='?', default=0.0, type=float)
+    parser.add_argument("-o", "--output", help="JSON file instead of stdout.",
+                        nargs='?', default=None)
+    args = vars(parser.parse_args())
+
+    runners = {'transfer': scenario_transfer, 'detect': scenario_detect,
+               'e2e': scenario_e2e}
+    results, servers, loops = [], {}, []
+    # Sessions print on stdout, keep it for the JSON output.
+    with contextlib.redirect_stdout(io.StringIO()):
+        for scenario, detect in (('transfer', False), ('e2e', True)):
+            if scenario in args['scenarios']:
+                server, loop, port = start_loopback(detect)
+                servers[scenario] = (server, port)
+                loops.append((loop, server))
+        for resolution in args['resolutions']:
+            width, height = (int(side) for side in resolution.split('x'))
+            for nfaces in args['faces']:
+                camera = SyntheticCamera(args['frames'], width, height,
+                                         nfaces, args['fps'] or None)
+                for scenario in args['scenarios']:
+                    results.append(runners[scenario](camera, args['window'],
+                                                     servers))
+        for loop, server in loops:
+            loop.call_soon_threadsafe(server.close)
+
+    output = json.dumps(results, indent=1)
+    if args['output']:
+        with open(args['output'], 'w') as filedesc:
+            filedesc.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
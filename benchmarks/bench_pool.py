@@ -0,0 +1,66 @@
+"""
+Benchmark of the DetectionPool scaling with the number of worker processes.
+
+Runs the detection on a synthetic frame set with 1, 2, 4... workers up to
+the number of cores, and reports frames/sec, the speedup over one worker
+and the throughput of every worker.
+
+Usage: python3 -m benchmarks.bench_pool [--frames FRAMES] [--width WIDTH]
+                                        [--workers WORKERS [WORKERS ...]]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.synthetic import make_frames
+from engine.detectpool import DetectionPool
+
+
+def default_workers():
+    """Return 1, 2, 4... up to the number of cores, always included."""
+    workers, count = [], 1
+    while count < os.cpu_count():
+        workers.append(count)
+        count *= 2
+    workers.append(os.cpu_count())
+    return workers
+
+def main():
+    """Main function for the pool benchmark."""
+    parser = argparse.ArgumentParser(description="DetectionPool bench.")
+    parser.add_argument("-f", "--frames", help="Frames to detect.",
+                        nargs='?', default=64, type=int)
+    parser.add_argument("-W", "--width", help="Frame width in pixels.",
+                        nargs='?', default=320, type=int)
+    parser.add_argument("-w", "--workers", help="Worker counts to run.",
+                        nargs='+', default=default_workers(), type=int)
+    args = vars(parser.parse_args())
+
+    tmp = tempfile.mkdtemp()
+    try:
+        frame_locs = make_frames(tmp, args['frames'], args['width'], True)
+        print("%8s %10s %12s %8s  %s" % ("workers", "seconds", "frames/sec",
+                                         "speedup", "per worker frames/sec"))
+        base = None
+        for workers in args['workers']:
+            pool = DetectionPool(workers)
+            start = time.perf_counter()
+            for _ in pool.detect_all(frame_locs):
+                pass
+            elapsed = time.perf_counter() - start
+            pool.close()
+            fps = len(frame_locs) / elapsed
+            base = base or fps
+            per_worker = sorted(pool.throughput().values(), reverse=True)
+            print("%8d %10.3f %12.1f %8.2f  %s" %
+                  (workers, elapsed, fps, fps / base,
+                   " ".join("%.1f" % value for value in per_worker)))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark of reduced size decoding against full resolution decoding.
+
+Encodes synthetic frames at 720p, 1080p and 4K, then measures for every
+reduction the decode time, the decode plus detection time and the accuracy
+of the faces mapped back to full resolution, as the mean IoU against full
+resolution detection, with and without local refinement.
+
+Usage: python3 -m benchmarks.bench_reduced [--repeat REPEAT]
+                                           [--reduce REDUCE [...]]
+"""
+
+import argparse
+import time
+
+import cv2
+
+from benchmarks.bench_tracker import match_iou
+from benchmarks.synthetic import make_image
+from engine.facedetect import REDUCED_FLAGS, FaceDetect, decode
+
+RESOLUTIONS = (("720p", 1280, 720), ("1080p", 1920, 1080),
+               ("4K", 3840, 2160))
+
+
+def make_jpeg(width, height):
+    """Return a JPEG encoded synthetic frame with three faces."""
+    radius = height // 12
+    faces = [(width // 4, height // 2), (width // 2, height // 3),
+             (3 * width // 4, 2 * height // 3)]
+    image = make_image(width, height, [(center, radius) for center in faces])
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+def timed(func, repeat):
+    """Return the last result of func and its mean run time in ms."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) * 1000 / repeat
+
+def main():
+    """Main function for the reduced decoding benchmark."""
+    parser = argparse.ArgumentParser(description="Reduced decoding bench.")
+    parser.add_argument("-n", "--repeat", help="Runs per measure.",
+                        nargs='?', default=5, type=int)
+    parser.add_argument("-r", "--reduce", help="Reductions to measure.",
+                        nargs='+', default=[2, 4], type=int,
+                        choices=sorted(REDUCED_FLAGS))
+    args = vars(parser.parse_args())
+    repeat = args['repeat']
+
+    print("%6s %7s %10s %10s %8s %10s %10s %10s" %
+          ("res", "reduce", "decode ms", "total ms", "speedup",
+           "IoU", "refine ms", "refine IoU"))
+    for name, width, height in RESOLUTIONS:
+        buf = make_jpeg(width, height)
+        reference, full_ms = None, None
+        for reduce in [1] + args['reduce']:
+            _, decode_ms = timed(lambda: decode(buf, reduce), repeat)
+            faces, total_ms = timed(
+                lambda: FaceDetect(buf, reduce).detect(), repeat)
+            if reference is None:
+                reference, full_ms = faces, total_ms
+            refined, refine_ms = timed(
+                lambda: FaceDetect(buf, reduce).detect(refine=True), repeat)
+            print("%6s %7d %10.2f %10.2f %8.2f %10.3f %10.2f %10.3f" %
+                  (name, reduce, decode_ms, total_ms, full_ms / total_ms,
+                   match_iou(reference, faces), refine_ms,
+                   match_iou(reference, refined)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark of the RoiDetector against full-frame detection on every frame.
+
+Runs both on the same high resolution sequence, synthetic or from a video
+file, and reports the per-frame latency, the share of full-frame scans and
+the accuracy against full detection.
+
+Usage: python3 -m benchmarks.bench_roi [--frames FRAMES] [--width WIDTH]
+                                       [--video VIDEO]
+                                       [--full-every FULL_EVERY [...]]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.bench_tracker import match_iou, read_video
+from benchmarks.synthetic import moving_faces
+from engine.cascade import get_cascade
+from engine.facedetect import HAAR_CASC
+from engine.roisearch import RoiDetector
+
+
+def main():
+    """Main function for the region of interest benchmark."""
+    parser = argparse.ArgumentParser(description="RoiDetector bench.")
+    parser.add_argument("-f", "--frames", help="Frames in the sequence.",
+                        nargs='?', default=60, type=int)
+    parser.add_argument("-W", "--width", help="Synthetic frame width.",
+                        nargs='?', default=1920, type=int)
+    parser.add_argument("-v", "--video", help="Video file instead of the "
+                        "synthetic sequence.", nargs='?', default=None)
+    parser.add_argument("-F", "--full-every", help="Full scan intervals.",
+                        nargs='+', default=[10, 30], type=int)
+    args = vars(parser.parse_args())
+
+    if args['video']:
+        sequence = read_video(args['video'], args['frames'])
+    else:
+        width = args['width']
+        sequence = moving_faces(args['frames'], width, width * 9 // 16,
+                                nfaces=2, radius=width // 24)
+
+    cascade = get_cascade(HAAR_CASC)
+    start = time.perf_counter()
+    reference = [cascade.detectMultiScale(image, 1.1, 5)
+                 for image in sequence]
+    full_ms = (time.perf_counter() - start) * 1000 / len(sequence)
+
+    print("%10s %10s %8s %11s %10s" % ("mode", "ms/frame", "speedup",
+                                       "full scans", "mean IoU"))
+    print("%10s %10.2f %8.2f %11d %10.3f" %
+          ("full", full_ms, 1.0, len(sequence), 1.0))
+    for full_every in args['full_every']:
+        detector = RoiDetector(full_every)
+        start = time.perf_counter()
+        found = [detector.detect(image) for image in sequence]
+        roi_ms = (time.perf_counter() - start) * 1000 / len(sequence)
+        ious = [match_iou(ref, boxes) for ref, boxes in zip(reference, found)]
+        print("%10s %10.2f %8.2f %11d %10.3f" %
+              ("roi/%d" % full_every, roi_ms, full_ms / roi_ms,
+               detector.full_scans, np.mean(ious)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark of the persistent FaceDetectServer with concurrent clients.
+
+Starts a FaceDetectServer on localhost, then runs 1, 8 and 64 simulated
+clients sending the same set of frames with send_frames_windowed, and
+reports the aggregate frames/sec for each client count.
+
+Usage: python3 -m benchmarks.bench_server [--frames FRAMES] [--size SIZE]
+                                          [--window WINDOW] [--detect]
+                                          [--clients CLIENTS [CLIENTS ...]]
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import client.client as cl
+from benchmarks.synthetic import make_frames
+from server.asyncserver import FaceDetectServer
+
+
+def start_server(img_loc, detect):
+    """Run a FaceDetectServer on localhost in a background thread.
+
+    Args:
+        img_loc: A string representing the root folder for session frames.
+        detect: A boolean, False to only receive and ack frames.
+
+    Returns:
+        (server, loop, port): The server, its event loop and its port.
+    """
+    server = FaceDetectServer(img_loc, address='127.0.0.1', port=0,
+                              detect=detect)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    bound = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        bound['addr'] = loop.run_until_complete(server.start())
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return (server, loop, bound['addr'][1])
+
+def run_clients(server, port, clients, frame_locs, window):
+    """Send frame_locs from several concurrent clients.
+
+    Returns once the server has processed every session, not only once
+    every frame has been ack'ed.
+
+    Args:
+        server: The FaceDetectServer receiving the sessions.
+        port: An int representing the server port.
+        clients: An int representing the number of concurrent clients.
+        frame_locs: A list of strings representing the frame locations.
+        window: An int representing the frames in flight per client.
+
+    Returns:
+        A float representing the wall clock time in seconds.
+    """
+    def run():
+        client_socket = cl.init_client_socket('127.0.0.1', port)
+        cl.send_frames_windowed(client_socket, frame_locs, window=window)
+        client_socket.close()
+
+    threads = [threading.Thread(target=run) for _ in range(clients)]
+    expected = server.served + clients
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    while server.served < expected:
+        time.sleep(0.001)
+    return time.perf_counter() - start
+
+def main():
+    """Main function for the server benchmark."""
+    parser = argparse.ArgumentParser(description="FaceDetectServer bench.")
+    parser.add_argument("-f", "--frames", help="Frames per client.",
+                        nargs='?', default=100, type=int)
+    parser.add_argument("-s", "--size",
+                        help="Frame size in bytes, or width with --detect.",
+                        nargs='?', default=50000, type=int)
+    parser.add_argument("-w", "--window", help="Frames in flight.",
+                        nargs='?', default=8, type=int)
+    parser.add_argument("-d", "--detect", action='store_true',
+                        help="Run the face detection on every frame.")
+    parser.add_argument("-c", "--clients", help="Client counts to run.",
+                        nargs='+', default=[1, 8, 64], type=int)
+    args = vars(parser.parse_args())
+
+    tmp = tempfile.mkdtemp()
+    try:
+        frame_locs = make_frames(tmp, args['frames'], args['size'],
+                                 args['detect'])
+        server, loop, port = start_server(os.path.join(tmp, 'out'),
+                                          args['detect'])
+        print("%8s %10s %12s" % ("clients", "seconds", "frames/sec"))
+        for clients in args['clients']:
+            elapsed = run_clients(server, port, clients, frame_locs,
+                                  args['window'])
+            print("%8d %10.3f %12.1f" %
+                  (clients, elapsed, clients * args['frames'] / elapsed))
+        loop.call_soon_threadsafe(server.close)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark of tiled parallel detection against one detectMultiScale call.
+
+Builds one very large synthetic still, 8K by default, with a grid of faces
+and reports the wall-clock detection time of FaceDetect.detect and of
+FaceDetect.detect_tiled for several thread counts, along with the accuracy
+of the merged tiled boxes against the single call.
+
+Usage: python3 -m benchmarks.bench_tiled [--width WIDTH] [--tile TILE]
+                                         [--max-face MAX_FACE]
+                                         [--workers WORKERS [...]]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+
+from benchmarks.bench_tracker import match_iou
+from benchmarks.synthetic import make_image
+from engine.facedetect import FaceDetect
+
+
+def make_still(path, width, radius):
+    """Write a width x 9/16 width still with a grid of faces to path."""
+    height = width * 9 // 16
+    step = radius * 6
+    faces = [((x, y), radius)
+             for y in range(step // 2, height, step)
+             for x in range(step // 2, width, step)]
+    cv2.imwrite(path, make_image(width, height, faces))
+    return len(faces)
+
+def main():
+    """Main function for the tiled detection benchmark."""
+    parser = argparse.ArgumentParser(description="Tiled detection bench.")
+    parser.add_argument("-W", "--width", help="Still width.",
+                        nargs='?', default=7680, type=int)
+    parser.add_argument("-t", "--tile", help="Tile side.",
+                        nargs='?', default=1024, type=int)
+    parser.add_argument("-M", "--max-face", help="Largest face searched.",
+                        nargs='?', default=256, type=int)
+    parser.add_argument("-w", "--workers", help="Thread counts.",
+                        nargs='+', default=[1, 2, 4, os.cpu_count()],
+                        type=int)
+    args = vars(parser.parse_args())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'still.jpg')
+        drawn = make_still(path, args['width'], args['max_face'] // 4)
+        detection = FaceDetect(path)
+        start = time.perf_counter()
+        reference = detection.detect()
+        full_s = time.perf_counter() - start
+
+        print("%10s %10s %8s %8s %10s" % ("mode", "seconds", "speedup",
+                                          "faces", "mean IoU"))
+        print("%10s %10.2f %8.2f %8d %10.3f" %
+              ("single", full_s, 1.0, len(reference), 1.0))
+        for workers in sorted(set(args['workers'])):
+            detection.detect_tiled(args['tile'], args['max_face'], workers)
+            start = time.perf_counter()
+            faces = detection.detect_tiled(args['tile'], args['max_face'],
+                                           workers)
+            tiled_s = time.perf_counter() - start
+            print("%10s %10.2f %8.2f %8d %10.3f" %
+                  ("tiled/%d" % workers, tiled_s, full_s / tiled_s,
+                   len(faces), match_iou(reference, faces)))
+        print("\n%d faces drawn, %d cores." % (drawn, os.cpu_count()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark of the TrackingDetector against full detection on every frame.
+
+Runs both on the same sequence, a synthetic one with moving faces or a
+video file, and reports the per-frame detection cost and the accuracy
+drift of tracking, as the mean IoU between tracked and fully detected
+boxes and the number of frames where face counts differ.
+
+Usage: python3 -m benchmarks.bench_tracker [--frames FRAMES] [--video VIDEO]
+                                           [--interval INTERVAL [...]]
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import moving_faces
+from engine.cascade import get_cascade
+from engine.facedetect import HAAR_CASC
+from engine.tracker import TrackingDetector
+
+
+def box_iou(box_a, box_b):
+    """Return the intersection over union of two (x, y, w, h) boxes."""
+    ax, ay, aw, ah = box_a
+    bx, by, bw, bh = box_b
+    inter_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    inter_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = inter_w * inter_h
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+def match_iou(reference, boxes):
+    """Return the mean best IoU of every reference box among boxes."""
+    if len(reference) == 0:
+        return 1.0 if len(boxes) == 0 else 0.0
+    return float(np.mean([max([box_iou(ref, box) for box in boxes] or [0.0])
+                          for ref in reference]))
+
+def read_video(path, frames):
+    """Read up to frames grayscale frames from a video file."""
+    cap = cv2.VideoCapture(path)
+    sequence = []
+    while len(sequence) < frames:
+        ok, frm = cap.read()
+        if not ok:
+            break
+        sequence.append(cv2.cvtColor(frm, cv2.COLOR_BGR2GRAY))
+    cap.release()
+    return sequence
+
+def main():
+    """Main function for the tracker benchmark."""
+    parser = argparse.ArgumentParser(description="TrackingDetector bench.")
+    parser.add_argument("-f", "--frames", help="Frames in the sequence.",
+                        nargs='?', default=100, type=int)
+    parser.add_argument("-v", "--video", help="Video file instead of the "
+                        "synthetic sequence.", nargs='?', default=None)
+    parser.add_argument("-i", "--interval", help="Keyframe intervals.",
+                        nargs='+', default=[5, 10, 30], type=int)
+    args = vars(parser.parse_args())
+
+    if args['video']:
+        sequence = read_video(args['video'], args['frames'])
+    else:
+        sequence = moving_faces(args['frames'], nfaces=2)
+
+    cascade = get_cascade(HAAR_CASC)
+    start = time.perf_counter()
+    reference = [cascade.detectMultiScale(image, 1.1, 5)
+                 for image in sequence]
+    full_ms = (time.perf_counter() - start) * 1000 / len(sequence)
+
+    print("%10s %10s %8s %10s %10s %12s" % ("mode", "ms/frame", "speedup",
+                                            "keyframes", "mean IoU",
+                                            "count diffs"))
+    print("%10s %10.2f %8.2f %10d %10.3f %12d" %
+          ("full", full_ms, 1.0, len(sequence), 1.0, 0))
+    for interval in args['interval']:
+        tracker = TrackingDetector(interval)
+        start = time.perf_counter()
+        tracked = [tracker.detect(image) for image in sequence]
+        track_ms = (time.perf_counter() - start) * 1000 / len(sequence)
+        ious = [match_iou(ref, boxes)
+                for ref, boxes in zip(reference, tracked)]
+        diffs = sum(len(ref) != len(boxes)
+                    for ref, boxes in zip(reference, tracked))
+        print("%10s %10.2f %8.2f %10d %10.3f %12d" %
+              ("track/%d" % interval, track_ms, full_ms / track_ms,
+               tracker.keyframes, np.mean(ious), diffs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Microbenchmark of the file transfer functions over a loopback TCP socket.
+
+Compares the original readline(1024)/send() sender and recv(1024) receiver
+with common.transfer, socket.sendfile on the sending side and recv_into a
+reusable buffer on the receiving side, and reports MB/s.
+
+Usage: python3 -m benchmarks.bench_transfer [--size SIZE] [--rounds ROUNDS]
+"""
+
+import argparse
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import common.transfer as tr
+
+
+def legacy_send_file(sock, path):
+    """Sender as originally implemented in client.send_frame."""
+    with open(path, 'rb') as filedesc:
+        buf = filedesc.readline(1024)
+        while buf:
+            sock.send(buf)
+            buf = filedesc.readline(1024)
+
+def legacy_recv_file(sock, path, size):
+    """Receiver as originally implemented in receive_frame."""
+    img_size = 0
+    with open(path, 'wb') as img:
+        while img_size < size:
+            remain = size - img_size
+            if remain < 1024:
+                data = sock.recv(remain)
+            else:
+                data = sock.recv(1024)
+            img.write(data)
+            img_size += len(data)
+
+def run(send, recv, src, dst, size, rounds):
+    """Transfer src to dst rounds times over loopback.
+
+    Args:
+        send: A callable (sock, path) sending one file.
+        recv: A callable (sock, path, size) receiving one file.
+        src: A string representing the file to send.
+        dst: A string representing the file to write.
+        size: An int representing the file size in bytes.
+        rounds: An int representing the number of transfers.
+
+    Returns:
+        A float representing the throughput in MB/s.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    sender = socket.create_connection(listener.getsockname())
+    receiver, _ = listener.accept()
+
+    def send_all():
+        for _ in range(rounds):
+            send(sender, src)
+
+    thread = threading.Thread(target=send_all)
+    start = time.perf_counter()
+    thread.start()
+    for _ in range(rounds):
+        recv(receiver, dst, size)
+    thread.join()
+    elapsed = time.perf_counter() - start
+    for sock in (sender, receiver, listener):
+        sock.close()
+    return size * rounds / elapsed / 1e6
+
+def main():
+    """Main function for the transfer benchmark."""
+    parser = argparse.ArgumentParser(description="Transfer microbenchmark.")
+    parser.add_argument("-s", "--size", help="File size in bytes.",
+                        nargs='?', default=2000000, type=int)
+    parser.add_argument("-r", "--rounds", help="Transfers per run.",
+                        nargs='?', default=50, type=int)
+    args = vars(parser.parse_args())
+
+    size = args['size']
+    tmp = tempfile.mkdtemp()
+    src = os.path.join(tmp, 'src.jpg')
+    dst = os.path.join(tmp, 'dst.jpg')
+    with open(src, 'wb') as filedesc:
+        filedesc.write(os.urandom(size))
+
+    buf = tr.new_buffer()
+    runs = (
+        ("readline/send + recv(1024)", legacy_send_file, legacy_recv_file),
+        ("sendfile + recv_into", tr.send_file,
+         lambda sock, path, size: tr.recv_file(sock, path, size, buf)),
+    )
+    for name, send, recv in runs:
+        mbps = run(send, recv, src, dst, size, args['rounds'])
+        print("%-28s %10.1f MB/s" % (name, mbps))
+    os.remove(src)
+    os.remove(dst)
+    os.rmdir(tmp)
+
+
+if __name__ == '__main__':
+    main()
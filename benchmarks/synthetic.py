@@ -0,0 +1,175 @@
+"""
+Module supporting synthetic frames for the benchmarks, so they run without a
+webcam or recorded footage.
+
+function draw_face: Draw a cartoon face the Haar cascade detects.
+
+function make_image: Build one grayscale frame with faces on a textured
+background.
+
+function make_frames: Write frame files for the benchmarks sending frames
+from disk.
+
+function moving_faces: Build a sequence of frames with faces drifting
+across the image, as a webcam feed would show.
+
+class SyntheticCamera: client.camera.Camera taking its snapshots from
+generated frames instead of a webcam.
+"""
+
+import os
+import time
+
+import cv2
+import numpy as np
+
+from client.camera import Camera
+
+
+def draw_face(img, center, radius):
+    """Draw a cartoon face the frontal face Haar cascade detects.
+
+    Args:
+        img: A grayscale numpy array to draw on.
+        center: A (x, y) tuple representing the face center.
+        radius: An int representing the face half width in pixels.
+
+    Returns:
+        None
+    """
+    cx, cy = center
+    r = radius
+    cv2.ellipse(img, (cx, cy), (r, int(r * 1.3)), 0, 0, 360, 200, -1)
+    for side in (-1, 1):
+        cv2.ellipse(img, (cx + side * r // 3, cy - r // 4), (r // 5, r // 9),
+                    0, 0, 360, 40, -1)
+        cv2.rectangle(img, (cx + side * r // 6, cy - r // 2),
+                      (cx + side * r // 2, cy - r // 2 + max(2, r // 10)),
+                      60, -1)
+    cv2.line(img, (cx, cy - r // 6), (cx, cy + r // 4), 150, max(1, r // 10))
+    cv2.ellipse(img, (cx, cy + r // 2), (r // 3, r // 10), 0, 0, 360, 70, -1)
+
+def make_image(width, height, faces=(), seed=0):
+    """Build one grayscale frame with faces on a textured background.
+
+    Args:
+        width: An int representing the frame width.
+        height: An int representing the frame height.
+        faces: An optional list of ((x, y), radius) tuples.
+        seed: An optional int seeding the background noise.
+
+    Returns:
+        A numpy array of uint8, height x width.
+    """
+    rng = np.random.RandomState(seed)
+    img = np.full((height, width), 90, np.uint8)
+    img += rng.randint(0, 20, (height, width)).astype(np.uint8)
+    for center, radius in faces:
+        draw_face(img, center, radius)
+    return cv2.GaussianBlur(img, (5, 5), 0)
+
+def make_frames(path, frames, size, detect):
+    """Write frame files for the benchmarks sending frames from disk.
+
+    Frames are random JPEG images when detection is enabled, random bytes
+    of the requested size otherwise.
+
+    Args:
+        path: A string representing the folder to write frames in.
+        frames: An int representing the number of frames.
+        size: An int representing the frame size in bytes, or the image
+        width in pixels when detect is True.
+        detect: A boolean, True to generate decodable JPEG frames.
+
+    Returns:
+        A list of strings representing the frame locations.
+    """
+    frame_locs = []
+    for frame in range(frames):
+        frame_loc = os.path.join(path, "frame%d.jpg" % frame)
+        if detect:
+            img = np.random.randint(0, 255, (size * 3 // 4, size),
+                                    dtype=np.uint8)
+            cv2.imwrite(frame_loc, img)
+        else:
+            with open(frame_loc, 'wb') as filedesc:
+                filedesc.write(os.urandom(size))
+        frame_locs.append(frame_loc)
+    return frame_locs
+
+def moving_faces(frames, width=640, height=480, nfaces=1, radius=40,
+                 speed=4):
+    """Build a sequence of frames with faces drifting across the image.
+
+    Args:
+        frames: An int representing the number of frames.
+        width: An optional int representing the frame width.
+        height: An optional int representing the frame height.
+        nfaces: An optional int representing the number of faces.
+        radius: An optional int representing the face half width.
+        speed: An optional int representing the motion in pixels per frame.
+
+    Returns:
+        A list of grayscale numpy arrays.
+    """
+    sequence = []
+    for frame in range(frames):
+        faces = []
+        for face in range(nfaces):
+            span_x = max(1, width - 4 * radius)
+            x = 2 * radius + (face * span_x // nfaces + frame * speed) % span_x
+            y = height // 2 + int(radius * np.sin(frame / 10.0 + face))
+            faces.append(((x, y), radius))
+        sequence.append(make_image(width, height, faces, seed=frame))
+    return sequence
+
+
+class SyntheticCamera(Camera):
+    """Camera taking its snapshots from generated frames.
+
+    Everything built on Camera.snapshots, such as stream or
+    capture_buffers, runs unchanged without a webcam. A short loop of
+    distinct BGR frames is rendered once and replayed, so generating frames
+    costs nothing during a measure. When fps is set, snapshots are paced
+    as a real camera would deliver them.
+
+    Attributes:
+        width: An int representing the frame width.
+        height: An int representing the frame height.
+        nfaces: An int representing the number of faces per frame, 0 for
+        frames without faces.
+        fps: A float representing the capture rate, None for no pacing.
+        taken: A list of the perf_counter time every snapshot was taken.
+    """
+
+    def __init__(self, frames=200, width=640, height=480, nfaces=1,
+                 fps=None, loop=10):
+        """Init SyntheticCamera and render its frame loop."""
+        super().__init__(frames)
+        self.width = width
+        self.height = height
+        self.nfaces = nfaces
+        self.fps = fps
+        self.taken = []
+        radius = max(10, height // 12)
+        self._loop = [cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+                      for img in moving_faces(loop, width, height, nfaces,
+                                              radius, speed=radius // 4)]
+
+    def snapshots(self):
+        """Yield the generated frames, at fps if set.
+
+        Args:
+            None
+
+        Returns:
+            A generator of BGR numpy arrays, one per snapshot.
+        """
+        start = time.perf_counter()
+        for frame in range(self.frames):
+            if self.fps:
+                delay = start + frame / self.fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            self.taken.append(time.perf_counter())
+            yield self._loop[frame % len(self._loop)]
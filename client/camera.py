@@ -1,13 +1,17 @@
 """
 Module supporting the Camera class, responsible for taking snapshots.
 
-class Camera: contains the builder and the main capture function.
+class Camera: contains the builder and the capture functions, to files, to
+in-memory encoded buffers or as a lazy stream of frames.
 
 """
 
 import os
 import cv2
 
+import common.metrics as mt
+from common.wireformat import SameFrame
+
 class Camera:
     """Class responsible for taking frames captures from webcam.
 
@@ -69,6 +73,28 @@ class Camera:
         """
         self.path = path
 
+    def snapshots(self):
+        """Take frames from webcam, one at a time.
+
+        Starts the existing camera bound to the computer and yields raw
+        frames as they are taken, until self.frames number is reached or
+        the generator is closed. The camera is released in both cases.
+
+        Args:
+            None
+
+        Returns:
+            A generator of numpy arrays, one per snapshot.
+        """
+        cap = cv2.VideoCapture(0)
+        try:
+            for _ in range(self.frames):
+                with mt.timer('capture'):
+                    _, frm = cap.read()
+                yield frm
+        finally:
+            cap.release()
+
     def capture(self):
         """Capture frames from webcam.
 
@@ -83,10 +109,54 @@ class Camera:
         Returns:
             None
         """
-        cap = cv2.VideoCapture(0)
-        count = 0
-        while count < self.frames:
-            _, frm = cap.read()
+        for count, frm in enumerate(self.snapshots()):
             cv2.imwrite(os.path.join(self.path, "frame%d.jpg" % count), frm)
-            count = count + 1
-        cap.release()
+
+    def stream(self, ext='.jpg', gate=None, encoder=None):
+        """Capture frames from webcam and encode them in memory, lazily.
+
+        Frames are encoded straight from the capture buffer with
+        cv2.imencode and yielded as soon as they are taken, so a sender can
+        transmit them while capture continues.
+
+        Args:
+            ext: An optional string representing the encoding format.
+            gate: An optional client.motion.MotionGate. Frames it rejects
+            are neither encoded nor sent, a SameFrame is yielded instead,
+            referring to the position in the stream of the last frame the
+            gate let through.
+            encoder: An optional client.encoder.FrameEncoder choosing the
+            size, color and quality of every frame, which may then be
+            yielded as a common.wireformat.EncodedFrame.
+
+        Returns:
+            A generator of bytes objects, one encoded frame per snapshot.
+        """
+        reference = None
+        for count, frm in enumerate(self.snapshots()):
+            if gate is not None and not gate.changed(frm):
+                yield SameFrame(reference)
+                continue
+            reference = count
+            with mt.timer('encode'):
+                if encoder is not None:
+                    buf = encoder.encode(frm, ext)
+                else:
+                    buf = cv2.imencode(ext, frm)[1].tobytes()
+            yield buf
+
+    def capture_buffers(self, ext='.jpg', gate=None, encoder=None):
+        """Capture frames from webcam and encode them in memory.
+
+        Same as capture, but frames are encoded straight from the capture
+        buffer with cv2.imencode instead of being written under self.path.
+
+        Args:
+            ext: An optional string representing the encoding format.
+            gate: An optional client.motion.MotionGate, see stream.
+            encoder: An optional client.encoder.FrameEncoder, see stream.
+
+        Returns:
+            A list of bytes objects, one encoded frame per snapshot.
+        """
+        return list(self.stream(ext, gate, encoder))
@@ -14,6 +14,19 @@ function send_frame: Send a frame to the client.
 
 function waiting_for_ack: Waits for client's ack based on frame.
 
+function send_session_header: Send the binary session header to the server.
+
+function wait_cumulative_ack: Waits for a binary cumulative ack.
+
+function send_frames_windowed: Send frames with the binary wire format and a
+sliding window of unacked frames in flight.
+
+function send_buffers_windowed: Same as send_frames_windowed for frames
+already encoded in memory.
+
+function send_windowed: Send encoded frames from any iterable, including
+open-ended live streams, with a sliding window.
+
 class Client: Create a client instance with a frame and a socket. Useful for
 sending only one frame on one socket.
 """
@@ -22,6 +35,10 @@ import socket
 import os
 import time
 
+import common.metrics as mt
+import common.transfer as tr
+import common.wireformat as wf
+
 
 def init_facedetect_environ_folder(capture_loc=None):
     """Return necessary capture_loc based on environ.
@@ -97,7 +114,8 @@ def send_frame(client_socket, frame_loc, sleep=1):
     """Send frame to client.
 
     Send one frame to the client, but wait for sleep seconds before sending
-    it. Sleep parameter is useful when a lot of frames are sent in a row,
+    it. The frame is sent with socket.sendfile, without copying it to user
+    space. Sleep parameter is useful when a lot of frames are sent in a row,
     in order to avoid broken pipe with the server, when the other end
     cannot keep up the rythm.
 
@@ -111,12 +129,7 @@ def send_frame(client_socket, frame_loc, sleep=1):
         None
     """
     time.sleep(sleep)
-    with open(frame_loc, 'rb') as filedesc:
-        buf = filedesc.readline(1024)
-        while buf:
-            client_socket.send(buf)
-            buf = filedesc.readline(1024)
-        filedesc.close()
+    tr.send_file(client_socket, frame_loc)
 
 def waiting_for_ack(client_socket, frame):
     """Wait for a particular frame to be acked by server.
@@ -136,6 +149,142 @@ def waiting_for_ack(client_socket, frame):
     while msg != 'OK FRAME ' + str(frame):
         msg = client_socket.recv(1024).decode('UTF-8')
 
+def send_session_header(client_socket, frame_nbr):
+    """Send the binary session header to the server.
+
+    Binary counterpart of send_total_frame_nbr, it opens a session using
+    the wire format defined in common.wireformat.
+
+    Args:
+        client_socket: A socket instance, used for client/server interactions.
+        frame_nbr: An int representing the number of frames of the session.
+
+    Returns:
+        None
+    """
+    wf.send_message(client_socket, wf.MSG_HELLO, frame_nbr)
+
+def wait_cumulative_ack(reader):
+    """Wait for the next cumulative ack from the server.
+
+    An ack for frame X means every frame up to and including X has been
+    received by the server.
+
+    Args:
+        reader: A common.wireformat.MessageReader on the client socket.
+
+    Returns:
+        An int representing the highest frame ack'ed by the server.
+    """
+    return reader.read(wf.MSG_ACK).frame_id
+
+def send_frames_windowed(client_socket, frame_locs, window=8):
+    """Send frames while keeping up to window frames unacked.
+
+    Replaces the send/wait cycle of send_frame and waiting_for_ack. Frames
+    are sent back to back as long as fewer than window frames are waiting
+    for an ack, so throughput is bound by bandwidth rather than by the
+    round trip time. Frames are sent from disk with socket.sendfile, and
+    the length prefixed headers remove the need for a sleep between
+    frames. A window of 1 behaves as stop-and-wait.
+
+    Args:
+        client_socket: A socket instance, used for client/server interactions.
+        frame_locs: A list of strings representing the frame locations.
+        window: Optional int representing the maximum number of frames in
+        flight.
+
+    Returns:
+        None
+    """
+    send_windowed(client_socket, frame_locs, window, len(frame_locs))
+
+def send_buffers_windowed(client_socket, buffers, window=8):
+    """Send in-memory frames while keeping up to window frames unacked.
+
+    Same as send_frames_windowed, but frames are bytes-like objects, for
+    instance encoded by Camera.capture_buffers, so nothing is read from
+    disk.
+
+    Args:
+        client_socket: A socket instance, used for client/server interactions.
+        buffers: A list of bytes-like objects holding the encoded frames.
+        window: Optional int representing the maximum number of frames in
+        flight.
+
+    Returns:
+        None
+    """
+    send_windowed(client_socket, buffers, window, len(buffers))
+
+def send_windowed(client_socket, frames, window=8, frame_nbr=0,
+                  feedback=None):
+    """Send encoded frames from any iterable with a sliding window.
+
+    With a known frame_nbr, every frame the window allows is taken from
+    frames at once and packed into a single vectored send. With frame_nbr
+    set to 0 the session is open-ended: frames are sent one by one as the
+    iterable yields them, typically from a live capture, and the session
+    is closed with an end message once the iterable is exhausted.
+
+    Args:
+        client_socket: A socket instance, used for client/server interactions.
+        frames: An iterable of bytes-like objects holding encoded frames,
+        of strings representing frame locations on disk, of
+        common.wireformat.EncodedFrame for frames sent with encoding flags,
+        or of common.wireformat.SameFrame for frames skipped by a
+        MotionGate. A SameFrame with no ref refers to the last frame
+        actually sent.
+        window: Optional int representing the maximum number of frames in
+        flight.
+        frame_nbr: Optional int representing the number of frames, 0 when
+        unknown.
+        feedback: Optional object told about every frame sent and ack
+        received through its sent(frame, payload) and acked(frame)
+        methods, such as a client.encoder.AdaptiveEncoder.
+
+    Returns:
+        An int representing the number of frames sent.
+    """
+    reader = wf.MessageReader(client_socket, bufsize=0)
+    send_session_header(client_socket, frame_nbr)
+    frames = iter(frames)
+    max_batch = window if frame_nbr else 1
+    acked, sent, done, last_sent = -1, 0, False, None
+    while not done:
+        while sent - acked > window:
+            acked = wait_cumulative_ack(reader)
+            if feedback is not None:
+                feedback.acked(acked)
+        batch = []
+        while len(batch) < max_batch and sent - acked <= window:
+            payload = next(frames, None)
+            if payload is None:
+                done = True
+                break
+            if not isinstance(payload, wf.SameFrame):
+                last_sent = sent
+            elif payload.ref is None:
+                if last_sent is None:
+                    raise ValueError("Unchanged frame before any frame "
+                                     "was sent.")
+                payload = wf.SameFrame(last_sent)
+            batch.append((sent, payload))
+            sent += 1
+        if batch:
+            with mt.timer('send'):
+                wf.send_frames(client_socket, batch)
+            if feedback is not None:
+                for frame, payload in batch:
+                    feedback.sent(frame, payload)
+    if not frame_nbr:
+        wf.send_message(client_socket, wf.MSG_END, sent)
+    while acked < sent - 1:
+        acked = wait_cumulative_ack(reader)
+        if feedback is not None:
+            feedback.acked(acked)
+    return sent
+
 class Client:
     """Handles and manage incoming connections for one frame and one socket.
 
@@ -249,9 +398,5 @@ class Client:
         Returns:
             None
         """
-        with open(self.filename, 'rb') as filedesc:
-            buf = filedesc.readline(1024)
-            while buf:
-                client_socket.send(buf)
-                buf = filedesc.readline(1024)
+        tr.send_file(client_socket, self.filename)
         client_socket.close()
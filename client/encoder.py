@@ -0,0 +1,226 @@
+"""
+Module supporting the client frame encoders, which choose the size, color
+and JPEG quality frames are sent with.
+
+function encoding_ladder: Build the encodings from the best quality to the
+cheapest within bounds.
+
+class FrameEncoder: Encode frames with fixed settings.
+
+class AdaptiveEncoder: Encode frames with settings following the measured
+uplink throughput and ack round trip time.
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+import common.wireformat as wf
+
+
+def encoding_ladder(scales=(100, 75, 50, 35), qualities=(90, 75, 60),
+                    gray=True):
+    """Build the encodings from the best quality to the cheapest.
+
+    Starting with the first value of every bound, each step makes one knob
+    cheaper, in turn JPEG quality and scale, until both reach their last
+    value. Every step roughly halves the size of a frame or less.
+
+    Args:
+        scales: An optional list of scale percents, decreasing.
+        qualities: An optional list of JPEG qualities, decreasing.
+        gray: An optional boolean, True to send grayscale frames at every
+        level, the server detecting on grayscale frames anyway.
+
+    Returns:
+        A list of common.wireformat.Encoding.
+    """
+    knobs = [('quality', qualities), ('scale', scales)]
+    index = {name: 0 for name, _ in knobs}
+    ladder = [wf.Encoding(scales[0], qualities[0], gray)]
+    while any(index[name] + 1 < len(values) for name, values in knobs):
+        for name, values in knobs:
+            if index[name] + 1 < len(values):
+                index[name] += 1
+                ladder.append(wf.Encoding(scales[index['scale']],
+                                          qualities[index['quality']], gray))
+    return ladder
+
+
+class FrameEncoder:
+    """Encodes captured frames with fixed settings.
+
+    Frames are resized to scale percent of their captured size, turned to
+    grayscale when gray is set and JPEG encoded at quality, 0 keeping the
+    OpenCV default. Frames not sent at full size, color and default
+    quality are wrapped in a common.wireformat.EncodedFrame, so their
+    encoding goes in the frame header and the server maps the faces back
+    to captured frame coordinates.
+
+    Attributes:
+        encoding: The common.wireformat.Encoding used for the next frame.
+    """
+
+    def __init__(self, scale=100, quality=0, gray=False):
+        """Init FrameEncoder with its settings."""
+        self.encoding = wf.Encoding(scale, quality, gray)
+
+    def encode(self, frame, ext='.jpg'):
+        """Encode one captured frame with the current settings.
+
+        Args:
+            frame: A BGR numpy array holding the captured frame.
+            ext: An optional string representing the encoding format,
+            quality only applies to JPEG.
+
+        Returns:
+            A bytes object, or a common.wireformat.EncodedFrame wrapping it
+            for non-default settings.
+        """
+        encoding = self.encoding
+        if encoding.scale != 100:
+            height, width = frame.shape[:2]
+            frame = cv2.resize(frame, (max(1, width * encoding.scale // 100),
+                                       max(1, height * encoding.scale // 100)),
+                               interpolation=cv2.INTER_AREA)
+        if encoding.gray and frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        params = ([cv2.IMWRITE_JPEG_QUALITY, encoding.quality]
+                  if encoding.quality else [])
+        buf = cv2.imencode(ext, frame, params)[1].tobytes()
+        flags = wf.pack_encoding(encoding)
+        return wf.EncodedFrame(buf, flags) if flags else buf
+
+    def sent(self, frame, payload):
+        """Account one frame sent, nothing to do with fixed settings.
+
+        Args:
+            frame: An int representing the frame number.
+            payload: The payload sent, see client.client.send_windowed.
+
+        Returns:
+            None
+        """
+
+    def acked(self, frame):
+        """Account one cumulative ack, nothing to do with fixed settings.
+
+        Args:
+            frame: An int representing the highest frame ack'ed.
+
+        Returns:
+            None
+        """
+
+
+class AdaptiveEncoder(FrameEncoder):
+    """Encodes frames with settings following the measured uplink.
+
+    Settings come from a ladder, see encoding_ladder. The sender reports
+    every frame sent and every ack, see client.client.send_windowed. Once
+    window frames were ack'ed, frames skipped as unchanged aside, their
+    throughput and median round trip time are compared with what the link
+    allows. A round trip time more than max_delay over the lowest one seen
+    means frames queue up on the uplink, or at the server. When the measured
+    throughput then cannot carry target_fps frames of the current size, the
+    next cheaper level is used. When nothing queues and the estimated
+    bandwidth would carry target_fps frames of the previous better level,
+    which is assumed twice as large, that level is used again. The bandwidth
+    estimate grows by 10% every window nothing queues, so better settings
+    are probed again when the link improves. Decisions are kept in history.
+    encode runs in the capture thread while sent and acked run in the sender
+    thread.
+
+    Attributes:
+        target_fps: A float representing the frame rate to sustain.
+        ladder: A list of common.wireformat.Encoding, see encoding_ladder.
+        level: An int, the index of the current encoding in ladder.
+        window: An int representing the frames ack'ed between decisions.
+        max_delay: A float representing the queueing delay in seconds over
+        which the link is considered saturated.
+        bandwidth: A float representing the estimated uplink bandwidth in
+        bytes per second, None until measured.
+        history: A list of dicts, one per decision, with the encoding, the
+        median round trip time in ms and the throughput in kB/s.
+        changes: An int counting the encoding changes.
+    """
+
+    def __init__(self, target_fps=15.0, ladder=None, window=10,
+                 max_delay=0.2):
+        """Init AdaptiveEncoder at the best quality settings."""
+        self.ladder = ladder or encoding_ladder()
+        super().__init__(*self.ladder[0])
+        self.target_fps = target_fps
+        self.level = 0
+        self.window = window
+        self.max_delay = max_delay
+        self.bandwidth = None
+        self.history = []
+        self.changes = 0
+        self._base_rtt = None
+        self._inflight = {}
+        self._samples = []
+
+    def sent(self, frame, payload):
+        """Record when a frame was sent and its size.
+
+        Frames skipped as unchanged carry no image, they are left out of
+        the size and throughput samples.
+
+        Args:
+            frame: An int representing the frame number.
+            payload: The payload sent, see client.client.send_windowed.
+
+        Returns:
+            None
+        """
+        if isinstance(payload, wf.SameFrame):
+            return
+        if isinstance(payload, wf.EncodedFrame):
+            payload = payload.payload
+        self._inflight[frame] = (time.perf_counter(), len(payload))
+
+    def acked(self, frame):
+        """Measure the frames covered by a cumulative ack and adapt.
+
+        Args:
+            frame: An int representing the highest frame ack'ed.
+
+        Returns:
+            None
+        """
+        now = time.perf_counter()
+        for done in sorted(sent for sent in self._inflight if sent <= frame):
+            start, nbytes = self._inflight.pop(done)
+            self._samples.append((start, now, nbytes))
+        if len(self._samples) >= self.window:
+            self._adapt()
+
+    def _adapt(self):
+        """Move along the ladder from the last window of acked frames."""
+        samples, self._samples = self._samples, []
+        rtt = float(np.median([end - start for start, end, _ in samples]))
+        lowest = min(end - start for start, end, _ in samples)
+        if self._base_rtt is None or lowest < self._base_rtt:
+            self._base_rtt = lowest
+        nbytes = sum(size for _, _, size in samples)
+        elapsed = max(end for _, end, _ in samples) - samples[0][0]
+        throughput = nbytes / elapsed if elapsed > 0 else float('inf')
+        frame_bytes = nbytes / len(samples)
+        if rtt > self._base_rtt + self.max_delay:
+            self.bandwidth = throughput
+            if (throughput < self.target_fps * frame_bytes and
+                    self.level + 1 < len(self.ladder)):
+                self.level += 1
+        else:
+            self.bandwidth = max(throughput, (self.bandwidth or 0) * 1.1)
+            if (self.level > 0 and
+                    self.bandwidth > 2 * self.target_fps * frame_bytes):
+                self.level -= 1
+        if self.ladder[self.level] != self.encoding:
+            self.encoding = self.ladder[self.level]
+            self.changes += 1
+        self.history.append({'encoding': self.encoding._asdict(),
+                             'rtt_ms': round(rtt * 1000, 2),
+                             'kbytes_per_s': round(throughput / 1000, 1)})
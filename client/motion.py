@@ -0,0 +1,67 @@
+"""
+Module supporting the MotionGate class, which skips frames that did not
+change enough to be worth sending.
+
+class MotionGate: Compare frames on small grayscale thumbnails and decide
+whether they should be sent.
+"""
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """Change detection stage skipping nearly identical frames.
+
+    Every frame is reduced to a small grayscale thumbnail and compared with
+    the thumbnail of the last frame that was let through. Frames whose mean
+    absolute difference stays under the threshold are skipped, the server
+    reuses the result of the last frame sent instead.
+
+    Attributes:
+        threshold: A float representing the mean absolute difference, on a
+        0-255 scale, above which a frame is sent.
+        size: A (width, height) tuple representing the thumbnail size.
+        skipped: An int counting the frames skipped so far.
+    """
+
+    def __init__(self, threshold=4.0, size=(64, 48)):
+        """Init MotionGate with its threshold and thumbnail size."""
+        self.threshold = threshold
+        self.size = size
+        self.skipped = 0
+        self._reference = None
+
+    def thumbnail(self, frame):
+        """Return the downscaled grayscale thumbnail of a frame.
+
+        Args:
+            frame: A numpy array holding a BGR or grayscale frame.
+
+        Returns:
+            A numpy array of int16, sized self.size.
+        """
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return small.astype(np.int16)
+
+    def changed(self, frame):
+        """Tell whether a frame differs enough from the last one sent.
+
+        When it does, the frame becomes the new reference.
+
+        Args:
+            frame: A numpy array holding a BGR or grayscale frame.
+
+        Returns:
+            A boolean, True if the frame should be sent.
+        """
+        thumb = self.thumbnail(frame)
+        if self._reference is not None:
+            diff = np.abs(thumb - self._reference).mean()
+            if diff < self.threshold:
+                self.skipped += 1
+                return False
+        self._reference = thumb
+        return True
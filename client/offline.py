@@ -0,0 +1,251 @@
+"""
+Module supporting offline sources, which replay recorded footage through
+the Camera interface instead of a live webcam.
+
+function open_source: Return the source reading a video file or an image
+directory.
+
+class VideoSource: Camera reading the frames of a video file.
+
+class ImageDirSource: Camera reading the images of a directory.
+"""
+
+import math
+import os
+import re
+
+import cv2
+
+import common.metrics as mt
+from client.camera import Camera
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def open_source(location, **options):
+    """Return the source reading a video file or an image directory.
+
+    Args:
+        location: A string representing a video file or a directory of
+        images.
+        options: Keyword arguments passed to the source, see VideoSource
+        and ImageDirSource.
+
+    Returns:
+        An ImageDirSource for a directory, a VideoSource otherwise.
+    """
+    if os.path.isdir(location):
+        return ImageDirSource(location, **options)
+    options.pop('fps', None)
+    return VideoSource(location, **options)
+
+
+class VideoSource(Camera):
+    """Camera reading the frames of a video file, lazily.
+
+    Frames are read one at a time, so archives of any length are replayed
+    in constant memory. With stride set to N, one frame in N is kept: the
+    others are only grabbed, not decoded. start and end select a time
+    range, start being reached with a seek rather than by reading.
+
+    Attributes:
+        video: A string representing the video file location.
+        stride: An int, one frame kept every stride frames.
+        start: A float representing the first second to read.
+        end: A float representing the second to stop at, None for the end
+        of the file.
+        positions: A list of (source_frame, seconds) tuples, one per frame
+        yielded by the last pass, to map results back to the footage.
+    """
+
+    def __init__(self, video, stride=1, start=0.0, end=None, frames=0,
+                 path='./'):
+        """Init VideoSource, frames set to 0 reads every sampled frame."""
+        super().__init__(frames, path)
+        self.video = video
+        self.stride = max(1, stride)
+        self.start = start
+        self.end = end
+        self.positions = []
+
+    def snapshots(self):
+        """Read the sampled frames of the video file.
+
+        Args:
+            None
+
+        Returns:
+            A generator of BGR numpy arrays, one per sampled frame.
+
+        Raises:
+            IOError: The video file cannot be opened.
+        """
+        cap = cv2.VideoCapture(self.video)
+        if not cap.isOpened():
+            raise IOError("Cannot open video %s." % self.video)
+        self.positions = []
+        # Some backends report a wrong position right after a seek, frame
+        # numbers stay reliable.
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        try:
+            if self.start:
+                cap.set(cv2.CAP_PROP_POS_MSEC, self.start * 1000)
+            while not self.frames or len(self.positions) < self.frames:
+                index = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+                seconds = (index / fps if fps > 0 else
+                           cap.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+                if self.end is not None and seconds >= self.end:
+                    return
+                with mt.timer('capture'):
+                    grabbed, frm = cap.read()
+                if not grabbed:
+                    return
+                self.positions.append((index, seconds))
+                yield frm
+                for _ in range(self.stride - 1):
+                    if not cap.grab():
+                        return
+        finally:
+            cap.release()
+
+    def samples(self):
+        """Yield the sampled frames in the form the engine decodes best.
+
+        Video frames are only available decoded, see snapshots.
+
+        Args:
+            None
+
+        Returns:
+            A generator of BGR numpy arrays.
+        """
+        return self.snapshots()
+
+
+class ImageDirSource(Camera):
+    """Camera reading the images of a directory, lazily, in name order.
+
+    Names are sorted naturally, frame2.jpg before frame10.jpg. Images have
+    no timestamps, so start and end are turned into positions with fps.
+    When streamed in their own format, images are sent as they are on
+    disk instead of being decoded and encoded again.
+
+    Attributes:
+        directory: A string representing the directory location.
+        stride: An int, one image kept every stride images.
+        start: A float representing the first second to read.
+        end: A float representing the second to stop at, None for the last
+        image.
+        fps: A float representing the rate the images were taken at.
+        positions: A list of (source_frame, seconds) tuples, see
+        VideoSource.
+    """
+
+    def __init__(self, directory, stride=1, start=0.0, end=None, fps=25.0,
+                 frames=0, path='./'):
+        """Init ImageDirSource, frames set to 0 reads every sampled image."""
+        super().__init__(frames, path)
+        self.directory = directory
+        self.stride = max(1, stride)
+        self.start = start
+        self.end = end
+        self.fps = fps
+        self.positions = []
+
+    def files(self):
+        """Return the sampled image locations and their source positions.
+
+        Args:
+            None
+
+        Returns:
+            A list of (location, source_frame) tuples.
+        """
+        names = sorted((name for name in os.listdir(self.directory)
+                        if name.lower().endswith(IMAGE_EXTS)),
+                       key=_natural_key)
+        first = int(math.ceil(self.start * self.fps))
+        last = len(names)
+        if self.end is not None:
+            last = min(last, int(math.ceil(self.end * self.fps)))
+        sampled = [(os.path.join(self.directory, names[index]), index)
+                   for index in range(first, last, self.stride)]
+        return sampled[:self.frames] if self.frames else sampled
+
+    def snapshots(self):
+        """Read the sampled images.
+
+        Args:
+            None
+
+        Returns:
+            A generator of numpy arrays, one per sampled image. Images that
+            cannot be decoded are skipped.
+        """
+        self.positions = []
+        for location, index in self.files():
+            with mt.timer('capture'):
+                frm = cv2.imread(location)
+            if frm is None:
+                continue
+            self.positions.append((index, index / self.fps))
+            yield frm
+
+    def stream(self, ext='.jpg', gate=None, encoder=None):
+        """Yield the sampled images encoded in memory, lazily.
+
+        Images already in the ext format are read as they are on disk.
+        The others, or every image when a gate or an encoder needs the
+        decoded frames, go through Camera.stream.
+
+        Args:
+            ext: An optional string representing the encoding format.
+            gate: An optional client.motion.MotionGate, see Camera.stream.
+            encoder: An optional client.encoder.FrameEncoder, see
+            Camera.stream.
+
+        Returns:
+            A generator of bytes objects, one encoded frame per image.
+        """
+        if gate is not None or encoder is not None:
+            return super().stream(ext, gate, encoder)
+        return self._read_files(ext)
+
+    def samples(self):
+        """Yield the sampled images in the form the engine decodes best.
+
+        Images are kept encoded, so the engine decodes them once, at a
+        reduced size when asked to.
+
+        Args:
+            None
+
+        Returns:
+            A generator of bytes objects.
+        """
+        return self._read_files(None)
+
+    def _read_files(self, ext):
+        """Yield the image files, re-encoded to ext unless already in it."""
+        aliases = {'.jpeg': '.jpg'}
+        self.positions = []
+        for location, index in self.files():
+            suffix = os.path.splitext(location)[1].lower()
+            with mt.timer('capture'):
+                if ext is None or (aliases.get(suffix, suffix) ==
+                                   aliases.get(ext, ext)):
+                    with open(location, 'rb') as filedesc:
+                        buf = filedesc.read()
+                else:
+                    frm = cv2.imread(location)
+                    if frm is None:
+                        continue
+                    buf = cv2.imencode(ext, frm)[1].tobytes()
+            self.positions.append((index, index / self.fps))
+            yield buf
+
+
+def _natural_key(name):
+    """Sort key ordering embedded numbers by value."""
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r'(\d+)', name)]
@@ -0,0 +1,200 @@
+"""
+Module supporting the streaming client, which sends frames while the capture
+is still running.
+
+class FrameBuffer: Bounded buffer dropping the oldest frame when full,
+keeping the frames skipped as unchanged consistent.
+
+class StreamingSender: Sender thread transmitting buffered frames to the
+server.
+"""
+
+import collections
+import threading
+
+import client.client as cl
+from common.wireformat import SameFrame
+
+
+class FrameBuffer:
+    """Bounded buffer between the capture and the sender.
+
+    When the network falls behind and the buffer is full, putting a new
+    frame drops the oldest one: on a live feed a recent frame is worth more
+    than a complete backlog.
+
+    Frames skipped by a MotionGate are put as a SameFrame referring to
+    their position among the frames put, see client.camera.Camera.stream.
+    They are yielded referring to the number the sender gives the frame
+    they reuse, i.e. its position among the frames yielded. When the frame
+    they refer to is dropped, the first of them takes over its payload and
+    the others refer to it instead, so the server never reuses the result
+    of another frame.
+
+    Attributes:
+        maxsize: An int representing the number of frames kept at most.
+        dropped: An int counting the frames dropped so far.
+    """
+
+    def __init__(self, maxsize=8):
+        """Init FrameBuffer with its capacity."""
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._frames = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._puts = 0
+        self._yielded = 0
+        self._sent_ids = {}
+        self._heirs = {}
+
+    def put(self, frame):
+        """Add one frame, dropping the oldest one if the buffer is full.
+
+        Args:
+            frame: A bytes-like object holding the encoded frame, or a
+            SameFrame referring to an earlier frame put.
+
+        Returns:
+            None
+        """
+        with self._cond:
+            if not isinstance(frame, SameFrame):
+                # Later SameFrames only refer to this frame.
+                self._heirs = {}
+            elif frame.ref in self._heirs:
+                frame = SameFrame(self._heirs[frame.ref])
+            self._frames.append((self._puts, frame))
+            self._puts += 1
+            if len(self._frames) > self.maxsize:
+                self._drop()
+            self._cond.notify()
+
+    def close(self):
+        """Mark the end of the capture, iteration stops once empty.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __iter__(self):
+        """Yield frames in order, blocking until one is available."""
+        while True:
+            with self._cond:
+                while not self._frames and not self._closed:
+                    self._cond.wait()
+                if not self._frames:
+                    return
+                index, frame = self._frames.popleft()
+                if isinstance(frame, SameFrame):
+                    frame = SameFrame(self._sent_ids[frame.ref])
+                else:
+                    # Later SameFrames only refer to the latest frame.
+                    self._sent_ids = {index: self._yielded}
+                self._yielded += 1
+            yield frame
+
+    def _drop(self):
+        """Drop the oldest frame, handing its payload to its SameFrames."""
+        index, frame = self._frames.popleft()
+        self.dropped += 1
+        if isinstance(frame, SameFrame):
+            return
+        heir = None
+        for pos, (other, payload) in enumerate(self._frames):
+            if isinstance(payload, SameFrame) and payload.ref == index:
+                if heir is None:
+                    heir = other
+                    self._frames[pos] = (other, frame)
+                else:
+                    self._frames[pos] = (other, SameFrame(heir))
+        if heir is not None:
+            # Frames skipped from now on refer to the heir too, including
+            # those referring to a frame this one had taken over.
+            for ref, current in self._heirs.items():
+                if current == index:
+                    self._heirs[ref] = heir
+            self._heirs[index] = heir
+
+
+class StreamingSender:
+    """Sends frames to the server from a background thread.
+
+    The capture puts frames into a FrameBuffer while the sender thread
+    transmits them with client.send_windowed as an open-ended session.
+
+    Attributes:
+        client_socket: A socket instance connected to the server.
+        window: An int representing the maximum number of frames in flight.
+        buffer: The FrameBuffer between capture and sender.
+        feedback: An optional object told about frames sent and acks, see
+        client.client.send_windowed.
+        sent: An int representing the number of frames sent, set once the
+        sender is closed.
+    """
+
+    def __init__(self, client_socket, window=8, maxsize=8, feedback=None):
+        """Init StreamingSender with its socket, window and buffer size."""
+        self.client_socket = client_socket
+        self.window = window
+        self.buffer = FrameBuffer(maxsize)
+        self.feedback = feedback
+        self.sent = 0
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """Start the sender thread.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._thread.start()
+
+    def put(self, frame):
+        """Queue one captured frame for sending.
+
+        Args:
+            frame: A bytes-like object holding the encoded frame.
+
+        Returns:
+            None
+        """
+        self.buffer.put(frame)
+
+    def close(self):
+        """End the session and wait for every buffered frame to be acked.
+
+        Args:
+            None
+
+        Returns:
+            An int representing the number of frames sent.
+
+        Raises:
+            Any error that stopped the sender thread.
+        """
+        self.buffer.close()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self.sent
+
+    def _run(self):
+        """Sender thread body."""
+        try:
+            self.sent = cl.send_windowed(self.client_socket, self.buffer,
+                                         self.window,
+                                         feedback=self.feedback)
+        except Exception as err:
+            # Re-raised by close, in the capture thread.
+            self._error = err
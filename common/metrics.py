@@ -0,0 +1,452 @@
+"""
+Module supporting per-stage latency metrics, shared by the client and the
+server.
+
+Every stage of a frame, from capture to save, is timed into fixed bucket
+histograms, overall and per session. Metrics are off by default: the
+active registry is then a NullRegistry whose timers do nothing, so
+instrumented code pays one function call per stage at most.
+
+function enable: Start collecting metrics in this process.
+
+function disable: Stop collecting metrics in this process.
+
+function registry: Return the active registry.
+
+function timer: Return a context manager timing one stage.
+
+function serve_metrics: Serve the registry over HTTP.
+
+class Histogram: Fixed bucket latency histogram.
+
+class Registry: Histograms of every stage, overall and per session.
+
+class NullRegistry: Registry doing nothing, used while metrics are off.
+
+class JsonDumper: Periodically write the registry as JSON to a file.
+"""
+
+import bisect
+import http.server
+import json
+import threading
+import time
+
+STAGES = ('capture', 'encode', 'send', 'receive', 'decode', 'detect',
+          'draw', 'save')
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Fixed bucket latency histogram, in seconds.
+
+    Attributes:
+        buckets: A sorted tuple of bucket upper bounds.
+        counts: A list of the observations per bucket, the last one
+        counting observations above every bound.
+        count: An int counting observations.
+        total: A float summing observations.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        """Init an empty Histogram."""
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        """Add one observation.
+
+        Args:
+            seconds: A float representing the observed duration.
+
+        Returns:
+            None
+        """
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, q):
+        """Estimate a percentile as the upper bound of its bucket.
+
+        Args:
+            q: A float between 0 and 100.
+
+        Returns:
+            A float in seconds, inf above the last bucket, 0.0 if empty.
+        """
+        if not self.count:
+            return 0.0
+        rank, seen = self.count * q / 100.0, 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        """Return the histogram as a JSON friendly dict.
+
+        Args:
+            None
+
+        Returns:
+            A dict with count, mean, p50, p95 and p99 in ms, and buckets.
+        """
+        def ms(seconds):
+            return None if seconds == float('inf') else round(seconds * 1e3,
+                                                              3)
+        return {'count': self.count,
+                'mean_ms': ms(self.total / self.count) if self.count else 0,
+                'p50_ms': ms(self.percentile(50)),
+                'p95_ms': ms(self.percentile(95)),
+                'p99_ms': ms(self.percentile(99)),
+                'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'],
+                                    self.counts))}
+
+
+class _Timer:
+    """Context manager observing the time spent in its block."""
+
+    __slots__ = ('_registry', '_stage', '_session', '_start')
+
+    def __init__(self, registry, stage, session):
+        self._registry = registry
+        self._stage = stage
+        self._session = session
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._registry.observe(self._stage,
+                               time.perf_counter() - self._start,
+                               self._session)
+        return False
+
+
+class _NullTimer:
+    """Context manager doing nothing, shared by every disabled timer."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Registry:
+    """Histograms of every stage, overall and per session.
+
+    Observations are recorded in the overall histogram of their stage and,
+    when a session is given, or set for the calling thread with session,
+    in the histogram of that session too. May be used from several
+    threads.
+
+    Attributes:
+        enabled: True, metrics are collected.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        """Init an empty Registry."""
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def observe(self, stage, seconds, session=None):
+        """Record the duration of one stage.
+
+        Args:
+            stage: A string representing the stage, see STAGES.
+            seconds: A float representing the stage duration.
+            session: An optional string representing the session, defaults
+            to the session of the calling thread.
+
+        Returns:
+            None
+        """
+        if session is None:
+            session = getattr(self._local, 'session', None)
+        with self._lock:
+            keys = [(stage, None)] if session is None else [(stage, None),
+                                                            (stage, session)]
+            for key in keys:
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram()
+                histogram.observe(seconds)
+
+    def time(self, stage, session=None):
+        """Return a context manager timing one stage, see observe."""
+        return _Timer(self, stage, session)
+
+    def session(self, session):
+        """Set the session of the stages timed by the calling thread.
+
+        Args:
+            session: A string representing the session, None to unset.
+
+        Returns:
+            None
+        """
+        self._local.session = session
+
+    def forget(self, session):
+        """Drop the histograms of a finished session.
+
+        The overall histograms keep its observations.
+
+        Args:
+            session: A string representing the session.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            for key in [key for key in self._histograms
+                        if key[1] == session]:
+                del self._histograms[key]
+
+    def snapshot(self):
+        """Return every histogram as a JSON friendly dict.
+
+        Args:
+            None
+
+        Returns:
+            A dict with a stages dict of overall summaries and a sessions
+            dict of per stage summaries for every session.
+        """
+        with self._lock:
+            items = sorted(self._histograms.items(),
+                           key=lambda item: (item[0][1] or '', item[0][0]))
+            stages, sessions = {}, {}
+            for (stage, session), histogram in items:
+                target = (stages if session is None else
+                          sessions.setdefault(session, {}))
+                target[stage] = histogram.summary()
+        return {'time': time.time(), 'stages': stages, 'sessions': sessions}
+
+    def prometheus(self):
+        """Return every histogram in the Prometheus text format.
+
+        Args:
+            None
+
+        Returns:
+            A string, one aws_facedetect_stage_seconds histogram labelled
+            by stage and session, the overall one having no session label.
+        """
+        name = 'aws_facedetect_stage_seconds'
+        lines = ['# HELP %s Time spent per frame in each stage.' % name,
+                 '# TYPE %s histogram' % name]
+        with self._lock:
+            for (stage, session), hist in sorted(
+                    self._histograms.items(),
+                    key=lambda item: (item[0][0], item[0][1] or '')):
+                labels = 'stage="%s"' % stage
+                if session is not None:
+                    labels += ',session="%s"' % session
+                seen = 0
+                for bound, count in zip(hist.buckets + ('+Inf',),
+                                        hist.counts):
+                    seen += count
+                    lines.append('%s_bucket{%s,le="%s"} %d' %
+                                 (name, labels, bound, seen))
+                lines.append('%s_sum{%s} %f' % (name, labels, hist.total))
+                lines.append('%s_count{%s} %d' % (name, labels, hist.count))
+        return '\n'.join(lines) + '\n'
+
+
+class NullRegistry:
+    """Registry doing nothing, used while metrics are off.
+
+    Attributes:
+        enabled: False, nothing is collected.
+    """
+
+    enabled = False
+
+    def observe(self, stage, seconds, session=None):
+        """Ignore one observation."""
+
+    def time(self, stage, session=None):
+        """Return the shared timer doing nothing."""
+        return _NULL_TIMER
+
+    def session(self, session):
+        """Ignore the session of the calling thread."""
+
+    def forget(self, session):
+        """Ignore a finished session."""
+
+    def snapshot(self):
+        """Return an empty snapshot."""
+        return {'time': time.time(), 'stages': {}, 'sessions': {}}
+
+    def prometheus(self):
+        """Return an empty exposition."""
+        return ''
+
+
+_REGISTRY = [NullRegistry()]
+
+
+def enable():
+    """Start collecting metrics in this process.
+
+    Args:
+        None
+
+    Returns:
+        The active Registry.
+    """
+    if not _REGISTRY[0].enabled:
+        _REGISTRY[0] = Registry()
+    return _REGISTRY[0]
+
+def disable():
+    """Stop collecting metrics in this process, dropping them.
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+    _REGISTRY[0] = NullRegistry()
+
+def registry():
+    """Return the active registry, a NullRegistry while metrics are off.
+
+    Args:
+        None
+
+    Returns:
+        A Registry or NullRegistry instance.
+    """
+    return _REGISTRY[0]
+
+def timer(stage, session=None):
+    """Return a context manager timing one stage of the active registry.
+
+    Args:
+        stage: A string representing the stage, see STAGES.
+        session: An optional string representing the session.
+
+    Returns:
+        A context manager.
+    """
+    return _REGISTRY[0].time(stage, session)
+
+def serve_metrics(address='', port=9100):
+    """Serve the active registry over HTTP in a background thread.
+
+    /metrics returns the Prometheus text format, /metrics.json the JSON
+    snapshot.
+
+    Args:
+        address: An optional string representing the IP address to bind.
+        port: An optional int representing the port to bind.
+
+    Returns:
+        The http.server.ThreadingHTTPServer, shutdown stops it.
+    """
+    server = http.server.ThreadingHTTPServer((address, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the Prometheus and JSON expositions."""
+
+    def do_GET(self):
+        """Route /metrics and /metrics.json."""
+        if self.path == '/metrics':
+            body = registry().prometheus().encode()
+            content_type = 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body = json.dumps(registry().snapshot()).encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Do not log every scrape."""
+
+
+class JsonDumper:
+    """Periodically write the active registry as JSON to a file.
+
+    Attributes:
+        path: A string representing the JSON file location.
+        interval: A float representing the seconds between two dumps.
+    """
+
+    def __init__(self, path, interval=5.0):
+        """Init JsonDumper, start begins dumping."""
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """Start dumping in a background thread.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._thread.start()
+
+    def dump(self):
+        """Write the current snapshot now.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with open(self.path, 'w') as filedesc:
+            json.dump(registry().snapshot(), filedesc, indent=1)
+
+    def close(self):
+        """Stop the dumps and write a last one.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.dump()
+
+    def _run(self):
+        """Dump every interval seconds until closed."""
+        while not self._stop.wait(self.interval):
+            self.dump()
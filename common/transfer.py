@@ -0,0 +1,76 @@
+"""
+Module supporting file transfers over sockets with as few copies and
+syscalls as possible.
+
+function new_buffer: Allocate a reusable receive buffer.
+
+function send_file: Send a whole file with socket.sendfile.
+
+function recv_file: Receive bytes into a reusable buffer and write them to a
+file.
+"""
+
+CHUNK_SIZE = 262144
+
+
+def new_buffer(size=CHUNK_SIZE):
+    """Allocate a receive buffer meant to be reused across transfers.
+
+    Args:
+        size: Optional int representing the buffer size in bytes.
+
+    Returns:
+        A bytearray of size bytes.
+    """
+    return bytearray(size)
+
+def send_file(sock, path):
+    """Send a whole file over a socket.
+
+    Relies on socket.sendfile, hence on the kernel sendfile syscall where
+    available: the file is never copied to user space and short writes are
+    resumed until every byte is sent.
+
+    Args:
+        sock: A connected socket instance.
+        path: A string representing the file location.
+
+    Returns:
+        An int representing the number of bytes sent.
+    """
+    with open(path, 'rb') as filedesc:
+        return sock.sendfile(filedesc)
+
+def recv_file(sock, path, size=None, buf=None):
+    """Receive bytes from a socket and write them to a file.
+
+    Data is received with recv_into straight into buf, which callers should
+    keep and pass again for the next transfer, so no memory is allocated
+    per chunk.
+
+    Args:
+        sock: A connected socket instance.
+        path: A string representing the file location to write.
+        size: Optional int representing the number of bytes to receive,
+        None to receive until the peer closes the connection.
+        buf: Optional bytearray to receive into, see new_buffer.
+
+    Returns:
+        An int representing the number of bytes received.
+    """
+    if buf is None:
+        buf = new_buffer()
+    view = memoryview(buf)
+    received = 0
+    with open(path, 'wb') as filedesc:
+        while size is None or received < size:
+            chunk = len(view) if size is None else min(len(view),
+                                                       size - received)
+            nbytes = sock.recv_into(view, chunk)
+            if nbytes == 0:
+                if size is None:
+                    break
+                raise ConnectionError("Peer closed the connection.")
+            filedesc.write(view[:nbytes])
+            received += nbytes
+    return received
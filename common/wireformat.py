@@ -0,0 +1,309 @@
+"""
+Module supporting the binary wire format shared by the client and the server.
+
+Every message starts with a fixed size header, packed in network order:
+
+    magic (4s) | version (B) | type (B) | flags (H) | frame id (I) | length (I)
+
+followed by exactly length bytes of payload. Since sizes are part of the
+header, message boundaries never depend on how TCP splits or merges
+segments and no sleep is needed between two sends.
+
+function pack_header: Build one message header.
+
+function unpack_header: Parse and validate one message header.
+
+function recv_exact_into: Fill a buffer with exactly its length in bytes.
+
+function sendall_vectored: Send several buffers with as few syscalls as
+possible.
+
+function send_message: Send one message, header and payload.
+
+function send_frames: Send several frames in one go.
+
+function pack_encoding: Pack the client encoding of a frame into header
+flags.
+
+function unpack_encoding: Read the client encoding of a frame from header
+flags.
+
+class ProtocolError: Raised when a peer sends an invalid message.
+
+class SameFrame: Payload placeholder for a frame identical to an earlier one.
+
+class EncodedFrame: Payload wrapper carrying the header flags of a frame.
+
+class Encoding: How the client encoded a frame.
+
+class MessageReader: Read messages into a reusable receive buffer.
+"""
+
+import collections
+import os
+import struct
+
+import common.transfer as tr
+
+MAGIC = b'AWFD'
+VERSION = 1
+
+HEADER = struct.Struct('!4sBBHII')
+HEADER_LEN = HEADER.size
+
+MSG_HELLO = 1
+MSG_FRAME = 2
+MSG_ACK = 3
+MSG_END = 4
+MSG_SAME = 5
+
+SAME_REF = struct.Struct('!I')
+
+# Flags of a MSG_FRAME: scale percent, JPEG quality, grayscale. 0 stands for
+# the defaults, full size and OpenCV quality, so plain frames have no flags.
+ENC_SCALE_MASK = 0x7f
+ENC_QUALITY_SHIFT = 7
+ENC_QUALITY_MASK = 0x7f << ENC_QUALITY_SHIFT
+ENC_GRAY = 1 << 14
+
+MAX_IOV = 64
+
+Message = collections.namedtuple('Message',
+                                 ['msg_type', 'flags', 'frame_id', 'payload'])
+
+SameFrame = collections.namedtuple('SameFrame', ['ref'])
+SameFrame.__doc__ = """Stands for a frame skipped as identical to frame ref.
+
+Sent as a MSG_SAME message whose payload is the ref frame id, so that the
+server reuses the result of ref instead of receiving and processing the
+frame again.
+"""
+
+
+EncodedFrame = collections.namedtuple('EncodedFrame', ['payload', 'flags'])
+EncodedFrame.__doc__ = """Frame payload sent or received with header flags.
+
+Clients encoding frames with a non-default Encoding send them wrapped, so
+that send_frames puts the encoding flags in the frame header, and the
+server receives them wrapped when the header flags are set.
+"""
+
+Encoding = collections.namedtuple('Encoding', ['scale', 'quality', 'gray'])
+Encoding.__doc__ = """How the client encoded a frame.
+
+scale is the percentage of the captured size the frame was resized to,
+quality the JPEG quality, 0 for the OpenCV default, and gray True when
+the frame was encoded as grayscale.
+"""
+
+
+class ProtocolError(ValueError):
+    """Raised when a received message does not follow the wire format."""
+
+
+def pack_header(msg_type, frame_id=0, length=0, flags=0):
+    """Build one message header.
+
+    Args:
+        msg_type: An int representing the message type, one of MSG_*.
+        frame_id: Optional int representing the frame the message is about.
+        For a MSG_HELLO this is the number of frames in the session, 0 when
+        unknown, in which case the session ends with a MSG_END carrying the
+        number of frames sent. For a MSG_ACK this is the highest frame
+        received.
+        length: Optional int representing the payload length in bytes.
+        flags: Optional int representing message flags.
+
+    Returns:
+        The header as bytes.
+    """
+    return HEADER.pack(MAGIC, VERSION, msg_type, flags, frame_id, length)
+
+def pack_encoding(encoding):
+    """Pack the client encoding of a frame into header flags.
+
+    Args:
+        encoding: An Encoding, scale and quality between 1 and 100.
+
+    Returns:
+        An int fitting the flags field, 0 for a full size color frame at
+        the default quality.
+    """
+    flags = 0 if encoding.scale >= 100 else encoding.scale
+    flags |= (encoding.quality << ENC_QUALITY_SHIFT) & ENC_QUALITY_MASK
+    return flags | (ENC_GRAY if encoding.gray else 0)
+
+def unpack_encoding(flags):
+    """Read the client encoding of a frame from header flags.
+
+    Args:
+        flags: An int, the flags field of a MSG_FRAME header.
+
+    Returns:
+        An Encoding.
+    """
+    return Encoding((flags & ENC_SCALE_MASK) or 100,
+                    (flags & ENC_QUALITY_MASK) >> ENC_QUALITY_SHIFT,
+                    bool(flags & ENC_GRAY))
+
+def unpack_header(buf):
+    """Parse and validate one message header.
+
+    Args:
+        buf: A bytes-like object of exactly HEADER_LEN bytes.
+
+    Returns:
+        (msg_type, flags, frame_id, length): A tuple of ints.
+    """
+    magic, version, msg_type, flags, frame_id, length = HEADER.unpack(buf)
+    if magic != MAGIC:
+        raise ProtocolError("Bad magic " + repr(magic) + ".")
+    if version != VERSION:
+        raise ProtocolError("Unsupported version " + str(version) + ".")
+    return (msg_type, flags, frame_id, length)
+
+def recv_exact_into(sock, view):
+    """Fill view with exactly len(view) bytes from sock.
+
+    Args:
+        sock: A socket instance to read from.
+        view: A writable memoryview to fill.
+
+    Returns:
+        None
+    """
+    received = 0
+    while received < len(view):
+        nbytes = sock.recv_into(view[received:])
+        if nbytes == 0:
+            raise ConnectionError("Peer closed the connection.")
+        received += nbytes
+
+def sendall_vectored(sock, buffers):
+    """Send all buffers, in order, with as few syscalls as possible.
+
+    Relies on sendmsg to hand several buffers to the kernel at once and
+    resumes after short writes. Falls back to sendall when sendmsg is not
+    available on the platform.
+
+    Args:
+        sock: A socket instance to write to.
+        buffers: A list of bytes-like objects.
+
+    Returns:
+        None
+    """
+    if not hasattr(sock, 'sendmsg'):
+        for buf in buffers:
+            sock.sendall(buf)
+        return
+    pending = [memoryview(buf).cast('B') for buf in buffers if len(buf)]
+    while pending:
+        sent = sock.sendmsg(pending[:MAX_IOV])
+        while sent and sent >= len(pending[0]):
+            sent -= len(pending.pop(0))
+        if sent:
+            pending[0] = pending[0][sent:]
+
+def send_message(sock, msg_type, frame_id=0, payload=b'', flags=0):
+    """Send one message, header and payload.
+
+    Args:
+        sock: A socket instance to write to.
+        msg_type: An int representing the message type, one of MSG_*.
+        frame_id: Optional int representing the frame id field.
+        payload: Optional bytes-like object to send after the header.
+        flags: Optional int representing message flags.
+
+    Returns:
+        None
+    """
+    header = pack_header(msg_type, frame_id, len(payload), flags)
+    sendall_vectored(sock, [header, payload])
+
+def send_frames(sock, frames):
+    """Send several frames in one go.
+
+    In-memory payloads are packed into a single vectored send. Payloads
+    given as file locations are sent with socket.sendfile instead, so they
+    are never copied to user space.
+
+    Args:
+        sock: A socket instance to write to.
+        frames: A list of (frame_id, payload) tuples, payload being a
+        bytes-like object, a string representing a file location, a
+        SameFrame or an EncodedFrame wrapping a bytes-like object.
+
+    Returns:
+        None
+    """
+    buffers = []
+    for frame_id, payload in frames:
+        if isinstance(payload, SameFrame):
+            buffers.append(pack_header(MSG_SAME, frame_id, SAME_REF.size))
+            buffers.append(SAME_REF.pack(payload.ref))
+        elif isinstance(payload, str):
+            buffers.append(pack_header(MSG_FRAME, frame_id,
+                                       os.path.getsize(payload)))
+            sendall_vectored(sock, buffers)
+            buffers = []
+            tr.send_file(sock, payload)
+        else:
+            flags = 0
+            if isinstance(payload, EncodedFrame):
+                payload, flags = payload
+            buffers.append(pack_header(MSG_FRAME, frame_id, len(payload),
+                                       flags))
+            buffers.append(payload)
+    sendall_vectored(sock, buffers)
+
+
+class MessageReader:
+    """Reads wire format messages from one socket.
+
+    The header and the payload are received with recv_into into buffers
+    owned by the reader, so no memory is allocated per message once the
+    payload buffer has grown to the largest frame of the session.
+
+    Attributes:
+        sock: A socket instance to read from.
+        header: A bytearray receiving message headers.
+        buffer: A bytearray receiving message payloads.
+    """
+
+    def __init__(self, sock, bufsize=65536):
+        """Init MessageReader with a socket and an initial buffer size."""
+        self.sock = sock
+        self.header = bytearray(HEADER_LEN)
+        self.buffer = bytearray(bufsize)
+
+    def read(self, expected=None, into=None):
+        """Read one message.
+
+        The returned payload is a memoryview on the reader buffer and is
+        only valid until the next call to read, unless into provides the
+        buffer of a frame payload.
+
+        Args:
+            expected: Optional int, the message type the caller expects.
+            into: Optional callable taking the payload length of a
+            MSG_FRAME message and returning a writable memoryview of that
+            length to receive the payload in, for instance a shared memory
+            slot.
+
+        Returns:
+            A Message namedtuple.
+        """
+        recv_exact_into(self.sock, memoryview(self.header))
+        msg_type, flags, frame_id, length = unpack_header(self.header)
+        if expected is not None and msg_type != expected:
+            raise ProtocolError("Expected message type " + str(expected) +
+                                ", got " + str(msg_type) + ".")
+        if into is not None and msg_type == MSG_FRAME:
+            payload = into(length)
+        else:
+            if length > len(self.buffer):
+                self.buffer = bytearray(length)
+            payload = memoryview(self.buffer)[:length]
+        recv_exact_into(self.sock, payload)
+        return Message(msg_type, flags, frame_id, payload)
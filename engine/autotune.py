@@ -0,0 +1,147 @@
+"""
+Module supporting the AdaptiveDetector class, which tunes the detection
+parameters on the fly to keep the detection latency under a budget.
+
+function settings_ladder: Build the detection settings from the best
+quality to the cheapest within bounds.
+
+class AdaptiveDetector: Face detection whose cost follows a p95 latency
+target.
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+from engine.cascade import get_cascade
+from engine.facedetect import HAAR_CASC
+
+
+def settings_ladder(scales=(1.1, 1.2, 1.3), min_sizes=(20, 30, 40),
+                    downscales=(1.0, 0.75, 0.5)):
+    """Build the detection settings from the best quality to the cheapest.
+
+    Starting with the first value of every bound, each step makes one knob
+    cheaper, in turn downscale, scale factor and minimum size, until all
+    knobs reach their last value.
+
+    Args:
+        scales: An optional list of scale factors, increasing.
+        min_sizes: An optional list of minimum face sizes in full frame
+        pixels, increasing.
+        downscales: An optional list of input downscale ratios, decreasing.
+
+    Returns:
+        A list of dicts with scale, min_size and downscale keys.
+    """
+    knobs = [('downscale', downscales), ('scale', scales),
+             ('min_size', min_sizes)]
+    index = {name: 0 for name, _ in knobs}
+    ladder = [{name: values[0] for name, values in knobs}]
+    while any(index[name] + 1 < len(values) for name, values in knobs):
+        for name, values in knobs:
+            if index[name] + 1 < len(values):
+                index[name] += 1
+                ladder.append({knob: vals[index[knob]]
+                               for knob, vals in knobs})
+    return ladder
+
+
+class AdaptiveDetector:
+    """Face detection whose parameters follow a latency budget.
+
+    Settings come from a ladder, see settings_ladder, going from the best
+    quality to the cheapest settings allowed. The detection time of every
+    frame is measured and, once window frames ran at the current level,
+    the p95 latency is compared with the target: above it, the next
+    cheaper level is used, under target * hysteresis, the previous better
+    one. The settings used and the time taken for every frame are kept in
+    history, so quality trade-offs can be audited. One instance must see
+    the frames of a single sequence, in order, as other stateful detectors.
+    Frames decoded at a reduced size, see engine.facedetect.decode, are
+    searched for faces of min_size full frame pixels too, given reduce.
+
+    Attributes:
+        target_ms: A float representing the p95 latency target in ms.
+        ladder: A list of settings dicts, see settings_ladder.
+        level: An int, the index of the current settings in ladder.
+        window: An int representing the frames measured before a change.
+        hysteresis: A float, the fraction of target_ms under which better
+        settings are tried again.
+        neighbors: An int to adjust the classifier.
+        cascade: A string representing the cascade file location.
+        reduce: An int, the factor frames are reduced by before detect.
+        history: A list of (settings, ms) tuples, one per detected frame.
+    """
+
+    def __init__(self, target_ms=50.0, ladder=None, window=20,
+                 hysteresis=0.6, neighbors=5, cascade=HAAR_CASC, reduce=1):
+        """Init AdaptiveDetector at the best quality settings."""
+        self.target_ms = target_ms
+        self.ladder = ladder or settings_ladder()
+        self.level = 0
+        self.window = window
+        self.hysteresis = hysteresis
+        self.neighbors = neighbors
+        self.cascade = cascade
+        self.reduce = reduce
+        self.history = []
+        self._samples = []
+
+    @property
+    def settings(self):
+        """The settings dict the next frame will be detected with."""
+        return self.ladder[self.level]
+
+    def detect(self, image):
+        """Return the faces of the next frame and adapt the settings.
+
+        Args:
+            image: A grayscale numpy array holding the frame.
+
+        Returns:
+            A numpy array of (x, y, w, h) rows, one per face, in image
+            coordinates.
+        """
+        settings = self.settings
+        start = time.perf_counter()
+        ratio = settings['downscale']
+        small = image
+        if ratio != 1.0:
+            small = cv2.resize(image, None, fx=ratio, fy=ratio,
+                               interpolation=cv2.INTER_AREA)
+        min_side = max(1, int(settings['min_size'] * ratio / self.reduce))
+        faces = get_cascade(self.cascade).detectMultiScale(
+            small, settings['scale'], self.neighbors,
+            minSize=(min_side, min_side))
+        faces = np.array(faces, dtype=np.float64).reshape(-1, 4) / ratio
+        elapsed = (time.perf_counter() - start) * 1000
+        self.history.append((settings, elapsed))
+        self._adapt(elapsed)
+        return faces.round().astype(np.int32)
+
+    def p95(self):
+        """Return the p95 detection time in ms over the whole history.
+
+        Args:
+            None
+
+        Returns:
+            A float, 0.0 before the first frame.
+        """
+        if not self.history:
+            return 0.0
+        return float(np.percentile([ms for _, ms in self.history], 95))
+
+    def _adapt(self, elapsed):
+        """Move along the ladder once window frames were measured."""
+        self._samples.append(elapsed)
+        if len(self._samples) < self.window:
+            return
+        p95 = np.percentile(self._samples, 95)
+        self._samples = []
+        if p95 > self.target_ms and self.level + 1 < len(self.ladder):
+            self.level += 1
+        elif p95 < self.target_ms * self.hysteresis and self.level > 0:
+            self.level -= 1
@@ -0,0 +1,73 @@
+"""
+Module supporting the cascade registry, so a cascade file is parsed once
+instead of once per detection.
+
+function get_cascade: Return the cached classifier for a cascade file.
+
+function clear_cascades: Drop every cached classifier of the calling thread.
+
+function loads: Return how many times cascade files have been parsed.
+"""
+
+import os
+import threading
+
+import cv2
+
+_LOCAL = threading.local()
+_LOADS = [0]
+_LOADS_LOCK = threading.Lock()
+
+
+def get_cascade(path):
+    """Return the cached classifier for a cascade file.
+
+    Classifiers are cached per thread, keyed by absolute path, and reloaded
+    only when the file modification time changes. Keeping one classifier
+    per thread avoids sharing OpenCV objects between threads, while a
+    process running N detection threads parses the file N times in total
+    rather than once per frame. Pool workers are single threaded processes
+    and therefore load it once each.
+
+    Args:
+        path: A string representing the cascade file location.
+
+    Returns:
+        A cv2.CascadeClassifier instance.
+    """
+    path = os.path.abspath(path)
+    mtime = os.stat(path).st_mtime_ns
+    cache = getattr(_LOCAL, 'cache', None)
+    if cache is None:
+        cache = _LOCAL.cache = {}
+    entry = cache.get(path)
+    if entry is None or entry[0] != mtime:
+        classifier = cv2.CascadeClassifier(path)
+        if classifier.empty():
+            raise ValueError("Invalid cascade file " + path + ".")
+        entry = cache[path] = (mtime, classifier)
+        with _LOADS_LOCK:
+            _LOADS[0] += 1
+    return entry[1]
+
+def clear_cascades():
+    """Drop every cached classifier of the calling thread.
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+    _LOCAL.cache = {}
+
+def loads():
+    """Return how many times cascade files have been parsed.
+
+    Args:
+        None
+
+    Returns:
+        An int counting cascade loads in this process, all threads included.
+    """
+    return _LOADS[0]
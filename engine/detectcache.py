@@ -0,0 +1,153 @@
+"""
+Module supporting the DetectionCache class, which remembers the faces found
+on encoded frames so that identical frames are not detected twice.
+
+class DetectionCache: Content-hash keyed detection results, with an LRU
+in-memory tier and an optional on-disk tier.
+"""
+
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from engine.facedetect import HAAR_CASC
+
+
+class DetectionCache:
+    """Detection results keyed by the content of the encoded frame.
+
+    Keys are a BLAKE2b digest of the encoded frame bytes together with the
+    detection parameters and the cascade file identity, so a changed
+    cascade file or different settings never return stale faces. The most
+    recently used results are kept in memory, up to maxsize entries. When
+    path is set, every result is also written there as one .npy file per
+    key, which survives restarts and is read back on memory misses. The
+    cache may be shared by several threads.
+
+    Only stateless detection may be cached: results of tracking or region
+    detectors depend on the previous frames.
+
+    Attributes:
+        maxsize: An int representing the number of results kept in memory.
+        path: A string representing the on-disk tier folder, None for
+        memory only.
+        hits: An int counting lookups answered from memory.
+        disk_hits: An int counting lookups answered from disk.
+        misses: An int counting lookups not answered.
+    """
+
+    def __init__(self, maxsize=1024, path=None):
+        """Init DetectionCache and create its on-disk folder."""
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def key(self, data, scale=1.1, neighbors=5, cascade=HAAR_CASC,
+            **options):
+        """Return the cache key of an encoded frame and its settings.
+
+        Args:
+            data: A bytes-like object holding the encoded frame.
+            scale: An optional float, the classifier scale factor.
+            neighbors: An optional int, the classifier min neighbors.
+            cascade: An optional string representing the cascade file.
+            options: Any other setting changing the result, such as reduce.
+
+        Returns:
+            A string of hexadecimal digits.
+        """
+        cascade = os.path.abspath(cascade)
+        params = (scale, neighbors, cascade, os.stat(cascade).st_mtime_ns,
+                  sorted(options.items()))
+        digest = hashlib.blake2b(data, digest_size=16)
+        digest.update(repr(params).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the faces cached for a key.
+
+        Args:
+            key: A string returned by key.
+
+        Returns:
+            A numpy array of (x, y, w, h) rows, None on a miss.
+        """
+        with self._lock:
+            faces = self._entries.get(key)
+            if faces is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return faces
+        if self.path is not None:
+            try:
+                faces = np.load(self._file(key))
+            except (OSError, ValueError):
+                faces = None
+        with self._lock:
+            if faces is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, faces)
+        return faces
+
+    def put(self, key, faces):
+        """Cache the faces found for a key.
+
+        Args:
+            key: A string returned by key.
+            faces: An array list of (x, y, w, h) boxes. None, the result of
+            an invalid frame, is not cached.
+
+        Returns:
+            None
+        """
+        if faces is None:
+            return
+        faces = np.array(faces, dtype=np.int32).reshape(-1, 4)
+        with self._lock:
+            self._remember(key, faces)
+        if self.path is not None:
+            # Write then rename, concurrent readers never see a partial file.
+            filedesc, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            with os.fdopen(filedesc, 'wb') as tmpfile:
+                np.save(tmpfile, faces)
+            os.replace(tmp, self._file(key))
+
+    def stats(self):
+        """Return the cache counters.
+
+        Args:
+            None
+
+        Returns:
+            A dict with hits, disk_hits, misses, hit_rate and size.
+        """
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {'hits': self.hits, 'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'hit_rate': ((self.hits + self.disk_hits) / lookups
+                                 if lookups else 0.0),
+                    'size': len(self._entries)}
+
+    def _remember(self, key, faces):
+        """Insert in the memory tier, evicting the least recently used."""
+        self._entries[key] = faces
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _file(self, key):
+        """Return the on-disk tier file of a key."""
+        return os.path.join(self.path, key + '.npy')
@@ -0,0 +1,212 @@
+"""
+Module supporting the DetectionPool class, which spreads the face detection
+over several processes.
+
+class DetectionPool: Pool of worker processes, each owning a preloaded
+cascade classifier, reading frames from disk or from a shared memory
+FrameRing.
+
+Stage metrics, see common.metrics, are timed in the workers and recorded
+in the registry of the process owning the pool.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+
+import cv2
+
+import common.metrics as mt
+from engine.cascade import get_cascade
+from engine.facedetect import FaceDetect, HAAR_CASC
+from engine.shmring import FrameRing
+
+_RINGS = {}
+
+
+def _init_worker(cascade):
+    """Load the cascade once per worker process."""
+    get_cascade(cascade)
+    cv2.setNumThreads(1)
+
+def _detect_image(source, cascade, scale, neighbors, save_as):
+    """Decode, detect and optionally save one frame, timing every stage.
+
+    Returns:
+        (faces, stages): The faces found, None for an invalid image, and a
+        dict mapping the stages run to their duration in seconds.
+    """
+    stages = {}
+    start = time.perf_counter()
+    detection = FaceDetect(source)
+    faces = None
+    if detection.isvalid():
+        start = _lap(stages, 'decode', start)
+        faces = get_cascade(cascade).detectMultiScale(detection.image, scale,
+                                                      neighbors)
+        start = _lap(stages, 'detect', start)
+        if save_as is not None:
+            detection.image = detection.drawrectangle(faces)
+            start = _lap(stages, 'draw', start)
+            detection.saveimage(save_as)
+            _lap(stages, 'save', start)
+    return (faces, stages)
+
+def _lap(stages, stage, start):
+    """Record the time since start as stage and return the current time."""
+    now = time.perf_counter()
+    stages[stage] = now - start
+    return now
+
+def _detect_worker(task):
+    """Run the detection on one frame inside a worker process."""
+    frame, frame_name, cascade, scale, neighbors, annotate = task
+    start = time.perf_counter()
+    faces, stages = _detect_image(frame_name, cascade, scale, neighbors,
+                                  frame_name if annotate else None)
+    return (frame, faces, os.getpid(), time.perf_counter() - start, stages)
+
+def _detect_slot_worker(task):
+    """Run the detection on one FrameRing slot inside a worker process.
+
+    The frame is decoded straight from the shared memory. When save_loc is
+    set, the annotated frame is saved there as frameN.jpg.
+    """
+    frame, ring, slot, cascade, scale, neighbors, save_loc = task
+    start = time.perf_counter()
+    if ring[0] not in _RINGS:
+        _RINGS[ring[0]] = FrameRing.attach(*ring)
+    faces, stages = _detect_image(
+        _RINGS[ring[0]].payload(slot), cascade, scale, neighbors,
+        None if save_loc is None else
+        save_loc + "frame" + str(frame) + ".jpg")
+    return (frame, faces, os.getpid(), time.perf_counter() - start, stages)
+
+
+class DetectionPool:
+    """Distributes face detection over a pool of worker processes.
+
+    Every worker loads the cascade once when it starts, and runs OpenCV
+    single threaded so that N workers use N cores without oversubscribing
+    them. Results are always returned in frame order.
+
+    Attributes:
+        processes: An int representing the number of worker processes.
+        cascade: A string representing the cascade file location.
+        scale: A float to adjust the classifier.
+        neighbors: An int to adjust the classifier.
+        chunksize: An int representing the frames sent to a worker at once
+        by detect_all.
+        stats: A dict mapping worker pids to [frames, busy seconds].
+    """
+
+    def __init__(self, processes=None, cascade=HAAR_CASC, scale=1.1,
+                 neighbors=5, chunksize=1):
+        """Init DetectionPool and start its worker processes."""
+        self.processes = processes or os.cpu_count()
+        self.cascade = cascade
+        self.scale = scale
+        self.neighbors = neighbors
+        self.chunksize = chunksize
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._pool = multiprocessing.Pool(self.processes, _init_worker,
+                                          (cascade,))
+
+    def detect_all(self, frame_names, annotate=False):
+        """Run the detection on a sequence of frames.
+
+        Args:
+            frame_names: An iterable of strings representing frame locations.
+            annotate: Optional boolean, True to overwrite every frame with
+            the detected faces drawn on it.
+
+        Returns:
+            A generator of (frame, faces) tuples, in frame order. Frame is
+            the index in frame_names, faces is None for invalid images.
+        """
+        tasks = ((frame, frame_name, self.cascade, self.scale, self.neighbors,
+                  annotate)
+                 for frame, frame_name in enumerate(frame_names))
+        for result in self._pool.imap(_detect_worker, tasks, self.chunksize):
+            yield self._record(result)
+
+    def detect_one(self, frame_name, annotate=True):
+        """Run the detection on one frame in a worker process.
+
+        Blocks until the result is available, but may be called from
+        several threads at once, for instance from a DetectionPipeline.
+
+        Args:
+            frame_name: A string representing the frame location.
+            annotate: Optional boolean, True to overwrite the frame with the
+            detected faces drawn on it.
+
+        Returns:
+            The faces found, None for an invalid image.
+        """
+        task = (0, frame_name, self.cascade, self.scale, self.neighbors,
+                annotate)
+        return self._record(self._pool.apply(_detect_worker, (task,)))[1]
+
+    def detect_slot(self, ring, slot, frame=0, save_loc=None):
+        """Run the detection on one FrameRing slot in a worker process.
+
+        Only the slot index crosses the process boundary, the worker reads
+        the frame in place. The slot is released once the worker is done.
+        Blocks until the result is available, see detect_one.
+
+        Args:
+            ring: An engine.shmring.FrameRing owned by this process.
+            slot: An int representing the slot holding the encoded frame.
+            frame: Optional int representing the frame number.
+            save_loc: Optional string representing the folder to save the
+            annotated frame in, None to save nothing.
+
+        Returns:
+            The faces found, None for an invalid image.
+        """
+        task = (frame, (ring.name, ring.slots, ring.slot_size), slot,
+                self.cascade, self.scale, self.neighbors, save_loc)
+        try:
+            result = self._pool.apply(_detect_slot_worker, (task,))
+        finally:
+            ring.release(slot)
+        return self._record(result)[1]
+
+    def throughput(self):
+        """Return the detection throughput of every worker.
+
+        Args:
+            None
+
+        Returns:
+            A dict mapping worker pids to frames per busy second.
+        """
+        with self._lock:
+            return {pid: frames / busy if busy else 0.0
+                    for pid, (frames, busy) in self.stats.items()}
+
+    def close(self):
+        """Stop the worker processes.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._pool.close()
+        self._pool.join()
+
+    def _record(self, result):
+        """Account one worker result and strip the worker fields."""
+        frame, faces, pid, elapsed, stages = result
+        with self._lock:
+            stat = self.stats.setdefault(pid, [0, 0.0])
+            stat[0] += 1
+            stat[1] += elapsed
+        for stage, seconds in stages.items():
+            mt.registry().observe(stage, seconds)
+        return (frame, faces)
@@ -3,12 +3,141 @@ Module support the engine route, more specifically, the FaceDetect class.
 Provides support for face detection on one or a set of frames.
 
 class FaceDetect: Provide face detection support for an image.
+
+function decode: Decode an image file or buffer to grayscale, optionally at
+a reduced size.
+
+function make_tiles: Split an image into overlapping tiles.
+
+function suppress: Merge duplicate boxes with non-maximum suppression.
 """
 
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
+import numpy as np
+
+from engine.cascade import get_cascade
 
 HAAR_CASC = "engine/haarcascade_frontalface_alt.xml"
 
+REDUCED_FLAGS = {1: cv2.IMREAD_GRAYSCALE,
+                 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                 4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+# Side, in pixels, max_face is downscaled to when detect_tiled searches
+# faces too large for its tiles.
+LARGE_FACE_SIDE = 48
+
+_EXECUTORS = {}
+_EXECUTORS_LOCK = threading.Lock()
+
+
+def decode(image, reduce=1):
+    """Decode an image file or buffer to grayscale.
+
+    With reduce set to 2, 4 or 8, JPEG images are decoded straight to
+    1/reduce of their size, which is much cheaper than a full decode.
+
+    Already decoded BGR or grayscale frames, such as those read from a
+    video file, are converted and resized instead.
+
+    Args:
+        image: A string representing the image location, a bytes-like
+        object holding the encoded image or a numpy array holding a
+        decoded frame.
+        reduce: An optional int, one of REDUCED_FLAGS keys.
+
+    Returns:
+        A numpy array, None if the image could not be decoded.
+    """
+    if isinstance(image, np.ndarray):
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if reduce > 1:
+            height, width = image.shape[:2]
+            image = cv2.resize(image, ((width + reduce - 1) // reduce,
+                                       (height + reduce - 1) // reduce),
+                               interpolation=cv2.INTER_AREA)
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return cv2.imdecode(np.frombuffer(image, np.uint8),
+                            REDUCED_FLAGS[reduce])
+    return cv2.imread(image, REDUCED_FLAGS[reduce])
+
+def make_tiles(width, height, tile=1024, overlap=256):
+    """Split a width x height image into overlapping tiles.
+
+    Consecutive tiles share overlap pixels, so that any face up to overlap
+    pixels wide lies entirely within at least one tile. The last tile of a
+    row or column is aligned on the image edge.
+
+    Args:
+        width: An int representing the image width.
+        height: An int representing the image height.
+        tile: An optional int representing the tile side.
+        overlap: An optional int representing the overlap between tiles,
+        lower than tile.
+
+    Returns:
+        A list of (x, y, w, h) tuples, one per tile.
+    """
+    def starts(length):
+        if length <= tile:
+            return [0]
+        step = tile - overlap
+        positions = list(range(0, length - tile, step))
+        return positions + [length - tile]
+    return [(x, y, min(tile, width), min(tile, height))
+            for y in starts(height) for x in starts(width)]
+
+def suppress(boxes, threshold=0.5):
+    """Merge duplicate boxes with non-maximum suppression.
+
+    Haar detections carry no score, so larger boxes win. A box is dropped
+    when its intersection with a kept box covers more than threshold of the
+    smaller of the two, which also removes faces cut in half by a tile
+    seam and found whole on the neighbouring tile.
+
+    Args:
+        boxes: An array list of (x, y, w, h) boxes.
+        threshold: An optional float representing the overlap over which
+        two boxes are considered the same face.
+
+    Returns:
+        A numpy array of the kept (x, y, w, h) rows.
+    """
+    boxes = np.array(boxes, dtype=np.int32).reshape(-1, 4)
+    areas = boxes[:, 2] * boxes[:, 3]
+    order = np.argsort(-areas, kind='stable')
+    right = boxes[:, 0] + boxes[:, 2]
+    bottom = boxes[:, 1] + boxes[:, 3]
+    keep = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        inter_w = np.clip(np.minimum(right[best], right[rest]) -
+                          np.maximum(boxes[best, 0], boxes[rest, 0]), 0, None)
+        inter_h = np.clip(np.minimum(bottom[best], bottom[rest]) -
+                          np.maximum(boxes[best, 1], boxes[rest, 1]), 0, None)
+        cover = inter_w * inter_h / np.minimum(areas[best], areas[rest])
+        order = rest[cover <= threshold]
+    return boxes[keep]
+
+def _tile_executor(workers):
+    """Return the shared tile thread pool for a number of workers.
+
+    Pools outlive detect_tiled calls so that their threads keep the
+    classifiers cached by engine.cascade.
+    """
+    with _EXECUTORS_LOCK:
+        if workers not in _EXECUTORS:
+            _EXECUTORS[workers] = ThreadPoolExecutor(
+                workers, thread_name_prefix='tile')
+        return _EXECUTORS[workers]
+
 
 class FaceDetect:
     """Provides support for face detection.
@@ -16,12 +145,17 @@ class FaceDetect:
     One instance can only work on one frame or image at a time.
 
     Attributes:
-        image: A string representating the image to act on.
+        image: A string representating the image to act on, or a bytes-like
+        object holding the encoded image, decoded in memory.
+        reduce: An int, the image is decoded at 1/reduce of its size. Faces
+        are always returned in full resolution coordinates.
     """
 
-    def __init__(self, image=None):
+    def __init__(self, image=None, reduce=1):
         """Init FaceDetect with one image and turn it to grayscale."""
-        self.image = cv2.imread(image, 0)
+        self.reduce = reduce
+        self._source = image
+        self.image = decode(image, reduce)
 
     def isvalid(self):
         """Check if attribute has been set.
@@ -89,35 +223,158 @@ class FaceDetect:
         """
         self.image = img
 
-    def detect(self, scale=1.1, neighbors=5):
+    def detect(self, scale=1.1, neighbors=5, cascade=HAAR_CASC,
+               refine=False):
         """Detect if a face is found.
 
         Use a cascade classifier from cv2 library to determine whether or
         not the attribute image has a face in it. Relies on an external
-        XML library, based on HAAR classifier.
+        XML library, based on HAAR classifier, loaded once and cached by
+        engine.cascade.
 
         Args:
             scale: An optional float to adjust the classifier.
             neighbors: An optional int to adjust the classifier.
+            cascade: An optional string representing the cascade file.
+            refine: An optional boolean. When the image has been decoded at
+            a reduced size, True refines every face on the full resolution
+            image, around the face only.
 
         Returns:
             A list of faces if faces are found. None if the image is invalid.
         """
         if self.isvalid():
-            haar_face_casc = cv2.CascadeClassifier(HAAR_CASC)
+            haar_face_casc = get_cascade(cascade)
             faces = haar_face_casc.detectMultiScale(self.image,
                                                     scale,
                                                     neighbors)
-            print('Faces found: ', len(faces))
+            faces = self.tofullres(faces)
+            if refine and self.reduce > 1:
+                faces = self.refine(faces, scale, neighbors, cascade)
             return faces
         print('Image format invalid.')
         return None
 
+    def detect_tiled(self, tile=1024, max_face=256, workers=None, scale=1.1,
+                     neighbors=5, cascade=HAAR_CASC):
+        """Detect faces on a very large image, tile by tile, in parallel.
+
+        The image is split into overlapping tiles, overlapping by max_face
+        pixels, and every tile is searched by a pool of threads for faces
+        up to max_face pixels wide. Faces larger than max_face are searched
+        on the whole image downscaled so that max_face becomes
+        LARGE_FACE_SIDE pixels, which is cheap, in the same pool. OpenCV
+        releases the GIL during detection, so tiles run concurrently on
+        multi-core hosts. Faces found twice, across tile seams or by both
+        searches, are merged by suppress.
+
+        Args:
+            tile: An optional int representing the tile side, raised to
+            twice max_face if lower.
+            max_face: An optional int representing the largest face
+            searched within tiles, in decoded image pixels.
+            workers: An optional int representing the number of threads,
+            defaults to the ThreadPoolExecutor default.
+            scale: An optional float to adjust the classifier.
+            neighbors: An optional int to adjust the classifier.
+            cascade: An optional string representing the cascade file.
+
+        Returns:
+            A list of faces if faces are found. None if the image is invalid.
+        """
+        if not self.isvalid():
+            print('Image format invalid.')
+            return None
+        height, width = self.image.shape[:2]
+        tiles = make_tiles(width, height, max(tile, 2 * max_face), max_face)
+
+        def detect_tile(region):
+            x, y, w, h = region
+            faces = get_cascade(cascade).detectMultiScale(
+                self.image[y:y + h, x:x + w], scale, neighbors,
+                maxSize=(max_face, max_face))
+            return [(x + fx, y + fy, fw, fh) for (fx, fy, fw, fh) in faces]
+
+        def detect_large():
+            ratio = min(1.0, LARGE_FACE_SIDE / max_face)
+            small = cv2.resize(self.image, None, fx=ratio, fy=ratio,
+                               interpolation=cv2.INTER_AREA)
+            side = int(max_face * ratio)
+            faces = get_cascade(cascade).detectMultiScale(
+                small, scale, neighbors, minSize=(side, side))
+            return [tuple(int(round(v / ratio)) for v in face)
+                    for face in faces]
+
+        executor = _tile_executor(workers)
+        large = executor.submit(detect_large)
+        found = [face for faces in executor.map(detect_tile, tiles)
+                 for face in faces]
+        found.extend(large.result())
+        return self.tofullres(suppress(found))
+
+    def tofullres(self, faces):
+        """Map faces found on the reduced image to full resolution.
+
+        Args:
+            faces: An array list representing faces location on image.
+
+        Returns:
+            The faces in full resolution coordinates.
+        """
+        if self.reduce == 1:
+            return faces
+        return np.array(faces, dtype=np.int32).reshape(-1, 4) * self.reduce
+
+    def refine(self, faces, scale=1.1, neighbors=5, cascade=HAAR_CASC,
+               margin=0.25):
+        """Refine faces found at a reduced size on the full resolution image.
+
+        The full resolution image is decoded once, then every face is
+        searched again in a small region around it, at sizes close to its
+        own. Faces not found again are kept as they are.
+
+        Args:
+            faces: An array list representing faces location, full
+            resolution coordinates.
+            scale: An optional float to adjust the classifier.
+            neighbors: An optional int to adjust the classifier.
+            cascade: An optional string representing the cascade file.
+            margin: An optional float representing the region growth around
+            every face, as a fraction of its size.
+
+        Returns:
+            The refined faces.
+        """
+        if len(faces) == 0:
+            return faces
+        full = decode(self._source)
+        height, width = full.shape[:2]
+        haar_face_casc = get_cascade(cascade)
+        refined = []
+        for (x, y, w, h) in faces:
+            pad_x, pad_y = int(w * margin), int(h * margin)
+            left, top = max(0, x - pad_x), max(0, y - pad_y)
+            found = haar_face_casc.detectMultiScale(
+                full[top:min(height, y + h + pad_y),
+                     left:min(width, x + w + pad_x)],
+                scale, neighbors,
+                minSize=(int(w * 0.8), int(h * 0.8)),
+                maxSize=(int(w * 1.25), int(h * 1.25)))
+            if len(found) == 0:
+                refined.append((x, y, w, h))
+                continue
+            center = np.array([x + w / 2.0, y + h / 2.0])
+            best = min(found, key=lambda f: np.linalg.norm(
+                center - (left + f[0] + f[2] / 2.0, top + f[1] + f[3] / 2.0)))
+            refined.append((left + best[0], top + best[1], best[2], best[3]))
+        return np.array(refined, dtype=np.int32).reshape(-1, 4)
+
     def drawrectangle(self, faces):
         """Draw rectangles on the picture based on faces.
 
         Takes the face list from the detect method output and draw rectangles
-        where faces are supposed to be on the frame.
+        where faces are supposed to be on the frame. Faces are in full
+        resolution coordinates and scaled down to the decoded image.
 
         Args:
             faces: An array list representing faces location.
@@ -126,13 +383,34 @@ class FaceDetect:
             The modified frame.
         """
         if self.isvalid():
-            for (coordx, coordy, width, height) in faces:
-                cv2.rectangle(self.image, (coordx, coordy),
-                              (coordx+width, coordy+height), (0, 255, 0), 2)
+            boxes = np.array(faces, dtype=np.int32).reshape(-1, 4)
+            if len(boxes):
+                boxes //= self.reduce
+                left, top = boxes[:, 0], boxes[:, 1]
+                right, bottom = left + boxes[:, 2], top + boxes[:, 3]
+                corners = np.stack([left, top, right, top, right, bottom,
+                                    left, bottom], axis=1).reshape(-1, 4, 2)
+                cv2.polylines(self.image, list(corners), True, (0, 255, 0),
+                              2)
             return self.image
         print('Image format invalid.')
         return None
 
+    def encode(self, ext='.jpg'):
+        """Encode image in memory.
+
+        Args:
+            ext: An optional string representing the image format.
+
+        Returns:
+            The encoded image as bytes. None if the image is invalid.
+        """
+        if self.isvalid():
+            _, buf = cv2.imencode(ext, self.image)
+            return buf.tobytes()
+        print('Image format invalid.')
+        return None
+
     def saveimage(self, loc):
         """Save image to a location specified by loc.
 
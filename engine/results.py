@@ -0,0 +1,138 @@
+"""
+Module supporting the ResultStore class, which keeps the faces found during
+a session in one compact table instead of only drawing them.
+
+function to_records: Turn the faces of one frame into result rows.
+
+function load_results: Memory-map a result file written by ResultStore.
+
+class ResultStore: Append the result rows of a session to a binary file
+and stream them as JSON.
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+RESULT_DTYPE = np.dtype([('frame_id', '<u4'), ('x', '<i4'), ('y', '<i4'),
+                         ('w', '<i4'), ('h', '<i4'), ('score', '<f4')])
+
+
+def to_records(frame, faces, scores=None):
+    """Turn the faces of one frame into result rows.
+
+    Args:
+        frame: An int representing the frame number.
+        faces: An array list of (x, y, w, h) boxes, None for an invalid
+        frame.
+        scores: An optional array list of one float per face. Detectors
+        that do not score faces get 1.0.
+
+    Returns:
+        A numpy array of RESULT_DTYPE, one row per face.
+    """
+    boxes = np.array([] if faces is None else faces,
+                     dtype=np.int32).reshape(-1, 4)
+    records = np.empty(len(boxes), dtype=RESULT_DTYPE)
+    records['frame_id'] = frame
+    records['x'], records['y'] = boxes[:, 0], boxes[:, 1]
+    records['w'], records['h'] = boxes[:, 2], boxes[:, 3]
+    records['score'] = 1.0 if scores is None else scores
+    return records
+
+def load_results(path):
+    """Memory-map a result file written by ResultStore.
+
+    Nothing is read until rows are accessed, so thousands of frames can be
+    queried column by column, e.g. results['frame_id'] == 42.
+
+    Args:
+        path: A string representing the result file location.
+
+    Returns:
+        A read-only numpy array of RESULT_DTYPE.
+    """
+    try:
+        return np.memmap(path, dtype=RESULT_DTYPE, mode='r')
+    except ValueError:
+        # np.memmap refuses empty files, i.e. sessions without faces.
+        return np.empty(0, dtype=RESULT_DTYPE)
+
+
+class ResultStore:
+    """Keeps the faces found during a session, one row per face.
+
+    Rows of (frame_id, x, y, w, h, score) are appended to a raw binary file
+    of RESULT_DTYPE records as soon as a frame is processed, which
+    load_results memory-maps without parsing anything. When json_loc is
+    set, the same results are streamed there as a JSON list with one entry
+    per frame, closed by close. Frames are stored in completion order,
+    which may differ from frame order when several workers run. add may be
+    called from several threads.
+
+    Attributes:
+        path: A string representing the binary result file location.
+        json_loc: A string representing the JSON file location, None to
+        write the binary file only.
+        rows: An int counting the rows written.
+        frames: An int counting the frames added.
+    """
+
+    def __init__(self, path, json_loc=None):
+        """Init ResultStore and truncate its files."""
+        self.path = path
+        self.json_loc = json_loc
+        self.rows = 0
+        self.frames = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb')
+        self._json = None
+        if json_loc is not None:
+            os.makedirs(os.path.dirname(json_loc) or '.', exist_ok=True)
+            self._json = open(json_loc, 'w')
+            self._json.write('[')
+
+    def add(self, frame, faces, scores=None):
+        """Store the faces of one frame.
+
+        Args:
+            frame: An int representing the frame number.
+            faces: An array list of (x, y, w, h) boxes, None for an invalid
+            frame.
+            scores: An optional array list of one float per face.
+
+        Returns:
+            None
+        """
+        records = to_records(frame, faces, scores)
+        with self._lock:
+            self._file.write(records.tobytes())
+            self._file.flush()
+            if self._json is not None:
+                entry = {'frame': int(frame),
+                         'faces': [[int(rec['x']), int(rec['y']),
+                                    int(rec['w']), int(rec['h']),
+                                    float(rec['score'])]
+                                   for rec in records]}
+                self._json.write((',\n' if self.frames else '\n') +
+                                 json.dumps(entry))
+                self._json.flush()
+            self.rows += len(records)
+            self.frames += 1
+
+    def close(self):
+        """Terminate the JSON list and close both files.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._file.close()
+            if self._json is not None:
+                self._json.write('\n]\n')
+                self._json.close()
@@ -0,0 +1,116 @@
+"""
+Module supporting the RoiDetector class, which searches for faces around the
+faces of the previous frame before scanning the whole image.
+
+class RoiDetector: Incremental face detection seeded from the previous
+frame.
+"""
+
+import numpy as np
+
+from engine.cascade import get_cascade
+from engine.facedetect import HAAR_CASC
+
+
+class RoiDetector:
+    """Incremental face detection for consecutive frames of a session.
+
+    Faces rarely move far or change size much from one frame to the next.
+    Once faces have been found, the next frame is only scanned in a region
+    of interest around every previous box, and only at scales close to the
+    previous face size, through minSize and maxSize. A full-frame scan
+    still runs every full_every frames, to pick up new faces, and whenever
+    one region comes up empty. One instance must see the frames of a
+    single sequence, in order.
+
+    Attributes:
+        full_every: An int representing the maximum number of frames
+        between two full-frame scans.
+        margin: A float representing the region growth around the previous
+        box, as a fraction of its size.
+        size_tolerance: A float representing how much a face may shrink or
+        grow between two frames, as a fraction of its size.
+        scale: A float to adjust the classifier.
+        neighbors: An int to adjust the classifier.
+        cascade: A string representing the cascade file location.
+        full_scans: An int counting the full-frame scans.
+        roi_scans: An int counting the frames handled by region scans only.
+    """
+
+    def __init__(self, full_every=30, margin=0.5, size_tolerance=0.3,
+                 scale=1.1, neighbors=5, cascade=HAAR_CASC):
+        """Init RoiDetector with its region and fallback settings."""
+        self.full_every = full_every
+        self.margin = margin
+        self.size_tolerance = size_tolerance
+        self.scale = scale
+        self.neighbors = neighbors
+        self.cascade = cascade
+        self.full_scans = 0
+        self.roi_scans = 0
+        self._boxes = []
+        self._since_full = None
+
+    def detect(self, image):
+        """Return the faces of the next frame of the sequence.
+
+        Args:
+            image: A grayscale numpy array holding the frame.
+
+        Returns:
+            A numpy array of (x, y, w, h) rows, one per face.
+        """
+        faces = None
+        if (self._boxes and self._since_full is not None and
+                self._since_full + 1 < self.full_every):
+            faces = self._scan_regions(image)
+        if faces is None:
+            faces = self._scan_full(image)
+        else:
+            self._since_full += 1
+            self.roi_scans += 1
+        self._boxes = faces.tolist()
+        return faces
+
+    def _scan_full(self, image):
+        """Scan the whole image at every scale."""
+        faces = get_cascade(self.cascade).detectMultiScale(image, self.scale,
+                                                           self.neighbors)
+        self._since_full = 0
+        self.full_scans += 1
+        return np.array(faces, dtype=np.int32).reshape(-1, 4)
+
+    def _scan_regions(self, image):
+        """Scan around every previous box, None if one comes up empty."""
+        classifier = get_cascade(self.cascade)
+        height, width = image.shape[:2]
+        found = []
+        for (x, y, w, h) in self._boxes:
+            pad_x, pad_y = int(w * self.margin), int(h * self.margin)
+            left, top = max(0, x - pad_x), max(0, y - pad_y)
+            right = min(width, x + w + pad_x)
+            bottom = min(height, y + h + pad_y)
+            low = 1.0 - self.size_tolerance
+            high = 1.0 + self.size_tolerance
+            faces = classifier.detectMultiScale(
+                image[top:bottom, left:right], self.scale, self.neighbors,
+                minSize=(int(w * low), int(h * low)),
+                maxSize=(int(w * high), int(h * high)))
+            if len(faces) == 0:
+                return None
+            for (fx, fy, fw, fh) in faces:
+                box = (left + fx, top + fy, fw, fh)
+                if not any(_overlap(box, kept) > 0.5 for kept in found):
+                    found.append(box)
+        return np.array(found, dtype=np.int32).reshape(-1, 4)
+
+
+def _overlap(box_a, box_b):
+    """Return the intersection over union of two (x, y, w, h) boxes."""
+    ax, ay, aw, ah = box_a
+    bx, by, bw, bh = box_b
+    inter_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    inter_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = inter_w * inter_h
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
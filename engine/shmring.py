@@ -0,0 +1,168 @@
+"""
+Module supporting the FrameRing class, a ring of fixed size shared memory
+slots through which received frames reach detection processes without
+being copied or pickled.
+
+function slot_size_for: Return the slot size fitting the frames of a
+resolution.
+
+class FrameRing: Fixed size frame slots in one shared memory block.
+"""
+
+import collections
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+def slot_size_for(width, height, channels=3):
+    """Return the slot size fitting the frames of a resolution.
+
+    A slot holds the raw pixels of a frame, which bounds its encoded size
+    in practice.
+
+    Args:
+        width: An int representing the frame width.
+        height: An int representing the frame height.
+        channels: An optional int representing the channels per pixel.
+
+    Returns:
+        An int representing a size in bytes.
+    """
+    return width * height * channels
+
+
+class FrameRing:
+    """Fixed size frame slots in one shared memory block.
+
+    The owner, typically the receiver, creates the block and hands out
+    free slots in turn: the payload of a frame is received straight into a
+    slot, a worker process attached to the block by name reads it in place
+    and the owner releases the slot once the worker is done. When every
+    slot is in use, acquire blocks, which slows down the receiver instead
+    of buffering frames. The block starts with the payload length of every
+    slot, followed by the slots themselves. Slots are handed out and
+    released from the owner process only, possibly from several threads.
+
+    Attributes:
+        slots: An int representing the number of slots.
+        slot_size: An int representing the size of a slot in bytes.
+        name: A string representing the shared memory block name, used by
+        attach.
+        owner: A boolean, True in the process that created the block.
+    """
+
+    def __init__(self, slots=8, slot_size=slot_size_for(1920, 1080),
+                 name=None):
+        """Init FrameRing, creating its block unless name is given."""
+        self.slots = slots
+        self.slot_size = slot_size
+        self.owner = name is None
+        self._shm = shared_memory.SharedMemory(
+            name=name, create=self.owner,
+            size=slots * (slot_size + 8) if self.owner else 0)
+        self.name = self._shm.name
+        if not self.owner:
+            # Only the owner frees the block, the resource tracker of an
+            # attached process would unlink it when that process exits.
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+        self._lengths = np.ndarray((slots,), dtype='<u8',
+                                   buffer=self._shm.buf)
+        self._data = np.ndarray((slots, slot_size), dtype=np.uint8,
+                                buffer=self._shm.buf, offset=slots * 8)
+        self._free = collections.deque(range(slots))
+        self._cond = threading.Condition()
+
+    @classmethod
+    def attach(cls, name, slots, slot_size):
+        """Attach to the block of a FrameRing created by another process.
+
+        Args:
+            name: A string, the name attribute of the owner ring.
+            slots: An int, the slots attribute of the owner ring.
+            slot_size: An int, the slot_size attribute of the owner ring.
+
+        Returns:
+            A FrameRing reading the same slots.
+        """
+        return cls(slots, slot_size, name)
+
+    def acquire(self, length):
+        """Reserve a free slot for a payload of length bytes.
+
+        Blocks until a slot is released when all of them are in use.
+
+        Args:
+            length: An int representing the payload size in bytes.
+
+        Returns:
+            (slot, view): The int slot index and a writable memoryview of
+            exactly length bytes to fill with the payload.
+
+        Raises:
+            ValueError: The payload does not fit in a slot.
+        """
+        if length > self.slot_size:
+            raise ValueError("Frame of %d bytes exceeds the %d bytes slots."
+                             % (length, self.slot_size))
+        with self._cond:
+            self._cond.wait_for(lambda: self._free)
+            slot = self._free.popleft()
+        self._lengths[slot] = length
+        return (slot, memoryview(self._data[slot, :length]))
+
+    def write(self, payload):
+        """Copy a payload already in memory into a free slot.
+
+        Args:
+            payload: A bytes-like object.
+
+        Returns:
+            An int representing the slot index.
+        """
+        slot, view = self.acquire(len(payload))
+        view[:] = payload
+        return slot
+
+    def payload(self, slot):
+        """Return the payload of a slot, without copying it.
+
+        Args:
+            slot: An int representing the slot index.
+
+        Returns:
+            A memoryview on the shared memory, valid until the slot is
+            released.
+        """
+        return memoryview(self._data[slot, :int(self._lengths[slot])])
+
+    def release(self, slot):
+        """Make a slot available again once its payload was processed.
+
+        Args:
+            slot: An int representing the slot index.
+
+        Returns:
+            None
+        """
+        with self._cond:
+            self._free.append(slot)
+            self._cond.notify()
+
+    def close(self):
+        """Detach from the block, and free it in the owner process.
+
+        Every memoryview returned by acquire or payload must have been
+        released first.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._lengths = self._data = None
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
@@ -0,0 +1,266 @@
+"""
+Module supporting the output sinks, where annotated frames are written once
+detection is done.
+
+class JpegSink: Write every frame as its own frameN.jpg file.
+
+class LiveSink: Publish every frame, JPEG encoded, to a live stream.
+
+class VideoSink: Append every frame to a single MJPEG AVI file, indexed by
+frame number.
+
+function avi_chunks: Return the position of every video frame in an AVI
+file.
+
+function read_video_frame: Read one frame of a VideoSink file through its
+index.
+"""
+
+import struct
+import threading
+
+import cv2
+import numpy as np
+
+INDEX_DTYPE = np.dtype([('frame_id', '<u4'), ('offset', '<u8'),
+                        ('size', '<u4')])
+
+
+class JpegSink:
+    """Writes every annotated frame as its own JPEG file.
+
+    This is the layout expected by AWS_Flask: frame N is saved as
+    img_loc/frameN.jpg.
+
+    Attributes:
+        img_loc: A string representing the folder to write frames in.
+    """
+
+    def __init__(self, img_loc):
+        """Init JpegSink with its destination folder."""
+        self.img_loc = img_loc
+
+    def write(self, frame, image):
+        """Write one annotated frame.
+
+        Args:
+            frame: An int representing the frame number.
+            image: A numpy array holding the annotated image.
+
+        Returns:
+            None
+        """
+        cv2.imwrite(self.img_loc + "frame" + str(frame) + ".jpg", image)
+
+    def close(self):
+        """Flush the sink, nothing to do for individual files.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+
+class LiveSink:
+    """Publishes every annotated frame to a live stream.
+
+    Frames are JPEG encoded in memory and handed to the stream publish
+    method, typically a server.livestream.LiveStream, so viewers see them
+    as soon as detection completes.
+
+    Attributes:
+        stream: An object with a publish(channel, frame, jpeg) method.
+        channel: A string representing the channel frames are published on.
+        quality: An int representing the JPEG quality, 0 to 100.
+    """
+
+    def __init__(self, stream, channel='stream', quality=80):
+        """Init LiveSink with its stream, channel and JPEG quality."""
+        self.stream = stream
+        self.channel = channel
+        self.quality = quality
+
+    def write(self, frame, image):
+        """Publish one annotated frame.
+
+        Args:
+            frame: An int representing the frame number.
+            image: A numpy array holding the annotated image.
+
+        Returns:
+            None
+        """
+        _, jpeg = cv2.imencode('.jpg', image,
+                               [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        self.stream.publish(self.channel, frame, jpeg.tobytes())
+
+    def close(self):
+        """Flush the sink, the stream outlives it.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+
+class VideoSink:
+    """Appends every annotated frame to a single MJPEG AVI file.
+
+    Thousands of frames end up in one file instead of one file each. Every
+    MJPEG frame is a plain JPEG image stored in its own AVI chunk, so on
+    close the chunks are located in the file and an index of (frame_id,
+    offset, size) rows is saved next to it, as path + '.idx.npy'. Any frame
+    can then be read back without decoding the video up to it, see
+    read_video_frame. Unchanged frames skipped by the client are only
+    added to the index, see alias. Frames are appended in the order they
+    are written, which may differ from frame order with several workers,
+    the index maps them back. Frames must all have the size and color of
+    the first one, others are resized. write may be called from several
+    threads.
+
+    Attributes:
+        path: A string representing the video file location.
+        fps: A float representing the nominal frame rate of the video.
+        frames: A list of the frame numbers, in video order.
+    """
+
+    def __init__(self, path, fps=10.0):
+        """Init VideoSink, the video is created with its first frame."""
+        self.path = path
+        self.fps = fps
+        self.frames = []
+        self._aliases = []
+        self._writer = None
+        self._size = None
+        self._lock = threading.Lock()
+
+    def write(self, frame, image):
+        """Append one annotated frame to the video.
+
+        Args:
+            frame: An int representing the frame number.
+            image: A numpy array holding the annotated image.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if self._writer is None:
+                self._size = (image.shape[1], image.shape[0])
+                self._writer = cv2.VideoWriter(
+                    self.path, cv2.VideoWriter_fourcc(*'MJPG'), self.fps,
+                    self._size, image.ndim == 3)
+                if not self._writer.isOpened():
+                    raise ValueError("Cannot write video " + self.path + ".")
+            if (image.shape[1], image.shape[0]) != self._size:
+                image = cv2.resize(image, self._size)
+            self._writer.write(image)
+            self.frames.append(frame)
+
+    def alias(self, frame, ref):
+        """Make frame show the video frame written for ref.
+
+        Used for frames the client skipped as unchanged, nothing is
+        appended to the video, frame gets the index row of ref instead.
+
+        Args:
+            frame: An int representing the skipped frame number.
+            ref: An int representing the frame number to reuse.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._aliases.append((frame, ref))
+
+    def close(self):
+        """Finish the video and save its frame index.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if self._writer is None:
+                return
+            self._writer.release()
+            self._writer = None
+            chunks = avi_chunks(self.path)
+            if len(chunks) != len(self.frames):
+                raise ValueError("Unexpected AVI layout in " + self.path +
+                                 ", index not written.")
+            index = np.empty(len(chunks), dtype=INDEX_DTYPE)
+            index['frame_id'] = self.frames
+            index['offset'] = [offset for offset, _ in chunks]
+            index['size'] = [size for _, size in chunks]
+            rows = {row['frame_id']: row for row in index}
+            aliases = []
+            for frame, ref in self._aliases:
+                if ref in rows:
+                    rows[frame] = rows[ref].copy()
+                    rows[frame]['frame_id'] = frame
+                    aliases.append(rows[frame])
+            index = np.concatenate([index, np.array(aliases, INDEX_DTYPE)])
+            np.save(self.path + '.idx.npy', index)
+
+
+def avi_chunks(path):
+    """Return the position of every video frame in an AVI file.
+
+    Walks the RIFF structure, including the extra RIFF AVIX parts of large
+    OpenDML files, reading chunk headers only.
+
+    Args:
+        path: A string representing the AVI file location.
+
+    Returns:
+        A list of (offset, size) tuples, one per video frame in video
+        order, offset being the position of the frame data in the file.
+    """
+    chunks = []
+    with open(path, 'rb') as filedesc:
+        filedesc.seek(0, 2)
+        end = filedesc.tell()
+        stack = [(0, end)]
+        while stack:
+            pos, stop = stack.pop()
+            while pos + 8 <= stop:
+                filedesc.seek(pos)
+                fourcc, size = struct.unpack('<4sI', filedesc.read(8))
+                if fourcc in (b'RIFF', b'LIST'):
+                    # Walk the list body after its 4 bytes type, then resume.
+                    stack.append((pos + 8 + size + (size & 1), stop))
+                    stop, pos = pos + 8 + size, pos + 12
+                    continue
+                if fourcc[2:] == b'dc' and fourcc[:2].isdigit() and size:
+                    chunks.append((pos + 8, size))
+                pos += 8 + size + (size & 1)
+    return chunks
+
+def read_video_frame(path, frame, index=None):
+    """Read one frame of a VideoSink file through its index.
+
+    Args:
+        path: A string representing the video file location.
+        frame: An int representing the frame number.
+        index: An optional index array, as loaded from path + '.idx.npy',
+        to avoid loading it on every call.
+
+    Returns:
+        A numpy array holding the frame, None if it is not in the video.
+    """
+    if index is None:
+        index = np.load(path + '.idx.npy')
+    rows = index[index['frame_id'] == frame]
+    if not len(rows):
+        return None
+    with open(path, 'rb') as filedesc:
+        filedesc.seek(int(rows[0]['offset']))
+        data = filedesc.read(int(rows[0]['size']))
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
@@ -0,0 +1,122 @@
+"""
+Module supporting the TrackingDetector class, which runs the full cascade on
+keyframes only and tracks faces in between.
+
+class TrackingDetector: Detect-then-track face detection over a sequence of
+frames.
+"""
+
+import cv2
+import numpy as np
+
+from engine.cascade import get_cascade
+from engine.facedetect import HAAR_CASC
+
+
+class TrackingDetector:
+    """Detect-then-track face detection for consecutive frames of a video.
+
+    The full detectMultiScale runs on keyframes. On the frames in between,
+    every face is searched for by template matching in a window around its
+    previous box, with the face as it appeared on the keyframe as template.
+    A new keyframe is forced every interval frames, or as soon as the
+    matching score of one face drops under min_confidence. One instance
+    must see the frames of a single sequence, in order.
+
+    Attributes:
+        interval: An int representing the maximum number of frames between
+        two keyframes.
+        min_confidence: A float, the normalized correlation under which a
+        face is considered lost.
+        margin: A float representing the search window growth around the
+        previous box, as a fraction of its size.
+        scale: A float to adjust the classifier.
+        neighbors: An int to adjust the classifier.
+        cascade: A string representing the cascade file location.
+        keyframes: An int counting the frames that ran the full cascade.
+        tracked: An int counting the frames handled by tracking only.
+        confidence: A float, the lowest matching score of the last frame,
+        1.0 on keyframes.
+    """
+
+    def __init__(self, interval=10, min_confidence=0.6, margin=0.5,
+                 scale=1.1, neighbors=5, cascade=HAAR_CASC):
+        """Init TrackingDetector with its keyframe and tracking settings."""
+        self.interval = interval
+        self.min_confidence = min_confidence
+        self.margin = margin
+        self.scale = scale
+        self.neighbors = neighbors
+        self.cascade = cascade
+        self.keyframes = 0
+        self.tracked = 0
+        self.confidence = 1.0
+        self._boxes = []
+        self._templates = []
+        self._since_keyframe = None
+
+    def detect(self, image):
+        """Return the faces of the next frame of the sequence.
+
+        Args:
+            image: A grayscale numpy array holding the frame.
+
+        Returns:
+            A numpy array of (x, y, w, h) rows, one per face.
+        """
+        if (self._since_keyframe is None or
+                self._since_keyframe + 1 >= self.interval):
+            return self._keyframe(image)
+        boxes, confidence = self._track(image)
+        if confidence < self.min_confidence:
+            return self._keyframe(image)
+        self._boxes = boxes
+        self._since_keyframe += 1
+        self.tracked += 1
+        self.confidence = confidence
+        return np.array(boxes, dtype=np.int32).reshape(-1, 4)
+
+    def reset(self):
+        """Forget the tracked faces, the next frame will be a keyframe.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._boxes = []
+        self._templates = []
+        self._since_keyframe = None
+
+    def _keyframe(self, image):
+        """Run the full cascade and take new templates."""
+        faces = get_cascade(self.cascade).detectMultiScale(image, self.scale,
+                                                           self.neighbors)
+        faces = np.array(faces, dtype=np.int32).reshape(-1, 4)
+        self._boxes = [tuple(face) for face in faces.tolist()]
+        self._templates = [image[y:y + h, x:x + w].copy()
+                           for (x, y, w, h) in self._boxes]
+        self._since_keyframe = 0
+        self.keyframes += 1
+        self.confidence = 1.0
+        return faces
+
+    def _track(self, image):
+        """Match every template around its previous box."""
+        height, width = image.shape[:2]
+        boxes, confidence = [], 1.0
+        for (x, y, w, h), template in zip(self._boxes, self._templates):
+            pad_x, pad_y = int(w * self.margin), int(h * self.margin)
+            left, top = max(0, x - pad_x), max(0, y - pad_y)
+            right = min(width, x + w + pad_x)
+            bottom = min(height, y + h + pad_y)
+            window = image[top:bottom, left:right]
+            if window.shape[0] < h or window.shape[1] < w:
+                return (boxes, 0.0)
+            scores = cv2.matchTemplate(window, template,
+                                       cv2.TM_CCOEFF_NORMED)
+            _, score, _, (dx, dy) = cv2.minMaxLoc(scores)
+            confidence = min(confidence, score)
+            boxes.append((left + dx, top + dy, w, h))
+        return (boxes, confidence)
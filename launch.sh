@@ -24,8 +24,8 @@ do
       shift
       shift
       ;;
-    -s|--sleep)
-      SLEEP="$2"
+    -w|--window)
+      WINDOW="$2"
       shift
       shift
       ;;
@@ -55,5 +55,5 @@ if [[ "${CLIENT}" = 1 ]]; then
   if [[ ! -d "$CAPTURE_DIR" ]]; then
     mkdir "$CAPTURE_DIR"
   fi
-  python3 main_client.py -f $FRAMES -a $ADDRESS -s $SLEEP
+  python3 main_client.py -f $FRAMES -a $ADDRESS -w ${WINDOW:-8}
 fi
\ No newline at end of file
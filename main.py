@@ -1,18 +1,182 @@
 """
 Main handler for the AWS server component.
 
-Usage: python3 main.py
+Usage: python3 main.py [--serve] [--workers WORKERS]
+                       [--processes PROCESSES] [--in-memory]
+                       [--track TRACK | --roi ROI]
+                       [--reduce {1,2,4,8}] [--refine] [--tile TILE]
+                       [--cache CACHE] [--cache-dir CACHE_DIR] [--video]
+                       [--live LIVE]
+                       [--max-age MAX_AGE] [--downgrade-age DOWNGRADE_AGE]
+                       [--latency-target LATENCY_TARGET]
+                       [--tune-window TUNE_WINDOW]
+                       [--tune-scales SCALE [SCALE ...]]
+                       [--tune-min-sizes MIN_SIZE [MIN_SIZE ...]]
+                       [--tune-downscales DOWNSCALE [DOWNSCALE ...]]
+                       [--metrics METRICS] [--metrics-json METRICS_JSON]
+                       [--shared-memory WxH] [--verbose]
 """
 
 
+import argparse
+import asyncio
+import bisect
+import functools
+import json
 import os
 
+import common.metrics as mt
+import common.wireformat as wf
 import server.connectionhandler as ch
-from engine.facedetect import FaceDetect
+from engine.autotune import AdaptiveDetector, settings_ladder
+from engine.detectcache import DetectionCache
+from engine.detectpool import DetectionPool
+from engine.facedetect import REDUCED_FLAGS
+from engine.results import ResultStore
+from engine.roisearch import RoiDetector
+from engine.shmring import FrameRing, slot_size_for
+from engine.sinks import JpegSink, LiveSink, VideoSink
+from engine.tracker import TrackingDetector
+from server.asyncserver import FaceDetectServer
+from server.livestream import LiveStream
+from server.pipeline import (DeadlineScheduler, DetectionPipeline,
+                             detect_and_save, detect_buffer, detect_encoded)
 
 def main():
     """Main function for server loop."""
 
+    # PYTHON PARSER VIA ARGPARSE #
+
+    parser = argparse.ArgumentParser(description="AWS FaceDetect Server Main.")
+    parser.add_argument("-s", "--serve", action='store_true',
+                        help="Keep accepting sessions until interrupted.")
+    parser.add_argument("-w", "--workers", help="Detection threads.",
+                        nargs='?', default=2, type=int)
+    parser.add_argument("-p", "--processes",
+                        help="Detection processes, 0 to detect in threads.",
+                        nargs='?', default=0, type=int)
+    parser.add_argument("-m", "--in-memory", action='store_true',
+                        help="Decode frames from memory, only save results.")
+    parser.add_argument("-t", "--track",
+                        help="Run the full detection every TRACK frames "
+                        "only and track faces in between.",
+                        nargs='?', default=0, type=int)
+    parser.add_argument("-r", "--roi",
+                        help="Search around the previous faces, with a full "
+                        "scan every ROI frames.",
+                        nargs='?', default=0, type=int)
+    parser.add_argument("-R", "--reduce",
+                        help="Decode frames at 1/REDUCE of their size "
+                        "for detection.",
+                        nargs='?', default=1, type=int,
+                        choices=sorted(REDUCED_FLAGS))
+    parser.add_argument("--refine", action='store_true',
+                        help="Refine reduced size faces at full resolution.")
+    parser.add_argument("-T", "--tile",
+                        help="Search large frames by TILE sized tiles, in "
+                        "parallel threads.",
+                        nargs='?', default=0, type=int)
+    parser.add_argument("-c", "--cache",
+                        help="Detection results kept in memory for "
+                        "identical frames, 0 to disable.",
+                        nargs='?', default=0, type=int)
+    parser.add_argument("--cache-dir",
+                        help="Folder keeping cached results across runs.",
+                        nargs='?', default=None)
+    parser.add_argument("-V", "--video", action='store_true',
+                        help="Save annotated frames to one indexed MJPEG "
+                        "video instead of one JPEG file each.")
+    parser.add_argument("-L", "--live",
+                        help="Stream annotated frames as MJPEG over HTTP "
+                        "on port LIVE while the session runs.",
+                        nargs='?', default=0, type=int)
+    parser.add_argument("-A", "--max-age",
+                        help="Skip frames waiting for detection longer "
+                        "than MAX_AGE seconds, latest frames win.",
+                        nargs='?', default=0.0, type=float)
+    parser.add_argument("-D", "--downgrade-age",
+                        help="Detect on reduced frames once they waited "
+                        "longer than DOWNGRADE_AGE seconds.",
+                        nargs='?', default=0.0, type=float)
+    parser.add_argument("-l", "--latency-target",
+                        help="Adapt the detection settings to keep the p95 "
+                        "detection time under LATENCY_TARGET ms.",
+                        nargs='?', default=0.0, type=float)
+    parser.add_argument("--tune-window",
+                        help="Frames measured at a setting before "
+                        "--latency-target changes it.",
+                        nargs='?', default=20, type=int)
+    parser.add_argument("--tune-scales",
+                        help="Classifier scale factors --latency-target "
+                        "may use, increasing.",
+                        nargs='+', default=[1.1, 1.2, 1.3], type=float)
+    parser.add_argument("--tune-min-sizes",
+                        help="Minimum face sizes in pixels --latency-target "
+                        "may use, increasing.",
+                        nargs='+', default=[20, 30, 40], type=int)
+    parser.add_argument("--tune-downscales",
+                        help="Input downscale ratios --latency-target may "
+                        "use, decreasing.",
+                        nargs='+', default=[1.0, 0.75, 0.5], type=float)
+    parser.add_argument("-M", "--metrics",
+                        help="Serve per-stage latency histograms for "
+                        "Prometheus on port METRICS, /metrics.",
+                        nargs='?', default=0, type=int)
+    parser.add_argument("--metrics-json",
+                        help="Dump per-stage latency histograms to the "
+                        "METRICS_JSON file every 5 seconds.",
+                        nargs='?', default=None)
+    parser.add_argument("--shared-memory",
+                        help="Receive frames of up to WxH pixels straight "
+                        "into shared memory read by the --processes "
+                        "workers.", nargs='?', default=None, type=str)
+    parser.add_argument("-v", "--verbose", action='store_true',
+                        help="Print every frame received and acked.")
+    args = vars(parser.parse_args())
+    if args['shared_memory'] and (args['processes'] <= 0 or args['serve']):
+        parser.error("--shared-memory needs --processes.")
+    if args['shared_memory'] and args['max_age'] > 0:
+        parser.error("--shared-memory keeps every frame, drop --max-age.")
+    if args['in_memory'] and args['processes'] > 0:
+        parser.error("--in-memory runs detection in threads only.")
+    if (args['track'] > 0 or args['roi'] > 0) and args['processes'] > 0:
+        parser.error("--track and --roi run detection in one thread only.")
+    if args['latency_target'] > 0 and args['processes'] > 0:
+        parser.error("--latency-target runs detection in one thread only.")
+    if sum(1 for name in ('track', 'roi', 'latency_target')
+           if args[name] > 0) > 1:
+        parser.error("--track, --roi and --latency-target are mutually "
+                     "exclusive.")
+    if args['tune_window'] < 1:
+        parser.error("--tune-window must be at least 1.")
+    if (args['tune_scales'] != sorted(args['tune_scales']) or
+            args['tune_scales'][0] <= 1.0):
+        parser.error("--tune-scales must be increasing and over 1.")
+    if (args['tune_min_sizes'] != sorted(args['tune_min_sizes']) or
+            args['tune_min_sizes'][0] < 1):
+        parser.error("--tune-min-sizes must be increasing and positive.")
+    if (args['tune_downscales'] != sorted(args['tune_downscales'],
+                                          reverse=True) or
+            not 0 < args['tune_downscales'][-1] <=
+            args['tune_downscales'][0] <= 1.0):
+        parser.error("--tune-downscales must be decreasing, in (0, 1].")
+    if args['reduce'] > 1 and args['processes'] > 0:
+        parser.error("--reduce runs detection in threads only.")
+    if args['tile'] > 0 and (args['processes'] > 0 or args['track'] > 0 or
+                             args['roi'] > 0 or args['latency_target'] > 0):
+        parser.error("--tile runs the full detection in threads only.")
+    if args['video'] and not (args['in_memory'] or args['serve']):
+        parser.error("--video needs --in-memory or --serve.")
+    if args['live'] > 0 and not (args['in_memory'] or args['serve']):
+        parser.error("--live needs --in-memory or --serve.")
+    if args['downgrade_age'] > 0 and args['processes'] > 0:
+        parser.error("--downgrade-age runs detection in threads only.")
+    if args['cache_dir'] and args['cache'] <= 0:
+        parser.error("--cache-dir needs --cache.")
+    if args['cache'] > 0 and (args['processes'] > 0 or args['track'] > 0 or
+                              args['roi'] > 0 or args['latency_target'] > 0):
+        parser.error("--cache caches the full detection in threads only.")
+
     # FACEDETECT SERVER #
 
     print(" -------------------------")
@@ -20,9 +184,35 @@ def main():
     print(" -------------------------")
 
     print("\n Initializing ENV variables...", end='')
-    img_loc, _json_loc = ch.init_flask_environ_folder()
+    img_loc, json_loc = ch.init_flask_environ_folder()
     print("Done!")
 
+    cache = None
+    if args['cache'] > 0:
+        cache = DetectionCache(args['cache'], args['cache_dir'])
+
+    metrics_server, dumper = None, None
+    if args['metrics'] > 0 or args['metrics_json']:
+        mt.enable()
+    if args['metrics'] > 0:
+        metrics_server = mt.serve_metrics(port=args['metrics'])
+        print(" Stage metrics on http://<server>:%d/metrics" %
+              args['metrics'])
+    if args['metrics_json']:
+        dumper = mt.JsonDumper(args['metrics_json'])
+        dumper.start()
+
+    live = None
+    if args['live'] > 0:
+        live = LiveStream(port=args['live'])
+        live.start()
+        print(" Live frames on http://<server>:%d/" % args['live'])
+
+    if args['serve']:
+        serve(img_loc, cache, args['video'], live)
+        close_metrics(metrics_server, dumper)
+        return
+
     print("\n Initializing server socket...", end='')
     server_socket = ch.init_server_socket()
     print("Done!")
@@ -32,20 +222,108 @@ def main():
     client, addr = server_socket.accept()
     print("Incoming connection from " + str(addr))
 
-    frame_nbr = int(ch.receive_bytes_to_string(client))
-    print("Expecting " + str(frame_nbr) + " frames from remote host.")
+    reader = wf.MessageReader(client)
+    announced = ch.receive_session_header(reader)
+    if announced:
+        print("Expecting " + str(announced) + " frames from remote host.")
+    else:
+        print("Streaming frames from remote host.")
 
-    print("\n **** RECEIVING FRAMES ****")
+    print("\n **** RECEIVING FRAMES AND RUNNING DETECTION ****")
 
-    for curr_frame in range(frame_nbr):
+    store = ResultStore(os.path.join(img_loc, "detections.bin"), json_loc)
+    if args['video']:
+        sink = VideoSink(os.path.join(img_loc, "session.avi"))
+    else:
+        sink = JpegSink(img_loc)
+    sinks = [sink]
+    if live is not None:
+        sinks.append(LiveSink(live))
+    pool, fallback, tuning, ring, into = None, None, None, None, None
+    if args['processes'] > 0:
+        pool = DetectionPool(args['processes'])
+        workers, process = args['processes'], pool.detect_one
+        if args['shared_memory']:
+            width, height = (int(side) for side in
+                             args['shared_memory'].split('x'))
+            ring = FrameRing(2 * workers, slot_size_for(width, height))
+            slots = []
+            into = functools.partial(receive_into, ring, slots)
+            process = functools.partial(detect_shared, pool, ring, img_loc)
+    else:
+        # Stateful detectors need the session frames in order, one thread.
+        detector, workers = None, args['workers']
+        if args['track'] > 0:
+            detector, workers = TrackingDetector(args['track']), 1
+        elif args['roi'] > 0:
+            detector, workers = RoiDetector(args['roi']), 1
+        elif args['latency_target'] > 0:
+            detector = AdaptiveDetector(
+                args['latency_target'],
+                settings_ladder(args['tune_scales'], args['tune_min_sizes'],
+                                args['tune_downscales']),
+                window=args['tune_window'], reduce=args['reduce'])
+            workers = 1
+        if args['in_memory']:
+            process = functools.partial(detect_buffer,
+                                        sinks=sinks,
+                                        detector=detector,
+                                        reduce=args['reduce'],
+                                        refine=args['refine'],
+                                        tile=args['tile'], cache=cache)
+        else:
+            process = functools.partial(detect_and_save, detector=detector,
+                                        reduce=args['reduce'],
+                                        refine=args['refine'],
+                                        tile=args['tile'], cache=cache)
+        if isinstance(detector, AdaptiveDetector):
+            process, tuning = record_settings(process, detector)
+        # Late frames get a plain detection on a quarter size decode.
+        if args['in_memory']:
+            fallback = functools.partial(detect_buffer, sinks=sinks,
+                                         reduce=max(4, args['reduce']))
+        else:
+            fallback = functools.partial(detect_and_save,
+                                         reduce=max(4, args['reduce']))
+        fallback = functools.partial(detect_encoded, fallback)
+    # Faces of frames the client downscaled are mapped back to full size.
+    process = functools.partial(detect_encoded, process)
+    if args['max_age'] > 0 or args['downgrade_age'] > 0:
+        pipeline = DeadlineScheduler(workers=workers, process=process,
+                                     store=store,
+                                     max_age=args['max_age'] or None,
+                                     downgrade_age=(args['downgrade_age'] or
+                                                    None),
+                                     fallback=fallback)
+    else:
+        pipeline = DetectionPipeline(workers=workers, process=process,
+                                     store=store)
+    frame_nbr = 0
+    same = {}
+    for curr_frame, payload in ch.receive_frames(reader, announced, into):
 
-        frame_size = int(ch.receive_bytes_to_string(client))
-        ch.receive_frame(client, curr_frame, frame_size, img_loc)
-        print("Frame " + str(curr_frame) + " received.")
+        frame_nbr += 1
+        if args['verbose']:
+            print("Frame " + str(curr_frame) + " received.")
+        slot = slots.pop() if into is not None and slots else None
+        if isinstance(payload, wf.SameFrame):
+            same[curr_frame] = payload.ref
+        else:
+            flags = 0
+            if isinstance(payload, wf.EncodedFrame):
+                payload, flags = payload
+            if slot is not None:
+                item = (curr_frame, slot)
+            elif args['in_memory']:
+                item = (curr_frame, bytes(payload))
+            else:
+                item = ch.write_frame(payload, curr_frame, img_loc)
+            pipeline.submit(curr_frame,
+                            wf.EncodedFrame(item, flags) if flags else item)
 
-        print("Sending ack...", end='')
-        ch.send_frame_ack(client, curr_frame)
-        print("Sent.")
+        ch.send_cumulative_ack(client, curr_frame)
+        if args['verbose']:
+            print("Frame " + str(curr_frame) + " acked.")
 
     print("\nFrames received!")
 
@@ -54,16 +332,65 @@ def main():
     server_socket.close()
     print("Done!")
 
-    print("\n **** STARTING DETECTION ****")
+    print("\nWaiting for detection to complete...", end='')
+    pipeline.close()
+
+    def show(curr_frame, ref):
+        if args['video']:
+            sink.alias(curr_frame, ref)
+        elif not ch.link_frame(curr_frame, ref, img_loc):
+            return
+        shown.add(curr_frame)
 
-    for item in range(frame_nbr):
-        print("Running detection on frame " + str(item))
-        frame_name = img_loc + "frame" + str(item) + ".jpg"
-        detection = FaceDetect(frame_name)
-        faces = detection.detect()
-        detection.image = detection.drawrectangle(faces)
-        detection.saveimage(frame_name)
+    shown = set(pipeline.results)
+    if isinstance(pipeline, DeadlineScheduler) and args['in_memory']:
+        # Skipped frames show the latest earlier result, as a live view would.
+        done = sorted(pipeline.results)
+        for curr_frame, (action, _) in sorted(pipeline.decisions.items()):
+            pos = bisect.bisect_left(done, curr_frame)
+            if action == 'skipped' and pos:
+                show(curr_frame, done[pos - 1])
+    for curr_frame, ref in sorted(same.items()):
+        if ref in shown or not args['in_memory']:
+            show(curr_frame, ref)
+        pipeline.results[curr_frame] = pipeline.results.get(ref)
+        store.add(curr_frame, pipeline.results[curr_frame])
+    store.close()
+    sink.close()
+    if live is not None:
+        live.close()
+    print("Done!")
+    print("%d faces stored in %s." % (store.rows, store.path))
+    if same:
+        print("%d unchanged frames reused." % len(same))
 
+    if pipeline.first_result is not None:
+        print("First result after %.3fs." % pipeline.first_result)
+    if pipeline.failed:
+        print("%d frames failed." % pipeline.failed)
+    if isinstance(pipeline, DeadlineScheduler):
+        print("%d frames skipped, %d downgraded." %
+              (pipeline.skipped, pipeline.downgraded))
+        for curr_frame, (action, reason) in sorted(pipeline.decisions.items()):
+            if action != 'detected':
+                print("Frame %d %s: %s." % (curr_frame, action, reason))
+    if cache is not None:
+        print_cache_stats(cache)
+    if tuning is not None:
+        with open(os.path.join(img_loc, "tuning.json"), 'w') as filedesc:
+            json.dump({str(frame): settings
+                       for frame, settings in sorted(tuning.items())},
+                      filedesc, indent=1)
+        print("Session detection p95 %.1fms for a %.1fms target, "
+              "settings %s." %
+              (detector.p95(), detector.target_ms, detector.settings))
+    if pool is not None:
+        pool.close()
+        for pid, fps in sorted(pool.throughput().items()):
+            print("Worker %d: %.1f frames/sec." % (pid, fps))
+    if ring is not None:
+        ring.close()
+    close_metrics(metrics_server, dumper)
     print("\nDetection completed!")
     print("\n --------------------------")
     print("| AWS FACEDETECT - GOODBYE |")
@@ -89,6 +416,140 @@ def main():
 
     print("\n")
 
+def record_settings(process, detector):
+    """Record the AdaptiveDetector settings every frame was detected with.
+
+    Args:
+        process: A detect_buffer or detect_and_save partial using detector.
+        detector: An engine.autotune.AdaptiveDetector instance, used by a
+        single thread.
+
+    Returns:
+        (process, tuning): The wrapped process, and the dict it fills,
+        mapping frame numbers to their settings and detection time in ms.
+    """
+    tuning = {}
+
+    def recorded(item):
+        calls = len(detector.history)
+        faces = process(item)
+        if len(detector.history) > calls:
+            # Items are (frame, buf) tuples in memory, frameN.jpg paths else.
+            frame = item[0] if isinstance(item, tuple) else int(
+                os.path.basename(item)[len("frame"):-len(".jpg")])
+            settings, elapsed = detector.history[-1]
+            tuning[frame] = dict(settings, ms=round(elapsed, 2))
+        return faces
+
+    return (recorded, tuning)
+
+def print_cache_stats(cache):
+    """Print the hit and miss counters of a DetectionCache.
+
+    Args:
+        cache: An engine.detectcache.DetectionCache instance.
+
+    Returns:
+        None
+    """
+    stats = cache.stats()
+    print("Cache: %d hits, %d disk hits, %d misses (%.0f%% hit rate)." %
+          (stats['hits'], stats['disk_hits'], stats['misses'],
+           stats['hit_rate'] * 100))
+
+def receive_into(ring, slots, length):
+    """Give the receiver a FrameRing slot to read a frame payload into.
+
+    Frames too large for a slot are read into a private buffer instead,
+    and their slot recorded as None.
+
+    Args:
+        ring: An engine.shmring.FrameRing owned by the receiver.
+        slots: A list the acquired slot, or None, is appended to.
+        length: An int representing the payload size in bytes.
+
+    Returns:
+        A writable memoryview of length bytes.
+    """
+    if length > ring.slot_size:
+        slots.append(None)
+        return memoryview(bytearray(length))
+    slot, view = ring.acquire(length)
+    slots.append(slot)
+    return view
+
+def detect_shared(pool, ring, img_loc, item):
+    """Detect a frame held in a FrameRing slot, or saved to disk.
+
+    Args:
+        pool: An engine.detectpool.DetectionPool.
+        ring: The engine.shmring.FrameRing the slots belong to.
+        img_loc: A string representing the folder for annotated frames.
+        item: A (frame, slot) tuple, or a string representing the location
+        of a frame too large for a slot.
+
+    Returns:
+        The faces found, None for an invalid image.
+    """
+    if isinstance(item, str):
+        return pool.detect_one(item)
+    frame, slot = item
+    return pool.detect_slot(ring, slot, frame, img_loc)
+
+def close_metrics(metrics_server, dumper):
+    """Print the stage latencies and stop exporting them.
+
+    Args:
+        metrics_server: The server returned by serve_metrics, or None.
+        dumper: A common.metrics.JsonDumper, or None.
+
+    Returns:
+        None
+    """
+    stages = mt.registry().snapshot()['stages']
+    for stage in mt.STAGES:
+        if stage in stages:
+            print("Stage %s: %d frames, p50 %sms, p95 %sms." %
+                  (stage, stages[stage]['count'], stages[stage]['p50_ms'],
+                   stages[stage]['p95_ms']))
+    if dumper is not None:
+        dumper.close()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+        metrics_server.server_close()
+
+def serve(img_loc, cache=None, video=False, live=None):
+    """Run the persistent multi-session server until interrupted.
+
+    Each session saves its frames under its own folder in img_loc.
+
+    Args:
+        img_loc: A string representing the root folder for session frames.
+        cache: An optional DetectionCache shared by every session.
+        video: An optional boolean, True to save every session as one
+        indexed MJPEG video.
+        live: An optional LiveStream every session publishes on.
+
+    Returns:
+        None
+    """
+    server = FaceDetectServer(img_loc, cache=cache, video=video, live=live)
+    print("\nWaiting for incoming sessions, ctrl+c to stop...")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if live is not None:
+            live.close()
+    print("\n%d sessions served." % server.served)
+    if cache is not None:
+        print_cache_stats(cache)
+    print("\n --------------------------")
+    print("| AWS FACEDETECT - GOODBYE |")
+    print(" --------------------------")
+
 
 if __name__ == '__main__':
     main()
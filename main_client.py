@@ -2,14 +2,35 @@
 Main handler for the client component.
 
 Usage: python3 main_client.py --address ADDRESS [--frames FRAMES]
-                             [--sleep SLEEP]
+                             [--window WINDOW] [--in-memory]
+                             [--stream] [--buffer BUFFER]
+                             [--motion MOTION] [--metrics METRICS]
+                             [--input INPUT] [--stride STRIDE]
+                             [--start START] [--end END] [--fps FPS]
+                             [--scale SCALE] [--quality QUALITY] [--gray]
+                             [--adaptive ADAPTIVE] [--max-delay MAX_DELAY]
+       python3 main_client.py --input INPUT --local LOCAL
+                             [--workers WORKERS] [--frames FRAMES]
+                             [--stride STRIDE] [--start START]
+                             [--end END] [--fps FPS] [--annotate]
 """
 
 
 import argparse
+import functools
+import json
+import os
 
 import client.client as cl
+import common.metrics as mt
 from client.camera import Camera
+from client.encoder import AdaptiveEncoder, FrameEncoder, encoding_ladder
+from client.motion import MotionGate
+from client.offline import open_source
+from client.streamer import StreamingSender
+from engine.results import ResultStore
+from engine.sinks import JpegSink
+from server.pipeline import DetectionPipeline, detect_buffer
 
 def main():
     """Main function for client loop."""
@@ -17,17 +38,85 @@ def main():
     # PYTHON PARSER VIA ARGPARSE #
 
     parser = argparse.ArgumentParser(description="AWS FaceDetect Client Main.")
-    parser.add_argument("-a", "--address", required=True,
+    parser.add_argument("-a", "--address",
                         help="Address to connect to.", type=str)
-    parser.add_argument("-f", "--frames", help="Frames to send.",
-                        nargs='?', default=10, type=int)
-    parser.add_argument("-s", "--sleep", help="Sleep in seconds.",
-                        nargs='?', default=0.1, type=float)
+    parser.add_argument("-f", "--frames", help="Frames to send, all the "
+                        "sampled frames of INPUT by default, else 10.",
+                        nargs='?', default=None, type=int)
+    parser.add_argument("-w", "--window", help="Frames in flight.",
+                        nargs='?', default=8, type=int)
+    parser.add_argument("-m", "--in-memory", action='store_true',
+                        help="Encode frames in memory, nothing on disk.")
+    parser.add_argument("-S", "--stream", action='store_true',
+                        help="Send frames while capture is running.")
+    parser.add_argument("-b", "--buffer",
+                        help="Frames buffered when streaming before dropping.",
+                        nargs='?', default=8, type=int)
+    parser.add_argument("-M", "--motion",
+                        help="Skip frames changing less than this (0-255).",
+                        nargs='?', default=0, type=float)
+    parser.add_argument("--metrics",
+                        help="Dump capture, encode and send latency "
+                        "histograms to the METRICS JSON file.",
+                        nargs='?', default=None)
+    parser.add_argument("-i", "--input",
+                        help="Video file or image directory to read "
+                        "instead of the webcam.", type=str)
+    parser.add_argument("--stride", help="Keep one INPUT frame in STRIDE.",
+                        nargs='?', default=1, type=int)
+    parser.add_argument("--start", help="Second of INPUT to start at.",
+                        nargs='?', default=0.0, type=float)
+    parser.add_argument("--end", help="Second of INPUT to stop at.",
+                        nargs='?', default=None, type=float)
+    parser.add_argument("--fps", help="Rate of an INPUT image directory, "
+                        "for --start and --end.",
+                        nargs='?', default=25.0, type=float)
+    parser.add_argument("-l", "--local",
+                        help="Detect INPUT in process and write the results "
+                        "to the LOCAL folder, no server needed.", type=str)
+    parser.add_argument("--workers", help="Detection threads with --local.",
+                        nargs='?', default=os.cpu_count() or 1, type=int)
+    parser.add_argument("--annotate", action='store_true',
+                        help="Also save annotated frames with --local.")
+    parser.add_argument("--scale", help="Send frames at SCALE percent of "
+                        "their captured size.",
+                        nargs='?', default=100, type=int)
+    parser.add_argument("--quality", help="JPEG quality, 0 for the OpenCV "
+                        "default.", nargs='?', default=0, type=int)
+    parser.add_argument("--gray", action='store_true',
+                        help="Send grayscale frames.")
+    parser.add_argument("--adaptive",
+                        help="Adapt scale and quality to the uplink to "
+                        "sustain ADAPTIVE frames/sec.",
+                        nargs='?', default=0.0, type=float)
+    parser.add_argument("--max-delay",
+                        help="Queueing delay in seconds over which "
+                        "--adaptive considers the uplink saturated.",
+                        nargs='?', default=0.2, type=float)
     args = vars(parser.parse_args())
+    if not 1 <= args['scale'] <= 100 or not 0 <= args['quality'] <= 100:
+        parser.error("--scale must be in 1-100 and --quality in 0-100.")
+    encoded = (args['scale'] < 100 or args['quality'] > 0 or args['gray'] or
+               args['adaptive'] > 0)
+    if encoded and not (args['in_memory'] or args['stream'] or
+                        args['input']):
+        parser.error("--scale, --quality, --gray and --adaptive need "
+                     "--in-memory, --stream or --input.")
+    if args['adaptive'] > 0 and (args['in_memory'] or args['local']):
+        parser.error("--adaptive needs frames encoded while sending, drop "
+                     "--in-memory or --local.")
+    if args['local'] and not args['input']:
+        parser.error("--local needs --input.")
+    if not args['local'] and not args['address']:
+        parser.error("--address is required unless --local is set.")
+    if args['motion'] > 0 and not (args['in_memory'] or args['stream']):
+        parser.error("--motion requires --in-memory or --stream.")
 
     frame_nbr = args['frames']
+    if frame_nbr is None:
+        frame_nbr = 0 if args['input'] else 10
     server_addr = args['address']
-    sleep = args['sleep']
+    window = args['window']
 
     # FACEDETECT CLIENT #
 
@@ -35,6 +124,18 @@ def main():
     print("| AWS FACEDETECT - CLIENT |")
     print(" -------------------------")
 
+    dumper = None
+    if args['metrics']:
+        mt.enable()
+        dumper = mt.JsonDumper(args['metrics'])
+        dumper.start()
+
+    if args['local']:
+        run_local(args, frame_nbr)
+        if dumper is not None:
+            dumper.close()
+        return
+
     print("\n Initializing ENV variables...", end='')
     capture_loc = cl.init_facedetect_environ_folder()
     print("Done!")
@@ -43,31 +144,118 @@ def main():
     client_socket = cl.init_client_socket(server_addr)
     print("Done!")
 
-    print("\n **** CAPTURING FRAMES ****")
     cam = Camera(frames=frame_nbr, path=capture_loc)
-    cam.capture()
-    print(" " + str(frame_nbr) + " frames captured!")
-
-    print("\n **** SENDING FRAMES NBR ****")
-    cl.send_total_frame_nbr(client_socket, frame_nbr)
-    print(" Frames number sent to server!")
-
-    print("\n **** SENDING FRAMES ****")
-    for frame in range(frame_nbr):
-        frame_loc = capture_loc + "frame" + str(frame) + ".jpg"
-        cl.send_frame_size(client_socket, frame_loc)
-        print("Sending frame %s..." % str(frame), end='')
-        cl.send_frame(client_socket, frame_loc, sleep=sleep)
-        print("Done.")
-        print("Waiting for frame " + str(frame) + " reception...", end='')
-        cl.waiting_for_ack(client_socket, frame)
-        print("ACK")
+    if args['input']:
+        cam = open_input(args, frame_nbr, capture_loc)
+    gate = MotionGate(args['motion']) if args['motion'] > 0 else None
+    encoder = None
+    if args['adaptive'] > 0:
+        encoder = AdaptiveEncoder(args['adaptive'],
+                                  encoding_ladder(gray=args['gray']),
+                                  max_delay=args['max_delay'])
+    elif encoded:
+        encoder = FrameEncoder(args['scale'], args['quality'], args['gray'])
+    if args['input'] and not (args['stream'] or args['in_memory']):
+        # Recorded footage is sent as fast as the server acks it.
+        print("\n **** SENDING %s (WINDOW %d) ****" % (args['input'], window))
+        sent = cl.send_windowed(client_socket,
+                                cam.stream(gate=gate, encoder=encoder),
+                                window=window, feedback=encoder)
+        print(" %d frames sent." % sent)
+    elif args['stream']:
+        print("\n **** STREAMING FRAMES (WINDOW %d) ****" % window)
+        sender = StreamingSender(client_socket, window, args['buffer'],
+                                 encoder)
+        sender.start()
+        for buf in cam.stream(gate=gate, encoder=encoder):
+            sender.put(buf)
+        sent = sender.close()
+        print(" %d frames sent, %d dropped." % (sent, sender.buffer.dropped))
+    else:
+        print("\n **** CAPTURING FRAMES ****")
+        if args['in_memory']:
+            buffers = cam.capture_buffers(gate=gate, encoder=encoder)
+        else:
+            cam.capture()
+        print(" " + str(frame_nbr) + " frames captured!")
+
+        print("\n **** SENDING FRAMES (WINDOW %d) ****" % window)
+        if args['in_memory']:
+            cl.send_buffers_windowed(client_socket, buffers, window=window)
+        else:
+            frame_locs = [capture_loc + "frame" + str(frame) + ".jpg"
+                          for frame in range(frame_nbr)]
+            cl.send_frames_windowed(client_socket, frame_locs,
+                                    window=window)
 
     print("\nFrames sent!")
+    if gate is not None:
+        print(" %d unchanged frames skipped." % gate.skipped)
+    if isinstance(encoder, AdaptiveEncoder):
+        print(" Final encoding %s, %d changes." %
+              (dict(encoder.encoding._asdict()), encoder.changes))
+    if dumper is not None:
+        dumper.close()
+        print(" Stage latencies written to %s." % args['metrics'])
     print("\n --------------------------")
     print("| AWS FACEDETECT - GOODBYE |")
     print(" --------------------------")
 
+def open_input(args, frame_nbr, path='./'):
+    """Return the offline source of the input option.
+
+    Args:
+        args: A dict of the parsed arguments.
+        frame_nbr: An int representing the frames to read, 0 for all.
+        path: An optional string, see client.camera.Camera.
+
+    Returns:
+        A client.offline.VideoSource or ImageDirSource.
+    """
+    return open_source(args['input'], stride=args['stride'],
+                       start=args['start'], end=args['end'],
+                       fps=args['fps'], frames=frame_nbr, path=path)
+
+def run_local(args, frame_nbr):
+    """Detect the frames of the input option in process.
+
+    Frames are read lazily and fed to a DetectionPipeline, which blocks the
+    reader while every worker is busy. Faces are stored in detections.bin
+    and detections.json under the local folder, with the source frame and
+    time of every frame in positions.json.
+
+    Args:
+        args: A dict of the parsed arguments.
+        frame_nbr: An int representing the frames to read, 0 for all.
+
+    Returns:
+        None
+    """
+    out_loc = os.path.join(args['local'], '')
+    os.makedirs(out_loc, exist_ok=True)
+    source = open_input(args, frame_nbr)
+    store = ResultStore(out_loc + "detections.bin",
+                        out_loc + "detections.json")
+    sinks = [JpegSink(out_loc)] if args['annotate'] else []
+    pipeline = DetectionPipeline(workers=args['workers'],
+                                 maxsize=2 * args['workers'],
+                                 process=functools.partial(detect_buffer,
+                                                           sinks=sinks),
+                                 store=store)
+    print("\n **** DETECTING %s (%d THREADS) ****" %
+          (args['input'], args['workers']))
+    for frame, sample in enumerate(source.samples()):
+        pipeline.submit(frame, (frame, sample))
+    pipeline.close()
+    store.close()
+    with open(out_loc + "positions.json", 'w') as filedesc:
+        json.dump([{'frame': frame, 'source_frame': index,
+                    'seconds': round(seconds, 3)}
+                   for frame, (index, seconds)
+                   in enumerate(source.positions)], filedesc, indent=1)
+    print(" %d frames detected, %d faces stored in %s." %
+          (store.frames, store.rows, store.path))
+
 
 if __name__ == '__main__':
     main()
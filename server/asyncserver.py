@@ -0,0 +1,332 @@
+"""
+Module supporting the FaceDetectServer class, a long running server able to
+handle many concurrent client sessions.
+
+class Session: Holds the state of one client session.
+
+class FaceDetectServer: Accept sessions on the server socket and run the
+face detection on every received frame.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import itertools
+import os
+import time
+
+import common.metrics as mt
+import common.wireformat as wf
+import server.connectionhandler as ch
+from engine.results import ResultStore
+from engine.sinks import JpegSink, LiveSink, VideoSink
+from server.pipeline import detect_buffer, detect_encoded
+
+
+class Session:
+    """Holds the state of one client session.
+
+    Attributes:
+        session_id: An int identifying the session on the server.
+        addr: A tuple representing the client address.
+        img_loc: A string representing where the session frames are saved.
+        frame_nbr: An int representing the number of frames announced, 0
+        for a streaming session.
+        received: An int representing the number of frames received.
+        processed: An int representing the number of frames processed.
+        received_bytes: An int representing the payload bytes received.
+        faces: A dict mapping frame numbers to the faces found.
+        store: An engine.results.ResultStore keeping the faces found in the
+        session folder, None when frames are not saved.
+        sinks: A list of the sinks annotated frames are written to.
+        start: A float representing the session start time.
+    """
+
+    def __init__(self, session_id, addr, img_loc):
+        """Init Session with its id, client address and frame location."""
+        self.session_id = session_id
+        self.addr = addr
+        self.img_loc = img_loc
+        self.frame_nbr = 0
+        self.received = 0
+        self.processed = 0
+        self.received_bytes = 0
+        self.faces = {}
+        self.store = None
+        self.sinks = []
+        self.start = time.monotonic()
+
+    def elapsed(self):
+        """Return the time in seconds since the session started.
+
+        Args:
+            None
+
+        Returns:
+            A float representing the session duration so far.
+        """
+        return time.monotonic() - self.start
+
+
+class FaceDetectServer:
+    """Long running server handling many concurrent client sessions.
+
+    Each connection gets its own Session and a bounded queue between the
+    socket reader and the detection. When detection falls behind, the queue
+    fills up, the reader stops reading and acking, and the client window
+    closes: backpressure is applied per connection without affecting the
+    other sessions. Detection runs in a shared thread pool since OpenCV
+    releases the GIL.
+
+    Attributes:
+        img_loc: A string representing the root folder for session frames.
+        address: A string representing the IP address to bind to.
+        port: An int representing the port to bind to.
+        max_pending: An int representing the number of received frames a
+        session may queue before reading from its socket is paused.
+        detect: A boolean, False to only receive, save and ack frames.
+        save: A boolean, False to keep frames in memory only.
+        cache: An engine.detectcache.DetectionCache shared by every
+        session, None to detect every frame.
+        video: A boolean, True to save every session as one indexed MJPEG
+        video, session.avi, instead of one JPEG file per frame.
+        live: A server.livestream.LiveStream every session publishes its
+        annotated frames on, as channel sessionN, removed when the session
+        ends, None to disable.
+        sessions: A dict of the active sessions by session id.
+        completed: A deque of the last keep_completed finished sessions.
+        served: An int counting the finished sessions.
+        failed: An int counting the frames whose processing failed.
+    """
+
+    def __init__(self, img_loc, address=None, port=5000, max_pending=8,
+                 workers=None, detect=True, save=True, cache=None,
+                 video=False, live=None, keep_completed=100):
+        """Init FaceDetectServer with its folder, binding and limits."""
+        self.img_loc = img_loc
+        self.address = address
+        self.port = port
+        self.max_pending = max_pending
+        self.detect = detect
+        self.save = save
+        self.cache = cache
+        self.video = video
+        self.live = live
+        self.sessions = {}
+        self.completed = collections.deque(maxlen=keep_completed)
+        self.served = 0
+        self.failed = 0
+        self._ids = itertools.count()
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self._server = None
+
+    async def start(self):
+        """Bind the server socket and start accepting sessions.
+
+        Args:
+            None
+
+        Returns:
+            The (address, port) tuple the server is listening on.
+        """
+        server_socket = ch.init_server_socket(self.address, self.port)
+        self._server = await asyncio.start_server(self.handle_client,
+                                                  sock=server_socket)
+        return server_socket.getsockname()
+
+    async def serve_forever(self):
+        """Start the server and accept sessions until cancelled.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self):
+        """Stop accepting sessions and release the worker threads.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._server is not None:
+            self._server.close()
+        self._executor.shutdown(wait=False)
+
+    async def handle_client(self, reader, writer):
+        """Receive, ack and process the frames of one session.
+
+        Args:
+            reader: An asyncio.StreamReader on the client connection.
+            writer: An asyncio.StreamWriter on the client connection.
+
+        Returns:
+            None
+        """
+        session_id = next(self._ids)
+        session = Session(session_id, writer.get_extra_info('peername'),
+                          os.path.join(self.img_loc,
+                                       "session%d/" % session_id))
+        if self.save:
+            os.makedirs(session.img_loc, exist_ok=True)
+            if self.detect:
+                session.store = ResultStore(
+                    os.path.join(session.img_loc, "detections.bin"),
+                    os.path.join(session.img_loc, "detections.json"))
+                if self.video:
+                    session.sinks = [VideoSink(
+                        os.path.join(session.img_loc, "session.avi"))]
+                else:
+                    session.sinks = [JpegSink(session.img_loc)]
+        if self.detect and self.live is not None:
+            session.sinks.append(LiveSink(self.live,
+                                          "session%d" % session_id))
+        self.sessions[session_id] = session
+        print("Session %d: connection from %s" % (session_id, session.addr))
+
+        queue = asyncio.Queue(self.max_pending)
+        worker = asyncio.ensure_future(self._process_frames(session, queue))
+        try:
+            msg_type, _, session.frame_nbr, _ = await _read_message(reader)
+            if msg_type != wf.MSG_HELLO:
+                raise wf.ProtocolError("Session must start with a hello.")
+            while (session.frame_nbr == 0 or
+                   session.received < session.frame_nbr):
+                start = time.perf_counter()
+                msg_type, flags, frame, payload = await _read_message(reader)
+                mt.registry().observe('receive',
+                                      time.perf_counter() - start,
+                                      "session%d" % session_id)
+                if msg_type == wf.MSG_END:
+                    break
+                if msg_type == wf.MSG_SAME:
+                    payload = wf.SameFrame(wf.SAME_REF.unpack(payload)[0])
+                elif msg_type != wf.MSG_FRAME:
+                    raise wf.ProtocolError("Expected a frame message.")
+                else:
+                    session.received_bytes += len(payload)
+                    if flags:
+                        payload = wf.EncodedFrame(payload, flags)
+                await queue.put((frame, payload))
+                session.received += 1
+                writer.write(wf.pack_header(wf.MSG_ACK, frame))
+                await writer.drain()
+            await queue.put(None)
+            await worker
+        except (ConnectionError, asyncio.IncompleteReadError,
+                wf.ProtocolError) as err:
+            print("Session %d: aborted, %s" % (session_id, err))
+            worker.cancel()
+        except Exception as err:
+            print("Session %d: failed, %r" % (session_id, err))
+            worker.cancel()
+        finally:
+            writer.close()
+            try:
+                if session.store is not None:
+                    session.store.close()
+                for sink in session.sinks:
+                    try:
+                        sink.close()
+                    except Exception as err:
+                        print("Session %d: closing %s failed, %r" %
+                              (session_id, type(sink).__name__, err))
+                if self.detect and self.live is not None:
+                    self.live.remove("session%d" % session_id)
+                mt.registry().forget("session%d" % session_id)
+            finally:
+                del self.sessions[session_id]
+                self.completed.append(session)
+                self.served += 1
+        print("Session %d: %d frames in %.2fs" %
+              (session_id, session.processed, session.elapsed()))
+
+    async def _process_frames(self, session, queue):
+        """Consume the session queue and process frames in order.
+
+        Frames skipped by the client as unchanged reuse the result of the
+        frame they refer to, which was queued, hence processed, before. A
+        frame whose processing fails, a corrupt one for instance, is logged
+        and recorded without faces, and the session goes on.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            frame, payload = item
+            if isinstance(payload, wf.SameFrame):
+                session.faces[frame] = session.faces.get(payload.ref)
+                try:
+                    self._reuse_frame(session, frame, payload.ref)
+                except Exception as err:
+                    print("Session %d: frame %d failed, %r" %
+                          (session.session_id, frame, err))
+                    self.failed += 1
+            else:
+                try:
+                    session.faces[frame] = await loop.run_in_executor(
+                        self._executor, self.process_frame, session, frame,
+                        payload)
+                except Exception as err:
+                    print("Session %d: frame %d failed, %r" %
+                          (session.session_id, frame, err))
+                    session.faces[frame] = None
+                    self.failed += 1
+            if session.store is not None:
+                session.store.add(frame, session.faces[frame])
+            session.processed += 1
+
+    def _reuse_frame(self, session, frame, ref):
+        """Save frame skipped as unchanged as the saved result of ref."""
+        if self.save and self.video and self.detect:
+            session.sinks[0].alias(frame, ref)
+        elif self.save:
+            ch.link_frame(frame, ref, session.img_loc)
+
+    def process_frame(self, session, frame, payload):
+        """Run the face detection on one frame and save the result.
+
+        The frame is decoded in memory, the annotated image is the only
+        file written, and only when save is set.
+
+        Args:
+            session: The Session the frame belongs to.
+            frame: An int representing the frame number.
+            payload: A bytes object holding the encoded frame, or a
+            common.wireformat.EncodedFrame wrapping it.
+
+        Returns:
+            The faces found, in captured frame coordinates, or None when
+            detection is disabled.
+        """
+        mt.registry().session("session%d" % session.session_id)
+        if not self.detect:
+            if self.save:
+                if isinstance(payload, wf.EncodedFrame):
+                    payload = payload.payload
+                ch.write_frame(payload, frame, session.img_loc)
+            return None
+        item = (frame, payload)
+        if isinstance(payload, wf.EncodedFrame):
+            item = wf.EncodedFrame((frame, payload.payload), payload.flags)
+        return detect_encoded(functools.partial(detect_buffer,
+                                                sinks=session.sinks,
+                                                cache=self.cache), item)
+
+
+async def _read_message(reader):
+    """Read one wire format message from an asyncio stream."""
+    header = await reader.readexactly(wf.HEADER_LEN)
+    msg_type, flags, frame_id, length = wf.unpack_header(header)
+    payload = await reader.readexactly(length)
+    return (msg_type, flags, frame_id, payload)
@@ -13,12 +13,29 @@ function receive_frame: Receive and save one frame.
 
 function send_frame_ack: Send one ack to client for a specific frame.
 
+function receive_session_header: Receive the binary session header.
+
+function receive_frame_message: Receive one binary frame message.
+
+function receive_frames: Receive the binary frame messages of a session.
+
+function write_frame: Save one received frame payload.
+
+function link_frame: Reuse the saved result of an earlier frame.
+
+function send_cumulative_ack: Send one binary cumulative ack to client.
+
 class ConnectionHandler: Create a server instance with a frame and a socket.
 Useful for receiving only one frame on one socket.
 """
 
 import socket
 import os
+import shutil
+
+import common.metrics as mt
+import common.transfer as tr
+import common.wireformat as wf
 
 
 def init_flask_environ_folder(img_loc=None, json_loc=None):
@@ -57,6 +74,7 @@ def init_server_socket(address=None, port=5000):
         A server socket where the program can receive messages.
     """
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     if address is None:
         address = socket.gethostbyname(socket.gethostname())
     server_socket.bind((address, port))
@@ -77,7 +95,7 @@ def receive_bytes_to_string(client_sock):
     str_msg = byte_msg.decode('utf-8').replace("\n", "")
     return str_msg
 
-def receive_frame(client_sock, frame, frame_size, img_loc):
+def receive_frame(client_sock, frame, frame_size, img_loc, buf=None):
     """Receive and save one frame.
 
     Main function responsible for storing and saving exactly one frame from
@@ -91,21 +109,14 @@ def receive_frame(client_sock, frame, frame_size, img_loc):
         frame_size: An int representing the frame size to expect.
         img_loc: A string representing the destination where to save the
         frame
+        buf: Optional bytearray to receive into, reused across frames when
+        provided, see common.transfer.new_buffer.
 
     Returns:
         None
     """
-    img_size = 0
     filename = img_loc + "frame" + str(frame) + ".jpg"
-    with open(filename, 'wb') as img:
-        while img_size < frame_size:
-            remain = frame_size - img_size
-            if remain < 1024:
-                data = client_sock.recv(remain)
-            else:
-                data = client_sock.recv(1024)
-            img.write(data)
-            img_size += len(data)
+    tr.recv_file(client_sock, filename, frame_size, buf)
 
 def send_frame_ack(client_sock, frame):
     """Send ACK for the frame to the client.
@@ -122,6 +133,125 @@ def send_frame_ack(client_sock, frame):
     """
     client_sock.send(("OK FRAME " + str(frame)).encode('ascii'))
 
+def receive_session_header(reader):
+    """Receive the binary session header sent by the client.
+
+    Args:
+        reader: A common.wireformat.MessageReader on the client socket.
+
+    Returns:
+        An int representing the number of frames the client will send.
+    """
+    return reader.read(wf.MSG_HELLO).frame_id
+
+def receive_frame_message(reader):
+    """Receive one binary frame message.
+
+    The payload is a view on the reader buffer and is only valid until the
+    next message is read.
+
+    Args:
+        reader: A common.wireformat.MessageReader on the client socket.
+
+    Returns:
+        (frame, payload): A tuple with the int frame number and a
+        memoryview on the frame bytes.
+    """
+    msg = reader.read(wf.MSG_FRAME)
+    return (msg.frame_id, msg.payload)
+
+def receive_frames(reader, frame_nbr=0, into=None):
+    """Receive the binary frame messages of a session.
+
+    Args:
+        reader: A common.wireformat.MessageReader on the client socket.
+        frame_nbr: Optional int representing the number of frames announced
+        by the session header, 0 for a streaming session closed by the
+        client with an end message.
+        into: Optional callable receiving frame payloads in place, see
+        common.wireformat.MessageReader.read.
+
+    Returns:
+        A generator of (frame, payload) tuples, see receive_frame_message.
+        For frames the client skipped as unchanged, payload is a
+        common.wireformat.SameFrame holding the frame to reuse. Frames sent
+        with encoding flags come as a common.wireformat.EncodedFrame.
+    """
+    received = 0
+    while frame_nbr == 0 or received < frame_nbr:
+        with mt.timer('receive'):
+            msg = reader.read(into=into)
+        if msg.msg_type == wf.MSG_END:
+            return
+        if msg.msg_type == wf.MSG_SAME:
+            payload = wf.SameFrame(wf.SAME_REF.unpack(msg.payload)[0])
+        elif msg.msg_type == wf.MSG_FRAME:
+            payload = msg.payload
+            if msg.flags:
+                payload = wf.EncodedFrame(payload, msg.flags)
+        else:
+            raise wf.ProtocolError("Expected a frame message.")
+        received += 1
+        yield (msg.frame_id, payload)
+
+def write_frame(payload, frame, img_loc):
+    """Save one received frame payload.
+
+    Args:
+        payload: A bytes-like object holding the encoded frame.
+        frame: An int representing the frame number.
+        img_loc: A string representing the destination where to save the
+        frame.
+
+    Returns:
+        A string representing the saved frame location.
+    """
+    filename = img_loc + "frame" + str(frame) + ".jpg"
+    with open(filename, 'wb') as img:
+        img.write(payload)
+    return filename
+
+def link_frame(frame, ref, img_loc):
+    """Reuse the saved result of frame ref for frame.
+
+    Used for frames the client skipped as unchanged: frame is saved as a
+    hard link to ref when possible, a copy otherwise. Nothing is saved
+    when ref was not, for instance because it could not be decoded.
+
+    Args:
+        frame: An int representing the skipped frame number.
+        ref: An int representing the frame number to reuse.
+        img_loc: A string representing where frames are saved.
+
+    Returns:
+        A boolean, False when ref was not saved.
+    """
+    src = img_loc + "frame" + str(ref) + ".jpg"
+    dst = img_loc + "frame" + str(frame) + ".jpg"
+    if not os.path.exists(src):
+        return False
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+    return True
+
+def send_cumulative_ack(client_sock, frame):
+    """Send a binary cumulative ACK to the client.
+
+    The ack covers every frame up to and including frame.
+
+    Args:
+        client_sock: A socket instance representing the client connection.
+        frame: An int representing the highest frame received.
+
+    Returns:
+        None
+    """
+    wf.send_message(client_sock, wf.MSG_ACK, frame)
+
 
 class ConnectionHandler:
     """Handles and manage incoming connections for one frame and one socket.
@@ -245,12 +375,7 @@ class ConnectionHandler:
         client, addr = server_socket.accept()
         print("Incoming connection from " + str(addr))
 
-        with open(self.filename, 'wb') as img:
-            while True:
-                data = client.recv(1024)
-                if not data:
-                    break
-                img.write(data)
+        tr.recv_file(client, self.filename)
 
         print("Transfer Completed.")
         print("Closing " + str(addr))
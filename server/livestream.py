@@ -0,0 +1,213 @@
+"""
+Module supporting the LiveStream class, a small HTTP server streaming the
+annotated frames as MJPEG while the session is still running.
+
+class LiveStream: Serve the latest annotated frame of every channel as a
+multipart/x-mixed-replace MJPEG stream.
+"""
+
+import http.server
+import threading
+
+BOUNDARY = b'frame'
+PAGE = (b'<html><head><title>AWS FaceDetect</title></head><body>%s'
+        b'</body></html>')
+
+
+class LiveStream:
+    """Streams annotated frames to browsers as soon as they are detected.
+
+    Detection threads publish encoded JPEG frames on named channels, for
+    instance through an engine.sinks.LiveSink, and every browser connected
+    to /<channel>.mjpg gets them as a multipart/x-mixed-replace stream,
+    which browsers display as live video in a plain img tag. Only the
+    latest frame of a channel is kept: a slow viewer skips frames instead
+    of delaying the others or the detection. / lists the channels. The
+    HTTP server runs in its own threads, one per viewer.
+
+    Attributes:
+        address: A string representing the IP address to bind to, all
+        interfaces by default.
+        port: An int representing the port to bind to.
+        frames: An int counting the frames published.
+    """
+
+    def __init__(self, address='', port=8081):
+        """Init LiveStream with its binding, start serves it."""
+        self.address = address
+        self.port = port
+        self.frames = 0
+        self._latest = {}
+        self._seq = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._server = None
+
+    def start(self):
+        """Bind the HTTP server and serve viewers in a background thread.
+
+        Args:
+            None
+
+        Returns:
+            The (address, port) tuple the stream is served on.
+        """
+        handler = type('Handler', (_MjpegHandler,), {'stream': self})
+        self._server = http.server.ThreadingHTTPServer(
+            (self.address, self.port), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+        return self._server.server_address
+
+    def publish(self, channel, frame, jpeg):
+        """Make a JPEG frame the latest one of a channel.
+
+        Frames older than the current one, as detection workers may finish
+        out of order, are ignored.
+
+        Args:
+            channel: A string representing the channel name.
+            frame: An int representing the frame number.
+            jpeg: A bytes object holding the JPEG encoded frame.
+
+        Returns:
+            None
+        """
+        with self._cond:
+            current = self._latest.get(channel)
+            if current is not None and frame < current[1]:
+                return
+            self._seq += 1
+            self._latest[channel] = (self._seq, frame, jpeg)
+            self.frames += 1
+            self._cond.notify_all()
+
+    def remove(self, channel):
+        """Forget a channel and its latest frame, ending its viewers.
+
+        Args:
+            channel: A string representing the channel name.
+
+        Returns:
+            None
+        """
+        with self._cond:
+            self._latest.pop(channel, None)
+            self._cond.notify_all()
+
+    def channels(self):
+        """Return the names of the channels published so far.
+
+        Args:
+            None
+
+        Returns:
+            A sorted list of strings.
+        """
+        with self._cond:
+            return sorted(self._latest)
+
+    def wait(self, channel, seq, timeout=1.0):
+        """Wait for a frame of channel newer than seq.
+
+        Args:
+            channel: A string representing the channel name.
+            seq: An int, the sequence number of the last frame seen, 0 for
+            none.
+            timeout: An optional float representing the seconds to wait.
+
+        Returns:
+            A (seq, frame, jpeg) tuple, None on timeout, once closed or
+            once the channel was removed.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._closed or
+                self._latest.get(channel, (0,))[0] > seq, timeout)
+            entry = self._latest.get(channel)
+            if self._closed or entry is None or entry[0] <= seq:
+                return None
+            return entry
+
+    def close(self):
+        """Disconnect the viewers and stop the HTTP server.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def closed(self):
+        """Tell whether close was called.
+
+        Args:
+            None
+
+        Returns:
+            A boolean.
+        """
+        return self._closed
+
+
+class _MjpegHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the channel list and the MJPEG streams of a LiveStream."""
+
+    stream = None
+
+    def do_GET(self):
+        """Route / to the channel list and /<channel>.mjpg to a stream."""
+        if self.path == '/':
+            links = b''.join(b'<h3>%s</h3><img src="/%s.mjpg"><br>' %
+                             (name.encode(), name.encode())
+                             for name in self.stream.channels())
+            self._send(200, 'text/html', PAGE % (links or b'No frames yet.'))
+        elif self.path.endswith('.mjpg'):
+            self._stream(self.path[1:-len('.mjpg')])
+        else:
+            self._send(404, 'text/plain', b'Not found.')
+
+    def log_message(self, *args):
+        """Do not log every request on the server output."""
+
+    def _send(self, code, content_type, body):
+        """Send a complete response."""
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, channel):
+        """Send the channel frames until the viewer or the stream leaves."""
+        self.send_response(200)
+        self.send_header('Cache-Control', 'no-cache, private')
+        self.send_header('Content-Type',
+                         'multipart/x-mixed-replace; boundary=' +
+                         BOUNDARY.decode())
+        self.end_headers()
+        seq = 0
+        try:
+            while not self.stream.closed():
+                entry = self.stream.wait(channel, seq)
+                if entry is None:
+                    if seq and channel not in self.stream.channels():
+                        break
+                    continue
+                seq, _, jpeg = entry
+                self.wfile.write(b'--%s\r\nContent-Type: image/jpeg\r\n'
+                                 b'Content-Length: %d\r\n\r\n' %
+                                 (BOUNDARY, len(jpeg)))
+                self.wfile.write(jpeg)
+                self.wfile.write(b'\r\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
@@ -0,0 +1,377 @@
+"""
+Module supporting the DetectionPipeline class, which runs the face detection
+while frames are still being received.
+
+function detect_and_save: Run the detection on one saved frame and overwrite
+it with the annotated result.
+
+function detect_buffer: Run the detection on one in-memory encoded frame and
+hand the annotated result to output sinks.
+
+function detect_encoded: Run the detection on a frame the client may have
+downscaled and return faces in captured frame coordinates.
+
+function to_original: Map faces found on a downscaled frame back to the
+captured frame.
+
+class DetectionPipeline: Bounded producer/consumer queue between the frame
+receiver and detection worker threads.
+
+class DeadlineScheduler: DetectionPipeline variant dropping or downgrading
+frames that waited too long, to stay real-time under overload.
+"""
+
+import collections
+import queue
+import threading
+import time
+
+import numpy as np
+
+import common.metrics as mt
+import common.wireformat as wf
+from engine.facedetect import FaceDetect
+
+
+def detect_and_save(frame_name, detector=None, reduce=1, refine=False,
+                    tile=0, cache=None):
+    """Run the detection on one saved frame and save the annotated result.
+
+    Args:
+        frame_name: A string representing the frame location.
+        detector: An optional stateful detector, such as an
+        engine.tracker.TrackingDetector, used instead of FaceDetect.detect.
+        reduce: An optional int, detection runs on the frame decoded at
+        1/reduce of its size, and so is the annotated result saved.
+        refine: An optional boolean, refine faces found at a reduced size on
+        the full resolution frame. Ignored with a detector.
+        tile: An optional int, when set, large frames are searched by tiles
+        of this side in parallel, see FaceDetect.detect_tiled. Ignored with
+        a detector.
+        cache: An optional engine.detectcache.DetectionCache, identical
+        frames reuse the faces found before. Ignored with a detector.
+
+    Returns:
+        The faces found on the frame, in full resolution coordinates.
+    """
+    with mt.timer('decode'):
+        detection = FaceDetect(frame_name, reduce)
+    with mt.timer('detect'):
+        faces = _cached_detect(detection, frame_name, cache, detector,
+                               refine, tile)
+    with mt.timer('draw'):
+        detection.image = detection.drawrectangle(faces)
+    with mt.timer('save'):
+        detection.saveimage(frame_name)
+    return faces
+
+def detect_buffer(item, sinks=(), detector=None, reduce=1, refine=False,
+                  tile=0, cache=None):
+    """Run the detection on one in-memory encoded frame.
+
+    The frame is decoded straight from the received bytes and the annotated
+    image is handed to the sinks, so nothing is written to disk unless a
+    sink does it.
+
+    Args:
+        item: A (frame, buf) tuple, frame being the int frame number and buf
+        a bytes-like object holding the encoded frame, or a numpy array
+        holding an already decoded one.
+        sinks: An optional list of sinks, see engine.sinks.
+        detector: An optional stateful detector, see detect_and_save.
+        reduce: An optional int, see detect_and_save.
+        refine: An optional boolean, see detect_and_save.
+        tile: An optional int, see detect_and_save.
+        cache: An optional DetectionCache, see detect_and_save.
+
+    Returns:
+        The faces found on the frame, in full resolution coordinates.
+    """
+    frame, buf = item
+    with mt.timer('decode'):
+        detection = FaceDetect(buf, reduce)
+    with mt.timer('detect'):
+        faces = _cached_detect(detection, buf, cache, detector, refine, tile)
+    with mt.timer('draw'):
+        detection.image = detection.drawrectangle(faces)
+    if detection.isvalid() and sinks:
+        with mt.timer('save'):
+            for sink in sinks:
+                sink.write(frame, detection.image)
+    return faces
+
+def detect_encoded(process, item):
+    """Run the detection on a frame the client may have downscaled.
+
+    Args:
+        process: A callable taking an item, such as a detect_buffer or
+        detect_and_save partial.
+        item: The item for process, or a common.wireformat.EncodedFrame
+        wrapping it with the header flags the frame was received with.
+
+    Returns:
+        The faces returned by process, in captured frame coordinates.
+    """
+    if not isinstance(item, wf.EncodedFrame):
+        return process(item)
+    return to_original(process(item.payload),
+                       wf.unpack_encoding(item.flags))
+
+def to_original(faces, encoding):
+    """Map faces found on a downscaled frame back to the captured frame.
+
+    Args:
+        faces: An array list of (x, y, w, h) boxes, None for an invalid
+        frame.
+        encoding: A common.wireformat.Encoding the frame was sent with.
+
+    Returns:
+        The faces in captured frame coordinates.
+    """
+    if faces is None or encoding.scale == 100:
+        return faces
+    boxes = np.array(faces, dtype=np.float64).reshape(-1, 4)
+    return (boxes * 100.0 / encoding.scale).round().astype(np.int32)
+
+def _detect(detection, detector, refine=False, tile=0):
+    """Run detector on the FaceDetect image, or FaceDetect.detect if None."""
+    if detector is None or not detection.isvalid():
+        if tile:
+            return detection.detect_tiled(tile)
+        return detection.detect(refine=refine)
+    return detection.tofullres(detector.detect(detection.image))
+
+def _cached_detect(detection, source, cache, detector, refine, tile):
+    """Run _detect through cache, keyed by the encoded source content."""
+    if cache is None or detector is not None:
+        return _detect(detection, detector, refine, tile)
+    if isinstance(source, str):
+        with open(source, 'rb') as filedesc:
+            source = filedesc.read()
+    key = cache.key(source, reduce=detection.reduce, refine=refine,
+                    tile=tile)
+    faces = cache.get(key)
+    if faces is None:
+        faces = _detect(detection, detector, refine, tile)
+        cache.put(key, faces)
+    return faces
+
+
+class DetectionPipeline:
+    """Runs detection on frames as soon as they are received.
+
+    The receiver submits every complete frame to a bounded queue and
+    detection worker threads consume it concurrently. When the workers fall
+    behind, submit blocks, which in turn stops the receiver from reading and
+    acking, so the client is slowed down instead of the server buffering
+    the whole session. OpenCV releases the GIL during detection, hence
+    threads are enough to use several cores. A frame whose processing
+    raises is logged and recorded with a None result, the worker goes on
+    with the next frame.
+
+    Attributes:
+        workers: An int representing the number of detection threads.
+        maxsize: An int representing the number of frames that may wait
+        for a worker.
+        process: A callable taking the submitted item and returning the
+        detection result.
+        store: An optional engine.results.ResultStore every result is added
+        to as soon as it is available.
+        results: A dict mapping frame numbers to detection results.
+        first_result: A float representing the delay in seconds between
+        start and the first result, None until a result is available.
+        failed: An int counting the frames whose processing raised.
+    """
+
+    def __init__(self, workers=2, maxsize=8, process=detect_and_save,
+                 store=None):
+        """Init DetectionPipeline and start its worker threads."""
+        self.workers = workers
+        self.maxsize = maxsize
+        self.process = process
+        self.store = store
+        self.results = {}
+        self.first_result = None
+        self.failed = 0
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._threads = [threading.Thread(target=self._work, daemon=True)
+                         for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, frame, item):
+        """Queue one received frame for detection.
+
+        Blocks while the queue is full.
+
+        Args:
+            frame: An int representing the frame number.
+            item: The argument passed to process, typically the frame
+            location.
+
+        Returns:
+            None
+        """
+        self._queue.put((frame, item))
+
+    def close(self):
+        """Wait for every queued frame to be processed and stop the workers.
+
+        Args:
+            None
+
+        Returns:
+            A dict mapping frame numbers to detection results.
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        return self.results
+
+    def _work(self):
+        """Worker loop, process queued frames until a None is received."""
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            frame, item = entry
+            self._run(frame, self.process, item)
+
+    def _run(self, frame, process, item):
+        """Process one frame and record its result, None if it failed."""
+        try:
+            result = process(item)
+        except Exception as err:
+            print("Frame %d failed: %r" % (frame, err))
+            self._fail(frame, err)
+            result = None
+        self._record(frame, result)
+
+    def _fail(self, frame, err):
+        """Account a frame whose processing raised err."""
+        with self._lock:
+            self.failed += 1
+
+    def _record(self, frame, result):
+        """Store the result of one frame."""
+        if self.store is not None:
+            self.store.add(frame, result)
+        with self._lock:
+            self.results[frame] = result
+            if self.first_result is None:
+                self.first_result = time.monotonic() - self._start
+
+
+class DeadlineScheduler(DetectionPipeline):
+    """Runs detection on received frames without ever falling behind.
+
+    Unlike DetectionPipeline, submit never blocks: when maxsize frames are
+    already waiting, the oldest one is dropped, the latest frame wins.
+    Every frame gets a deadline when submitted. A worker picking a frame
+    that waited longer than downgrade_age runs the cheaper fallback
+    instead of process, and a frame that waited longer than max_age is
+    skipped altogether. Under overload results therefore stay recent
+    instead of drifting further behind the client. What happened to every
+    frame, and why, is recorded in decisions.
+
+    Attributes:
+        max_age: A float representing the seconds after which a waiting
+        frame is skipped, None to never skip on age.
+        downgrade_age: A float representing the seconds after which a
+        waiting frame is processed by fallback, None to never downgrade.
+        fallback: A callable like process, cheaper, e.g. detecting on a
+        reduced size frame. Required with downgrade_age.
+        decisions: A dict mapping frame numbers to (action, reason) tuples,
+        action being 'detected', 'downgraded', 'skipped' or 'error', the
+        latter when processing raised.
+        skipped: An int counting the skipped frames.
+        downgraded: An int counting the downgraded frames.
+    """
+
+    def __init__(self, workers=2, maxsize=8, process=detect_and_save,
+                 store=None, max_age=None, downgrade_age=None,
+                 fallback=None):
+        """Init DeadlineScheduler and start its worker threads."""
+        if downgrade_age is not None and fallback is None:
+            raise ValueError("downgrade_age needs a fallback.")
+        self.max_age = max_age
+        self.downgrade_age = downgrade_age
+        self.fallback = fallback
+        self.decisions = {}
+        self.skipped = 0
+        self.downgraded = 0
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._closing = False
+        super().__init__(workers, maxsize, process, store)
+
+    def submit(self, frame, item):
+        """Queue one received frame for detection, never blocks.
+
+        Args:
+            frame: An int representing the frame number.
+            item: The argument passed to process.
+
+        Returns:
+            None
+        """
+        with self._cond:
+            self._pending.append((frame, item, time.monotonic()))
+            if len(self._pending) > self.maxsize:
+                old = self._pending.popleft()[0]
+                self._skip(old, "superseded by frame %d" % frame)
+            self._cond.notify()
+
+    def close(self):
+        """Process or skip every waiting frame and stop the workers.
+
+        Args:
+            None
+
+        Returns:
+            A dict mapping frame numbers to detection results.
+        """
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        return self.results
+
+    def _work(self):
+        """Worker loop, take the oldest waiting frame and honour its age."""
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closing)
+                if not self._pending:
+                    return
+                frame, item, arrival = self._pending.popleft()
+                age = time.monotonic() - arrival
+                if self.max_age is not None and age > self.max_age:
+                    self._skip(frame, "waited %.3fs > %.3fs" %
+                               (age, self.max_age))
+                    continue
+                process = self.process
+                if self.downgrade_age is not None and age > self.downgrade_age:
+                    process = self.fallback
+                    self.downgraded += 1
+                    self.decisions[frame] = ('downgraded', "waited %.3fs > "
+                                             "%.3fs" % (age,
+                                                        self.downgrade_age))
+                else:
+                    self.decisions[frame] = ('detected', "waited %.3fs" % age)
+            self._run(frame, process, item)
+
+    def _fail(self, frame, err):
+        """Account a failed frame and record why in decisions."""
+        super()._fail(frame, err)
+        with self._cond:
+            self.decisions[frame] = ('error', repr(err))
+
+    def _skip(self, frame, reason):
+        """Record a skipped frame, called with the condition held."""
+        self.skipped += 1
+        self.decisions[frame] = ('skipped', reason)